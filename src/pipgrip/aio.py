@@ -0,0 +1,511 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Discovery on an asyncio event loop, with a synchronous facade for the solver.
+
+Python 3 only, so this module is imported lazily.
+"""
+import asyncio
+import io
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile
+
+from pipgrip.cache import DEFAULT_CACHE_TTL
+from pipgrip.compat import PIP_VERSION
+from pipgrip.package_source import PackageSource
+from pipgrip.pip_worker import PIP_WORKER_MAX_JOBS, PipWorkerError, _get_environment
+from pipgrip.pipper import (
+    REPORT_FAILURE_STR,
+    _get_available_versions_from_index,
+    _get_discovery_result,
+    _get_index_metadata,
+    _get_known_available_versions,
+    _get_pip_metadata,
+    _get_report_args,
+    _get_versions_probe_args,
+    _index_governor,
+    _parse_versions_probe,
+    _set_available_versions,
+    _subprocess_governor,
+    parse_req,
+)
+
+logger = logging.getLogger(__name__)
+
+# pip worker responses contain the full pip output on a single line
+_STREAM_LIMIT = 2**24
+
+
+def _get_pip_env():
+    env = os.environ.copy()
+    # Enable Python's UTF-8 mode.
+    env["PYTHONUTF8"] = "1"
+    return env
+
+
+class _AsyncPipWorker(object):
+    def __init__(self, process, environment):
+        self.process = process
+        self.environment = environment
+        self.jobs = 0
+
+    @classmethod
+    async def start(cls):
+        environment = _get_environment()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "pipgrip.pip_worker",
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=_get_pip_env(),
+            limit=_STREAM_LIMIT,
+        )
+        worker = cls(process, environment)
+        response = await worker._read()
+        if not response.get("ready"):
+            await worker.close()
+            raise PipWorkerError(
+                "Failed to start pip worker: {}".format(response.get("error"))
+            )
+        return worker
+
+    async def _read(self):
+        line = await self.process.stdout.readline()
+        if not line:
+            raise PipWorkerError("pip worker exited unexpectedly")
+        return json.loads(line.decode("utf-8"))
+
+    async def run(self, args):
+        self.jobs += 1
+        request = json.dumps({"args": args}) + "\n"
+        self.process.stdin.write(request.encode("utf-8"))
+        await self.process.stdin.drain()
+        response = await self._read()
+        return response["returncode"], response["output"] + response["console"]
+
+    async def close(self):
+        self.process.stdin.close()
+        if self.process.returncode is None:
+            self.process.kill()
+        await self.process.wait()
+
+
+class AsyncPipWorkerPool(object):
+    """Run pip commands concurrently on long-lived pip processes.
+
+    The asyncio counterpart of pipgrip.pip_worker.PipWorkerPool. Commands are
+    run in a regular pip subprocess if workers can not be used. Must be created
+    on the event loop it is used on.
+
+    Args:
+        size (int): maximum amount of concurrent pip processes
+        max_jobs (int): amount of commands after which a worker is replaced
+
+    """
+
+    def __init__(self, size, max_jobs=PIP_WORKER_MAX_JOBS):
+        self.max_jobs = max_jobs
+        self._semaphore = asyncio.Semaphore(max(1, size))
+        self._idle = []
+        self._disabled = size < 1
+
+    async def run(self, args, failure_expected=False):
+        """Run pip with args.
+
+        Like pipgrip.pipper.stream_bash_command, commands hold a slot of the
+        subprocess concurrency governor, and count as failed calls when exiting
+        non-zero unless failure_expected.
+
+        Returns:
+            tuple: (returncode, combined stdout and stderr output)
+
+        """
+        async with self._semaphore:
+            acquired = asyncio.get_event_loop().run_in_executor(
+                None, _subprocess_governor.acquire
+            )
+            try:
+                await asyncio.shield(acquired)
+            except asyncio.CancelledError:
+                # give back the slot once the waiting thread got it
+                acquired.add_done_callback(
+                    lambda _: _subprocess_governor.release(0, failed=True)
+                )
+                raise
+            start = time.time()
+            returncode = None
+            try:
+                result = await self._run_on_worker(args)
+                if result is None:
+                    result = await self._run_subprocess(args)
+                returncode = result[0]
+                return result
+            finally:
+                _subprocess_governor.release(
+                    time.time() - start,
+                    returncode is None or (bool(returncode) and not failure_expected),
+                )
+
+    async def _run_on_worker(self, args):
+        if self._disabled:
+            return None
+        environment = _get_environment()
+        while self._idle and self._idle[-1].environment != environment:
+            # started with other environment variables or working directory
+            await self._idle.pop().close()
+        if self._idle:
+            worker = self._idle.pop()
+        else:
+            try:
+                worker = await _AsyncPipWorker.start()
+            except (PipWorkerError, OSError, ValueError) as exc:
+                logger.debug("Disabling pip workers: {}".format(exc))
+                self._disabled = True
+                return None
+        try:
+            result = await worker.run(args)
+        except (PipWorkerError, OSError, ValueError) as exc:
+            logger.debug(
+                "pip worker failed, falling back to subprocess: {}".format(exc)
+            )
+            await worker.close()
+            return None
+        if worker.jobs < self.max_jobs:
+            self._idle.append(worker)
+        else:
+            await worker.close()
+        return result
+
+    async def _run_subprocess(self, args):
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "pip",
+            *args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            env=_get_pip_env()
+        )
+        out, _ = await process.communicate()
+        return process.returncode, out.decode("utf-8", errors="replace")
+
+    async def close(self):
+        """Stop all idle workers."""
+        idle, self._idle = self._idle, []
+        for worker in idle:
+            await worker.close()
+
+
+class AsyncDiscovery(object):
+    """Discover packages with coroutines.
+
+    The asyncio counterpart of discover_dependencies_and_versions: pip runs on
+    an AsyncPipWorkerPool and the blocking index client on a thread pool, so
+    any amount of discoveries can be awaited at once, with the metadata and the
+    available versions of a package fetched concurrently. Each requirement is
+    discovered only once. Must be created on the event loop it is used on.
+
+    Args:
+        index_url (str): primary PyPI index url
+        extra_index_url (str): secondary PyPI index url
+        cache_dir (str): directory for storing wheels
+        no_cache_dir (bool): pip --no-cache-dir flag
+        pre (bool): pip --pre flag
+        metadata_cache (pipgrip.cache.MetadataCache): cache for index requests
+        subprocesses (int): maximum amount of concurrent pip processes
+        requests (int): maximum amount of concurrent index requests, at most (and
+            by default) the maximum of the index concurrency governor
+
+    """
+
+    def __init__(
+        self,
+        index_url,
+        extra_index_url,
+        cache_dir,
+        no_cache_dir,
+        pre,
+        metadata_cache=None,
+        subprocesses=1,
+        requests=None,
+    ):
+        self.index_url = index_url
+        self.extra_index_url = extra_index_url
+        self.cache_dir = cache_dir
+        self.no_cache_dir = no_cache_dir
+        self.pre = pre
+        self.metadata_cache = metadata_cache
+        self._pip = AsyncPipWorkerPool(subprocesses)
+        # the index client is blocking, so index requests run on a thread pool.
+        # The index calls hold a slot of the index governor, which adapts how
+        # many of them run at once, so more threads would only wait for a slot
+        max_requests = _index_governor.max_limit
+        self._executor = ThreadPoolExecutor(min(requests or max_requests, max_requests))
+        self._in_flight = {}
+        self._discovered = {}
+
+    def _share(self, key, func, *args):
+        # concurrent callers await the same task
+        task = self._in_flight.get(key)
+        if task is None:
+            task = self._in_flight[key] = asyncio.ensure_future(func(*args))
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return task
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def discover(self, package):
+        """Get information for a package, like discover_dependencies_and_versions."""
+        req = parse_req(package)
+        key = req.__str__()
+        if key not in self._discovered:
+            # failed discoveries are remembered as well, and raise again
+            self._discovered[key] = asyncio.ensure_future(self._discover(req))
+        return await self._discovered[key]
+
+    async def discover_all(self, packages):
+        """Discover packages at once, returning information or exceptions."""
+        return await asyncio.gather(
+            *[self.discover(package) for package in packages], return_exceptions=True
+        )
+
+    async def _discover(self, req):
+        logger.info("discovering %s", req)
+        if req.key == "." or req.url is not None:
+            return _get_discovery_result(req, await self.get_metadata(req), None)
+        wheel_metadata, available_versions = await asyncio.gather(
+            self.get_metadata(req), self.get_available_versions(req.name)
+        )
+        return _get_discovery_result(req, wheel_metadata, available_versions)
+
+    async def get_available_versions(self, package):
+        """Get the available versions of package."""
+        return await self._share(
+            ("versions", package), self._find_available_versions, package
+        )
+
+    async def _find_available_versions(self, package):
+        available_versions = await self._call(
+            _get_known_available_versions, package, self.pre, self.metadata_cache
+        )
+        if available_versions is not None:
+            return available_versions
+
+        logger.debug("Finding possible versions for {}".format(package))
+        all_versions = await self._call(
+            _get_available_versions_from_index,
+            package,
+            self.index_url,
+            self.extra_index_url,
+            self.metadata_cache,
+        )
+        if all_versions is None:
+            args = _get_versions_probe_args(
+                package, self.index_url, self.extra_index_url, self.pre
+            )
+            returncode, out = await self._pip.run(args[3:], failure_expected=True)
+            if not returncode:
+                logger.warning(out)
+                raise RuntimeError("Unexpected success:" + " ".join(args))
+            # expected. we forced this by using a non-existing version number.
+            all_versions = _parse_versions_probe(package, out)
+        return await self._call(
+            _set_available_versions,
+            package,
+            self.pre,
+            all_versions,
+            self.metadata_cache,
+        )
+
+    async def get_metadata(self, req):
+        """Get core metadata of the distribution pip selects for req."""
+        if req.key != "." and req.url is None:
+            wheel_metadata = await self._call(
+                _get_index_metadata,
+                req,
+                self.index_url,
+                self.extra_index_url,
+                self.pre,
+                self.metadata_cache,
+            )
+            if wheel_metadata is not None:
+                return wheel_metadata
+        if PIP_VERSION < [22, 2]:
+            # old pip fallback, building wheels
+            return await self._call(
+                _get_pip_metadata,
+                req,
+                self.index_url,
+                self.extra_index_url,
+                self.cache_dir,
+                self.pre,
+                self.no_cache_dir,
+            )
+        return await self._get_report_metadata(req)
+
+    async def _get_report_metadata(self, req):
+        logger.debug(
+            "Getting report for {} (with fallback cache_dir {})".format(
+                req, self.cache_dir
+            )
+        )
+        # Windows disallows opening fp a second time (within the pip subprocess)
+        # So close it here, and delete it manually
+        with NamedTemporaryFile(delete=False, mode="w+") as fp:
+            report_file = fp.name
+        args = _get_report_args(
+            [req.__str__()],
+            report_file,
+            index_url=self.index_url,
+            extra_index_url=self.extra_index_url,
+            pre=self.pre,
+            cache_dir=self.cache_dir,
+            no_cache_dir=self.no_cache_dir,
+        )
+        try:
+            returncode, out = await self._pip.run(args[3:])
+            if returncode:
+                logger.error(
+                    "Getting report for {} failed with output:\n{}".format(
+                        req, out.strip()
+                    )
+                )
+                raise RuntimeError("{} {}".format(REPORT_FAILURE_STR, req))
+            with io.open(report_file, "r", encoding="utf-8") as fp:
+                return json.load(fp)["install"][0]["metadata"]
+        finally:
+            os.remove(report_file)
+
+    async def close(self):
+        """Stop the pip workers and the index request threads."""
+        await self._pip.close()
+        self._executor.shutdown(wait=False)
+
+
+class AsyncPackageSource(PackageSource):
+    """PackageSource discovering packages with AsyncDiscovery.
+
+    The event loop runs in a background thread. The solver threads block on the
+    discoveries they need, while prefetch has all packages of a level in flight
+    at once, regardless of its threads argument.
+
+    Args:
+        subprocesses (int): maximum amount of concurrent pip processes
+        requests (int): maximum amount of concurrent index requests (see
+            AsyncDiscovery)
+
+    Other arguments are passed to PackageSource.
+
+    """
+
+    def __init__(
+        self,
+        cache_dir,
+        no_cache_dir,
+        index_url,
+        extra_index_url,
+        pre,
+        offline=False,
+        cache_ttl=DEFAULT_CACHE_TTL,
+        subprocesses=1,
+        requests=None,
+    ):
+        super(AsyncPackageSource, self).__init__(
+            cache_dir=cache_dir,
+            no_cache_dir=no_cache_dir,
+            index_url=index_url,
+            extra_index_url=extra_index_url,
+            pre=pre,
+            offline=offline,
+            cache_ttl=cache_ttl,
+        )
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        self.engine = self.run(self._create_engine(subprocesses, requests))
+
+    async def _create_engine(self, subprocesses, requests):
+        return AsyncDiscovery(
+            index_url=self.index_url,
+            extra_index_url=self.extra_index_url,
+            cache_dir=self.cache_dir,
+            no_cache_dir=self.no_cache_dir,
+            pre=self.pre,
+            metadata_cache=self.metadata_cache,
+            subprocesses=subprocesses,
+            requests=requests,
+        )
+
+    def run(self, coro):
+        """Run coro on the event loop, and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _fetch(self, package):
+        return self.run(self.engine.discover(package))
+
+    def _prefetch_all(self, packages, threads):
+        if not self.offline:
+            # _prefetch then adds the results, ignoring failures
+            self.run(self._discover_unknown_all(packages))
+        return [self._prefetch(package) for package in packages]
+
+    async def _discover_unknown_all(self, packages):
+        await asyncio.gather(
+            *[self._discover_unknown(package) for package in packages],
+            return_exceptions=True
+        )
+
+    async def _discover_unknown(self, package):
+        # the metadata cache may still ask the index for the best version, so
+        # this runs in the executor along with the discoveries
+        req = parse_req(package)
+        if await self.engine._call(self._discover_known, req) is None:
+            await self.engine.discover(package)
+
+    def close(self):
+        """Stop the engine and the event loop, and close the metadata cache."""
+        self.run(self.engine.close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        super(AsyncPackageSource, self).close()
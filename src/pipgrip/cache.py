@@ -0,0 +1,306 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Persistent (SQLite) cache of package metadata, shared across pipgrip runs."""
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+from pipgrip.index import get_index_settings
+
+try:
+    from packaging.tags import sys_tags
+except ImportError:  # packaging<20
+    sys_tags = None
+
+logger = logging.getLogger(__name__)
+
+OFFLINE_FAILURE_STR = "No cached metadata available offline for"
+
+CACHE_FILENAME = "metadata.sqlite3"
+
+# revalidate cached version lists and project pages on every run by default
+DEFAULT_CACHE_TTL = 0
+
+# bump when changing the tables below, outdated caches are dropped
+SCHEMA_VERSION = 2
+
+SCHEMA = """
+DROP TABLE IF EXISTS metadata;
+DROP TABLE IF EXISTS versions;
+DROP TABLE IF EXISTS pages;
+CREATE TABLE IF NOT EXISTS metadata (
+    index_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    pretty_name TEXT NOT NULL,
+    pretty_version TEXT NOT NULL,
+    requires_dist TEXT NOT NULL,
+    requires_python TEXT,
+    PRIMARY KEY (index_key, name, version, environment)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    index_key TEXT NOT NULL,
+    name TEXT NOT NULL,
+    environment TEXT NOT NULL,
+    pre INTEGER NOT NULL,
+    versions TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    PRIMARY KEY (index_key, name, environment, pre)
+);
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT NOT NULL PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    files TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+
+def user_cache_dir():
+    """Get the default pipgrip cache directory of the current user."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+    elif sys.platform == "darwin":
+        base = os.path.expanduser("~/Library/Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(base, "pipgrip")
+
+
+def get_cache_path(cache_dir=None):
+    """Get the path of the cache database, inside --cache-dir if provided."""
+    directory = os.path.join(cache_dir, "pipgrip") if cache_dir else user_cache_dir()
+    return os.path.join(directory, CACHE_FILENAME)
+
+
+def get_index_key(index_url, extra_index_url):
+    """Identify the configured indexes, as the same release can differ per index."""
+    settings = get_index_settings(index_url, extra_index_url)
+    if settings is None:
+        # pip uses --find-links or --no-index, keep the raw urls apart
+        return "pip {} {}".format(index_url, extra_index_url)
+    return " ".join(settings["index_urls"])
+
+
+def get_environment_key():
+    """Identify the running interpreter, as available versions depend on it."""
+    if sys_tags is None:
+        return "py{}{}-{}".format(
+            sys.version_info[0], sys.version_info[1], sys.platform
+        )
+    return str(next(iter(sys_tags())))
+
+
+def normalize_version(version):
+    try:
+        return str(Version(version))
+    except InvalidVersion:
+        return version
+
+
+class MetadataCache(object):
+    """Store core metadata per (index, canonical name, version) on disk.
+
+    Only the raw Requires-Dist is stored: environment markers and extras are
+    evaluated on every read. Metadata read from a pure Python wheel is shared by
+    all interpreters. Other metadata, e.g. built by pip from an sdist whose
+    setup.py picks requirements for the running interpreter, is only reused for
+    the same environment, like pip keys its cache of built wheels.
+
+    Lists of available versions and index project pages can change, and are
+    only reused for ttl seconds (by default not at all). After that, project
+    pages are revalidated using their ETag and Last-Modified headers.
+
+    """
+
+    def __init__(self, path, index_key, ttl=DEFAULT_CACHE_TTL):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.index_key = index_key
+        self.ttl = ttl
+        self.environment = get_environment_key()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            (schema_version,) = self._connection.execute(
+                "PRAGMA user_version"
+            ).fetchone()
+            if schema_version != SCHEMA_VERSION:
+                self._connection.executescript(SCHEMA)
+                self._connection.execute(
+                    "PRAGMA user_version = {:d}".format(SCHEMA_VERSION)
+                )
+
+    def _is_fresh(self, fetched_at):
+        return time.time() - fetched_at < self.ttl
+
+    def get_metadata(self, name):
+        """Get all cached metadata for a package, keyed by normalized version."""
+        with self._lock:
+            # entries of this environment override the shared ones
+            rows = self._connection.execute(
+                "SELECT version, pretty_name, pretty_version, requires_dist, "
+                "requires_python FROM metadata WHERE index_key = ? AND name = ? "
+                "AND environment IN ('', ?) ORDER BY environment",
+                (self.index_key, canonicalize_name(name), self.environment),
+            ).fetchall()
+        return {
+            version: {
+                "name": pretty_name,
+                "version": pretty_version,
+                "requires_dist": json.loads(requires_dist),
+                "requires_python": requires_python,
+            }
+            for version, pretty_name, pretty_version, requires_dist, requires_python in rows
+        }
+
+    def set_metadata(self, metadata):
+        """Store the core metadata of a single distribution.
+
+        Only shared across environments if metadata['portable'] is true.
+
+        """
+        environment = "" if metadata.get("portable") else self.environment
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.index_key,
+                    canonicalize_name(metadata["name"]),
+                    normalize_version(metadata["version"]),
+                    environment,
+                    metadata["name"],
+                    metadata["version"],
+                    json.dumps(list(metadata.get("requires_dist") or [])),
+                    metadata.get("requires_python"),
+                ),
+            )
+
+    def get_versions(self, name, pre, fresh=False):
+        """Get the last seen available versions of a package, or None.
+
+        Args:
+            name (str): package name
+            pre (bool): pip --pre flag
+            fresh (bool): ignore versions that are older than ttl
+
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT versions, fetched_at FROM versions WHERE index_key = ? "
+                "AND name = ? AND environment = ? AND pre = ?",
+                (self.index_key, canonicalize_name(name), self.environment, int(pre)),
+            ).fetchone()
+        if row is None or (fresh and not self._is_fresh(row[1])):
+            return None
+        return json.loads(row[0])
+
+    def set_versions(self, name, pre, versions):
+        """Store the available versions of a package for use in offline mode."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    self.index_key,
+                    canonicalize_name(name),
+                    self.environment,
+                    int(pre),
+                    json.dumps(list(versions)),
+                    time.time(),
+                ),
+            )
+
+    def get_page(self, url):
+        """Get a cached index project page, or None.
+
+        Returns:
+            dict: 'files' as parsed from the page, its 'etag' and 'last_modified'
+                response headers, and whether it is 'fresh' (younger than ttl)
+
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, last_modified, files, fetched_at FROM pages "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, last_modified, files, fetched_at = row
+        return {
+            "etag": etag,
+            "last_modified": last_modified,
+            "files": json.loads(files),
+            "fresh": self._is_fresh(fetched_at),
+        }
+
+    def set_page(self, url, files, etag=None, last_modified=None):
+        """Store the parsed files of an index project page."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (url, etag, last_modified, json.dumps(files), time.time()),
+            )
+
+    def touch_page(self, url):
+        """Mark a cached project page as fresh, after a successful revalidation."""
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE pages SET fetched_at = ? WHERE url = ?", (time.time(), url)
+            )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_metadata_cache(cache_dir, index_url, extra_index_url, ttl=DEFAULT_CACHE_TTL):
+    """Open the metadata cache, or return None if it is not usable."""
+    path = get_cache_path(cache_dir)
+    try:
+        return MetadataCache(path, get_index_key(index_url, extra_index_url), ttl)
+    except (sqlite3.Error, OSError) as exc:
+        logger.warning("Metadata cache {} disabled: {}".format(path, exc))
+        return None
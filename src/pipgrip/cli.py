@@ -49,17 +49,35 @@ from packaging.requirements import InvalidRequirement
 from pkg_resources import RequirementParseError
 
 from pipgrip import __version__
+from pipgrip.cache import DEFAULT_CACHE_TTL, OFFLINE_FAILURE_STR
 from pipgrip.compat import PIP_VERSION
+from pipgrip.concurrency import PriorityScheduler
+from pipgrip.libs.mixology.bitset import set_version_bitsets
 from pipgrip.libs.mixology.failure import SolverFailure
 from pipgrip.libs.mixology.package import Package
-from pipgrip.libs.mixology.version_solver import VersionSolver
-from pipgrip.package_source import PackageSource, render_pin
+from pipgrip.libs.mixology.version_solver import (
+    CACHED_HEURISTIC,
+    FETCH_HEURISTIC,
+    HEURISTICS,
+    VersionSolver,
+)
+from pipgrip.package_source import (
+    DEFAULT_PREFETCH_BUDGET,
+    DEFAULT_PREFETCH_DEPTH,
+    DEFAULT_SPECULATION_BUDGET,
+    PackageSource,
+    render_pin,
+)
 from pipgrip.pipper import (
     BUILD_FAILURE_STR,
     REPORT_FAILURE_STR,
     install_packages,
     parse_req,
     read_requirements,
+    set_index_hedging,
+    set_max_subprocesses,
+    set_pip_workers,
+    shutdown,
 )
 
 logging.basicConfig(format="%(levelname)s: %(message)s")
@@ -490,9 +508,22 @@ def render_lock(packages, include_dot=True, sort=False):
     "--no-cache-dir",
     # envvar='PIP_NO_CACHE_DIR',  #  this would be counter-intuitive https://github.com/pypa/pip/issues/2897#issuecomment-231753826
     is_flag=True,
-    help="Disable pip cache for the wheels downloaded by pipper. Overrides --cache-dir.",
+    help="Disable pip cache for the wheels downloaded by pipper, and the pipgrip metadata cache. Overrides --cache-dir.",
     # alternatively https://click.palletsprojects.com/en/7.x/options/#boolean-flags
 )
+@click.option(
+    "--offline",
+    is_flag=True,
+    help="Resolve using only the pipgrip metadata cache of previous runs (stored in --cache-dir), without contacting the package indexes.",
+)
+@click.option(
+    "--cache-ttl",
+    type=click.INT,
+    default=DEFAULT_CACHE_TTL,
+    help="Seconds to reuse cached lists of available versions without revalidating them with the package indexes (default {}: always revalidate, so new releases are seen immediately).".format(
+        DEFAULT_CACHE_TTL
+    ),
+)
 @click.option(
     "--index-url",
     # envvar="PIP_INDEX_URL",  # let pip discover
@@ -504,12 +535,60 @@ def render_lock(packages, include_dot=True, sort=False):
     # envvar="PIP_EXTRA_INDEX_URL",  # let pip discover
     help="Extra URLs of package indexes to use in addition to --index-url.",
 )
+@click.option(
+    "--hedge",
+    is_flag=True,
+    help="Treat the package indexes as mirrors of the same projects: look up each project on the fastest one, and also on the next one if that takes longer than usual (95th percentile of recent lookups).",
+)
 @click.option(
     "--threads",
     type=click.INT,
     envvar="PIPGRIP_THREADS",
     default=max(8, cpu_count() * 2),
-    help="Maximum amount of threads to use for running concurrent pip subprocesses.",
+    help="Maximum amount of threads to use for running concurrent pip subprocesses (also the maximum amount of long-lived pip processes). Fewer run concurrently while pip calls fail, slow down, or memory runs low.",
+)
+@click.option(
+    "--prefetch-depth",
+    type=click.INT,
+    default=DEFAULT_PREFETCH_DEPTH,
+    help="Before solving, concurrently discover the dependencies of the input requirements up to this many levels deep, like 2 (default {}: disabled, as these may turn out not to be needed).".format(
+        DEFAULT_PREFETCH_DEPTH
+    ),
+)
+@click.option(
+    "--prefetch-budget",
+    type=click.INT,
+    default=DEFAULT_PREFETCH_BUDGET,
+    help="Maximum amount of packages to discover before solving, with --prefetch-depth (default {}).".format(
+        DEFAULT_PREFETCH_BUDGET
+    ),
+)
+@click.option(
+    "--speculation-budget",
+    type=click.INT,
+    default=DEFAULT_SPECULATION_BUDGET,
+    help="While solving, maximum amount of newly found dependencies to discover in the background, like 100 (default {}: disabled, as these may turn out not to be needed).".format(
+        DEFAULT_SPECULATION_BUDGET
+    ),
+)
+@click.option(
+    "--heuristic",
+    type=click.Choice(HEURISTICS),
+    default=FETCH_HEURISTIC,
+    help="How to choose the next package to decide while solving, among the ones with the fewest versions and then dependencies: '{}' discovers these for every candidate, '{}' only uses what was discovered so far (preferring candidates that are known, then by name) to avoid discovering packages that may not be needed (default {}).".format(
+        FETCH_HEURISTIC, CACHED_HEURISTIC, FETCH_HEURISTIC
+    ),
+)
+@click.option(
+    "--bitsets",
+    is_flag=True,
+    help="While solving, compare and combine the version ranges of each package as bitsets over the bounds seen for it, instead of range by range. Gives the same results, faster when packages have many different requirements.",
+)
+@click.option(
+    "--asyncio",
+    "use_asyncio",
+    is_flag=True,
+    help="Discover packages on an asyncio event loop, with up to --threads pip processes and many more index requests in flight (Python 3.5+).",
 )
 @click.option(
     "--pre",
@@ -547,9 +626,18 @@ def main(
     max_depth,
     cache_dir,
     no_cache_dir,
+    offline,
+    cache_ttl,
     index_url,
     extra_index_url,
+    hedge,
     threads,
+    prefetch_depth,
+    prefetch_budget,
+    speculation_budget,
+    heuristic,
+    bitsets,
+    use_asyncio,
     pre,
     verbose,
     skip_invalid_input,
@@ -612,14 +700,28 @@ def main(
     if user:
         if not install:
             raise click.ClickException("--user has no effect without --install")
+    if offline and no_cache_dir:
+        raise click.ClickException("--offline has no effect with --no-cache-dir")
 
+    source_class, source_options = PackageSource, {}
+    if use_asyncio:
+        if sys.version_info < (3, 5):
+            raise click.ClickException("--asyncio requires Python 3.5 or higher")
+        from pipgrip.aio import AsyncPackageSource
+
+        source_class, source_options = AsyncPackageSource, {"subprocesses": threads}
+
+    source = None
     try:
-        source = PackageSource(
+        source = source_class(
             cache_dir=cache_dir,
             no_cache_dir=no_cache_dir,
             index_url=index_url,
             extra_index_url=extra_index_url,
             pre=pre,
+            offline=offline,
+            cache_ttl=cache_ttl,
+            **source_options
         )
         for root_dependency in dependencies:
             try:
@@ -632,17 +734,39 @@ def main(
                 else:
                     raise
 
-        solver = VersionSolver(source, threads=threads)
+        set_pip_workers(threads)
+        set_max_subprocesses(threads)
+        set_index_hedging(hedge)
+        set_version_bitsets(bitsets)
+        if prefetch_depth >= 0 and prefetch_budget > 0:
+            source.prefetch(
+                depth=prefetch_depth, budget=prefetch_budget, threads=threads
+            )
+        scheduler = PriorityScheduler(threads)
+        if speculation_budget > 0:
+            source.start_speculation(scheduler, budget=speculation_budget)
+        solver = VersionSolver(source, scheduler=scheduler, heuristic=heuristic)
         try:
             solution = solver.solve()
             exc = None
         except RuntimeError as e:
             # RuntimeError coming from pipgrip.pipper
-            if REPORT_FAILURE_STR not in str(e) and BUILD_FAILURE_STR not in str(e):
+            if not any(
+                failure_str in str(e)
+                for failure_str in (
+                    REPORT_FAILURE_STR,
+                    BUILD_FAILURE_STR,
+                    OFFLINE_FAILURE_STR,
+                )
+            ):
                 # only continue handling expected RuntimeErrors
                 raise
             solution = solver.solution
             exc = e
+        finally:
+            # drop speculative discoveries that are still queued
+            source.stop_speculation()
+            scheduler.close()
 
         # build tree of the (partial) solution using package metadata from source
         decision_packages = OrderedDict()
@@ -741,3 +865,7 @@ def main(
             )
     except (SolverFailure, click.ClickException, CalledProcessError) as exc:
         raise click.ClickException(str(exc))
+    finally:
+        if source is not None:
+            source.close()
+        shutdown()
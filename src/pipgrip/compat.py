@@ -34,9 +34,29 @@ import pip
 from pkg_resources import parse_version
 
 try:
-    from urllib.parse import urlparse
+    from urllib.parse import unquote, urljoin, urlparse
 except ImportError:
     # Python 2
-    from urlparse import urlparse  # noqa:F401
+    from urllib import unquote  # noqa:F401
+
+    from urlparse import urljoin, urlparse  # noqa:F401
+
+try:
+    from urllib.request import getproxies, proxy_bypass, url2pathname
+except ImportError:
+    # Python 2
+    from urllib import getproxies, proxy_bypass, url2pathname  # noqa:F401
+
+try:
+    from http.client import HTTPConnection, HTTPException, HTTPSConnection
+except ImportError:
+    # Python 2
+    from httplib import HTTPConnection, HTTPException, HTTPSConnection  # noqa:F401
+
+try:
+    from html.parser import HTMLParser
+except ImportError:
+    # Python 2
+    from HTMLParser import HTMLParser  # noqa:F401
 
 PIP_VERSION = list(parse_version(pip.__version__)._version.release)
@@ -0,0 +1,531 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Helpers for sharing work between the solver threads."""
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# job priorities of a PriorityScheduler, lowest runs first
+BLOCKING = 0
+CANDIDATE = 1
+SPECULATIVE = 2
+
+# a call taking this many times the average latency signals congestion
+CONGESTION_LATENCY_FACTOR = 4
+# calls faster than this never signal congestion, like the ones served from memory
+CONGESTION_MIN_LATENCY = 0.5
+# the system is under memory pressure below this fraction of available memory
+MEMORY_PRESSURE_RATIO = 0.1
+
+# a call slower than this percentile of its backend's recent latencies is hedged
+HEDGE_PERCENTILE = 0.95
+# the hedging deadline of a backend with fewer known latencies
+HEDGE_MIN_SAMPLES = 5
+HEDGE_DEFAULT_DEADLINE = 1.0
+HEDGE_WINDOW = 100
+
+_QUEUED = "queued"
+_RUNNING = "running"
+_DONE = "done"
+_CANCELLED = "cancelled"
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc = None
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key into a single call.
+
+    The first caller for a key runs the function, concurrent callers for the
+    same key wait for it and get the same result (or exception). Once the call
+    finished, the next caller for the key runs the function again, so results
+    should be cached by the function itself.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+
+        succeeded = False
+        try:
+            call.result = func(*args, **kwargs)
+            succeeded = True
+            return call.result
+        finally:
+            if not succeeded:
+                # the exception being raised, handed to the waiting callers
+                call.exc = sys.exc_info()[1]
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class Job(object):
+    """A call queued on a PriorityScheduler."""
+
+    def __init__(self, func, args, priority, key, group):
+        self.func = func
+        self.args = args
+        self.priority = priority
+        self.key = key
+        self.group = group
+        self.state = _QUEUED
+        self.done = threading.Event()
+        self.result = None
+        self.exc = None
+
+    @property
+    def cancelled(self):
+        """Whether the job was dropped from the queue before it ran."""
+        return self.state == _CANCELLED
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception as exc:  # noqa: B902 raised by the waiting callers
+            self.exc = exc
+
+    def get(self):
+        """Wait for the job, and return its result or raise its exception."""
+        self.done.wait()
+        if self.exc is not None:
+            raise self.exc
+        return self.result
+
+
+def spawn(func, *args):
+    """Run func(*args) in a new thread, and return its Job."""
+    job = Job(func, args, BLOCKING, None, None)
+
+    def run():
+        job.run()
+        job.done.set()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return job
+
+
+class PriorityScheduler(object):
+    """Run calls on a pool of threads, most urgent first.
+
+    Jobs run in order of priority (BLOCKING, CANDIDATE, SPECULATIVE), and in
+    order of submission within a priority. Jobs submitted with a key are
+    deduplicated: while a job with the same key is queued or running, it is
+    returned instead (with its priority raised if needed). Waiting for a job
+    that is still queued runs it in the waiting thread, so the threads waiting
+    for results never wait behind the queue.
+
+    """
+
+    def __init__(self, threads=1):
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._queue = []
+        self._seq = itertools.count()
+        self._jobs = {}
+        self._unfinished = 0
+        self._closed = False
+        self._threads = []
+        for _ in range(max(1, threads)):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, func, args=(), priority=SPECULATIVE, key=None, group=None):
+        """Queue func(*args), and return its Job.
+
+        The group is used to cancel related speculative jobs at once.
+
+        """
+        with self._lock:
+            if self._closed:
+                raise ValueError("Scheduler is closed")
+            job = None if key is None else self._jobs.get(key)
+            if job is None:
+                job = Job(func, args, priority, key, group)
+                if key is not None:
+                    self._jobs[key] = job
+                self._unfinished += 1
+            elif job.state != _QUEUED or job.priority <= priority:
+                return job
+            job.priority = priority
+            heapq.heappush(self._queue, (priority, next(self._seq), job))
+            self._changed.notify()
+        return job
+
+    def wait(self, job):
+        """Return the result of job, running it in this thread if still queued."""
+        with self._lock:
+            steal = job.state == _QUEUED
+            if steal:
+                job.state = _RUNNING
+        if steal:
+            self._run(job)
+        return job.get()
+
+    def run(self, func, args=(), key=None):
+        """Run func(*args) in this thread, or wait for the job with the same key."""
+        return self.wait(self.submit(func, args, BLOCKING, key))
+
+    def run_all(self, func, iterable, priority=CANDIDATE):
+        """Return [func(item) for item in iterable], run concurrently."""
+        jobs = [self.submit(func, (item,), priority) for item in iterable]
+        return [self.wait(job) for job in jobs]
+
+    def cancel(self, groups=None):
+        """Drop queued speculative jobs of the given groups (default all).
+
+        Returns the amount of jobs cancelled.
+
+        """
+        cancelled = []
+        with self._lock:
+            for _, _, job in self._queue:
+                if (
+                    job.state == _QUEUED
+                    and job.priority == SPECULATIVE
+                    and (groups is None or job.group in groups)
+                ):
+                    job.state = _CANCELLED
+                    self._finish(job)
+                    cancelled.append(job)
+            self._queue = [entry for entry in self._queue if entry[2].state == _QUEUED]
+            heapq.heapify(self._queue)
+        for job in cancelled:
+            job.done.set()
+        if cancelled:
+            logger.debug("cancelled %d speculative jobs", len(cancelled))
+        return len(cancelled)
+
+    def join(self):
+        """Wait until all jobs finished, including the ones they submit."""
+        with self._lock:
+            while self._unfinished:
+                self._changed.wait()
+
+    def close(self):
+        """Cancel queued speculative jobs, and stop after running the others."""
+        self.cancel()
+        with self._lock:
+            self._closed = True
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _finish(self, job):
+        # with self._lock held
+        if job.key is not None and self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+        self._unfinished -= 1
+        self._changed.notify_all()
+
+    def _run(self, job):
+        job.run()
+        with self._lock:
+            job.state = _DONE
+            self._finish(job)
+        job.done.set()
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._closed:
+                    self._changed.wait()
+                if not self._queue:
+                    return
+                _, _, job = heapq.heappop(self._queue)
+                if job.state != _QUEUED:
+                    # run by a waiting thread, or an entry from before a raised priority
+                    continue
+                job.state = _RUNNING
+            self._run(job)
+
+
+def get_memory_pressure():  # type: () -> bool
+    """Whether the system runs low on memory (only known on Linux)."""
+    try:
+        with open("/proc/meminfo") as fp:
+            meminfo = dict(line.split(":", 1) for line in fp if ":" in line)
+        total = int(meminfo["MemTotal"].split()[0])
+        available = int(meminfo["MemAvailable"].split()[0])
+    except (IOError, OSError, KeyError, IndexError, ValueError):
+        return False
+    return available < MEMORY_PRESSURE_RATIO * total
+
+
+class ConcurrencyGovernor(object):
+    """Limit the amount of concurrent calls, adapting the limit AIMD-style.
+
+    The limit starts at max_limit. It halves (at most once per average call
+    latency) when a call fails, when a call takes CONGESTION_LATENCY_FACTOR
+    times the average latency (and at least CONGESTION_MIN_LATENCY), or when the
+    system runs low on memory. Else it
+    grows by one for every limit calls that finish, up to max_limit again.
+
+    Args:
+        name (str): used in log messages
+        max_limit (int): maximum amount of concurrent calls
+        min_limit (int): minimum amount of concurrent calls
+        memory_pressure (callable): returns whether memory runs low
+
+    """
+
+    def __init__(
+        self, name, max_limit, min_limit=1, memory_pressure=get_memory_pressure
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self._max_limit = max_limit
+        self._limit = float(max_limit)
+        self._in_flight = 0
+        self._latency = None
+        self._decreased_at = 0
+        self._memory_pressure = memory_pressure
+        self._memory_checked_at = 0
+        self._under_pressure = False
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self):  # type: () -> int
+        return max(self.min_limit, int(self._limit))
+
+    @property
+    def max_limit(self):  # type: () -> int
+        return self._max_limit
+
+    @max_limit.setter
+    def max_limit(self, max_limit):  # type: (int) -> None
+        with self._condition:
+            self._max_limit = max(self.min_limit, max_limit)
+            self._limit = float(self._max_limit)
+            self._condition.notify_all()
+
+    def acquire(self):  # type: () -> None
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def release(self, latency, failed=False):  # type: (float, bool) -> None
+        with self._condition:
+            self._in_flight -= 1
+            now = time.time()
+            congested = (
+                failed
+                or self._check_memory(now)
+                or (
+                    self._latency is not None
+                    and latency > CONGESTION_MIN_LATENCY
+                    and latency > CONGESTION_LATENCY_FACTOR * self._latency
+                )
+            )
+            if not congested:
+                self._limit = min(self._max_limit, self._limit + 1.0 / self.limit)
+            elif now - self._decreased_at > (self._latency or 0):
+                # one decrease per round trip, calls in flight saw the same congestion
+                self._decreased_at = now
+                self._limit = max(self.min_limit, self._limit / 2)
+                logger.debug(
+                    "Decreased {} concurrency to {}".format(self.name, self.limit)
+                )
+            if not failed:
+                self._latency = (
+                    latency
+                    if self._latency is None
+                    else 0.8 * self._latency + 0.2 * latency
+                )
+            self._condition.notify_all()
+
+    def _check_memory(self, now):
+        if now - self._memory_checked_at > 1:
+            self._memory_checked_at = now
+            self._under_pressure = self._memory_pressure()
+        return self._under_pressure
+
+    @contextmanager
+    def slot(self):
+        """Hold one of the concurrent call slots, timing the call.
+
+        Exceptions raised in the block count as failed calls.
+
+        """
+        self.acquire()
+        start = time.time()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.release(time.time() - start, failed)
+
+
+class LatencyTracker(object):
+    """Track the recent latencies of interchangeable backends, like index mirrors.
+
+    Args:
+        percentile (float): percentile of the recent latencies used as deadline
+        default (float): deadline of a backend with too few known latencies
+        window (int): amount of recent latencies to keep per backend
+
+    """
+
+    def __init__(
+        self,
+        percentile=HEDGE_PERCENTILE,
+        default=HEDGE_DEFAULT_DEADLINE,
+        window=HEDGE_WINDOW,
+    ):
+        self.percentile = percentile
+        self.default = default
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def observe(self, backend, latency):
+        with self._lock:
+            if backend not in self._latencies:
+                self._latencies[backend] = deque(maxlen=self.window)
+            self._latencies[backend].append(latency)
+
+    def _sorted(self, backend):
+        with self._lock:
+            return sorted(self._latencies.get(backend, ()))
+
+    def rank(self, backends):
+        """Sort backends by median latency, untried backends first (stable)."""
+
+        def median(backend):
+            latencies = self._sorted(backend)
+            return latencies[len(latencies) // 2] if latencies else 0
+
+        return sorted(backends, key=median)
+
+    def deadline(self, backend):
+        """Get the time after which a call to backend is hedged."""
+        latencies = self._sorted(backend)
+        if len(latencies) < HEDGE_MIN_SAMPLES:
+            return self.default
+        return latencies[int(self.percentile * (len(latencies) - 1))]
+
+
+def hedge(calls, deadline, accept=bool):
+    """Return the first accepted result of calls, hedging slow and failed calls.
+
+    Starts the first call, and the next one whenever no call returned within
+    deadline seconds since the last start, or when a call failed or returned a
+    result rejected by accept. Calls still running once a result is accepted
+    finish in the background.
+
+    Args:
+        calls (list): functions without arguments, in order of preference
+        deadline (float): seconds to wait for a call before starting the next one
+        accept (callable): whether a result is an answer
+
+    Returns:
+        the first accepted result, else the last rejected result, else the
+        exception of the last failed call is raised.
+
+    """
+    pending = list(calls)
+    finished = []
+    condition = threading.Condition()
+
+    def run(job):
+        job.run()
+        with condition:
+            finished.append(job)
+            condition.notify()
+
+    def start():
+        job = Job(pending.pop(0), (), BLOCKING, None, None)
+        thread = threading.Thread(target=run, args=(job,))
+        thread.daemon = True
+        thread.start()
+        return time.time() + deadline
+
+    rejected = []
+    exc = None
+    with condition:
+        hedge_at = start()
+        running = 1
+        while running:
+            if not finished:
+                if not pending:
+                    condition.wait()
+                elif time.time() < hedge_at:
+                    condition.wait(hedge_at - time.time())
+                else:
+                    hedge_at = start()
+                    running += 1
+                continue
+            job = finished.pop(0)
+            running -= 1
+            if job.exc is not None:
+                exc = job.exc
+            elif accept(job.result):
+                return job.result
+            else:
+                rejected.append(job.result)
+            if pending:
+                hedge_at = start()
+                running += 1
+    if rejected:
+        return rejected[-1]
+    raise exc
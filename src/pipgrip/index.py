@@ -0,0 +1,856 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""In-process client for PEP 503 (HTML) and PEP 691 (JSON) simple repositories."""
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import posixpath
+import socket
+import ssl
+import sys
+import threading
+import time
+import zipfile
+import zlib
+from email.parser import HeaderParser
+from functools import partial
+
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+from packaging.utils import canonicalize_name
+from packaging.version import InvalidVersion, Version
+
+from pipgrip.compat import (
+    HTMLParser,
+    HTTPConnection,
+    HTTPException,
+    HTTPSConnection,
+    getproxies,
+    proxy_bypass,
+    unquote,
+    url2pathname,
+    urljoin,
+    urlparse,
+)
+from pipgrip.concurrency import LatencyTracker, SingleFlight, hedge, spawn
+
+try:
+    from packaging.tags import sys_tags
+except ImportError:  # packaging<20
+    sys_tags = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_URL = "https://pypi.org/simple"
+SIMPLE_JSON_CONTENT_TYPE = "application/vnd.pypi.simple.v1+json"
+ACCEPT_HEADER = ", ".join(
+    [
+        SIMPLE_JSON_CONTENT_TYPE,
+        "application/vnd.pypi.simple.v1+html; q=0.2",
+        "text/html; q=0.1",
+    ]
+)
+SDIST_EXTENSIONS = (".tar.gz", ".tgz", ".tar.bz2", ".tbz", ".tar.xz", ".txz", ".zip")
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+MAX_REDIRECTS = 10
+LAZY_BLOCK_SIZE = 16 * 1024
+LAZY_TAIL_SIZE = 64 * 1024
+
+
+class IndexClientError(RuntimeError):
+    """Raised when an index can not be queried in-process (pip fallback applies)."""
+
+
+def _load_pip_config():
+    """Return pip's merged configuration items, or None when unavailable."""
+    try:
+        from pip._internal.configuration import Configuration
+        from pip._internal.exceptions import ConfigurationError
+    except ImportError:  # pip<10
+        return None
+    try:
+        configuration = Configuration(isolated=False)
+        configuration.load()
+        return dict(configuration.items())
+    except (ConfigurationError, OSError, ValueError) as exc:
+        logger.debug("Failed to load pip configuration: %s", exc)
+        return None
+
+
+def _config_value(config, key):
+    # env vars take precedence over the install/wheel command sections, which in
+    # turn take precedence over the global section (like pip does)
+    for section in (":env:", "install", "wheel", "global"):
+        value = config.get("{}.{}".format(section, key))
+        if value:
+            return value
+
+
+def get_index_settings(index_url, extra_index_url):
+    """Get index urls, trusted hosts and cert path like pip would use them.
+
+    Returns None if pip is configured in a way this client can't mimic
+    (e.g. --no-index or --find-links), in which case pip itself must be used.
+    """
+    config = _load_pip_config()
+    if config is None:
+        return None
+    if _config_value(config, "no-index") or _config_value(config, "find-links"):
+        return None
+
+    trusted_hosts = set((_config_value(config, "trusted-host") or "").split())
+    if index_url is not None:
+        # mimic the --trusted-host flags passed to pip in pipgrip.pipper
+        trusted_hosts.add(urlparse(index_url).hostname)
+    else:
+        index_url = _config_value(config, "index-url") or DEFAULT_INDEX_URL
+
+    if extra_index_url is not None:
+        trusted_hosts.add(urlparse(extra_index_url).hostname)
+        extra_index_urls = [extra_index_url]
+    else:
+        extra_index_urls = (_config_value(config, "extra-index-url") or "").split()
+
+    only_binary = _config_value(config, "only-binary") or ""
+    return {
+        "index_urls": [index_url] + extra_index_urls,
+        "trusted_hosts": trusted_hosts,
+        "cert": os.environ.get("REQUESTS_CA_BUNDLE") or _config_value(config, "cert"),
+        "timeout": float(_config_value(config, "timeout") or 15),
+        "prefer_binary": _config_bool(_config_value(config, "prefer-binary")),
+        "only_binary": {
+            name if name == ":all:" else canonicalize_name(name)
+            for name in only_binary.replace(",", " ").split()
+            if name != ":none:"
+        },
+    }
+
+
+def _config_bool(value):
+    # pip's config files spell booleans like configparser does
+    return (value or "").lower() in ("1", "true", "yes", "on")
+
+
+_supported_tags = None
+
+
+def wheel_tag_rank(filename):
+    """Rank a wheel by its most preferred tag (lower is better, like pip).
+
+    Returns None if the wheel is not installable on the running interpreter.
+    """
+    global _supported_tags
+    if sys_tags is None:
+        return 0
+    if _supported_tags is None:
+        _supported_tags = {str(tag): rank for rank, tag in enumerate(sys_tags())}
+    parts = filename[: -len(".whl")].split("-")
+    if len(parts) not in (5, 6):
+        return None
+    pythons, abis, platforms = (part.split(".") for part in parts[-3:])
+    ranks = [
+        _supported_tags["-".join((python, abi, platform))]
+        for python in pythons
+        for abi in abis
+        for platform in platforms
+        if "-".join((python, abi, platform)) in _supported_tags
+    ]
+    return min(ranks) if ranks else None
+
+
+def is_supported_wheel(filename):
+    """Check whether a wheel filename is installable on the running interpreter."""
+    return wheel_tag_rank(filename) is not None
+
+
+def version_from_filename(filename, project):
+    """Extract the (normalized) version string from a wheel or sdist filename."""
+    if filename.endswith(".whl"):
+        parts = filename[: -len(".whl")].split("-")
+        if len(parts) not in (5, 6) or canonicalize_name(parts[0]) != project:
+            return
+        version = parts[1]
+    else:
+        lowered = filename.lower()
+        for ext in SDIST_EXTENSIONS:
+            if lowered.endswith(ext):
+                stem = filename[: -len(ext)]
+                break
+        else:
+            return
+        # the project name itself may contain dashes
+        version = None
+        for i, char in enumerate(stem):
+            if char == "-" and canonicalize_name(stem[:i]) == project:
+                version = stem[i + 1 :]
+                break
+        if not version:
+            return
+    try:
+        return str(Version(version))
+    except InvalidVersion:
+        return
+
+
+def _python_version():
+    return ".".join(str(part) for part in sys.version_info[:3])
+
+
+def is_compatible_python(requires_python):
+    if not requires_python:
+        return True
+    try:
+        return SpecifierSet(requires_python).contains(
+            _python_version(), prereleases=True
+        )
+    except InvalidSpecifier:
+        # pip ignores invalid Requires-Python specifiers as well
+        return True
+
+
+def _parse_hash(value):
+    """Parse a '<hashname>=<hexdigest>' string into a hashes dict."""
+    name, sep, digest = value.partition("=")
+    return {name: digest} if sep else {}
+
+
+def _parse_metadata_attribute(value):
+    """Parse a PEP 658 data-dist-info-metadata / PEP 714 data-core-metadata value."""
+    if value is None or value == "false":
+        return None
+    return _parse_hash(value) or True
+
+
+def _make_file(
+    filename, url, requires_python=None, yanked=False, hashes=None, metadata=None
+):
+    url, _, fragment = url.partition("#")
+    if hashes is None:
+        hashes = _parse_hash(fragment)
+    return {
+        "filename": filename,
+        "url": url,
+        "hashes": hashes,
+        "requires_python": requires_python,
+        "yanked": yanked,
+        # hashes dict (or True if no hashes were given) if the index serves the
+        # core metadata file separately at url + '.metadata'
+        "metadata": metadata,
+    }
+
+
+def merge_index_pages(pages):
+    """Merge the files of a project on several indexes, in order of priority.
+
+    All files of the project are taken from the first index that lists it, so
+    files of the same project on several indexes are never mixed. pages can be
+    an iterator, which is only consumed up to that index.
+    """
+    for page in pages:
+        if page:
+            return list(page)
+    return []
+
+
+class _SimpleHTMLParser(HTMLParser):
+    def __init__(self, page_url):
+        HTMLParser.__init__(self)
+        self.base_url = page_url
+        self.anchors = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == "base" and attrs.get("href"):
+            self.base_url = urljoin(self.base_url, attrs["href"])
+        elif tag == "a" and attrs.get("href"):
+            self.anchors.append(attrs)
+
+
+def parse_html_page(body, page_url):
+    """Parse a PEP 503 project page into a list of file dicts."""
+    parser = _SimpleHTMLParser(page_url)
+    parser.feed(body.decode("utf-8", errors="replace"))
+    parser.close()
+    files = []
+    for anchor in parser.anchors:
+        url = urljoin(parser.base_url, anchor["href"])
+        filename = unquote(posixpath.basename(urlparse(url).path))
+        files.append(
+            _make_file(
+                filename,
+                url,
+                requires_python=anchor.get("data-requires-python"),
+                yanked="data-yanked" in anchor,
+                metadata=_parse_metadata_attribute(
+                    anchor.get(
+                        "data-core-metadata", anchor.get("data-dist-info-metadata")
+                    )
+                ),
+            )
+        )
+    return files
+
+
+def parse_json_page(body, page_url):
+    """Parse a PEP 691 project page into a list of file dicts."""
+    data = json.loads(body.decode("utf-8"))
+    return [
+        _make_file(
+            entry["filename"],
+            urljoin(page_url, entry["url"]),
+            requires_python=entry.get("requires-python"),
+            yanked=bool(entry.get("yanked", False)),
+            hashes=entry.get("hashes"),
+            metadata=entry.get("core-metadata", entry.get("dist-info-metadata"))
+            or None,
+        )
+        for entry in data.get("files", [])
+    ]
+
+
+def parse_metadata(text):
+    """Parse a core metadata (METADATA/PKG-INFO) file.
+
+    The keys of the returned dict follow pip's installation report.
+    """
+    message = HeaderParser().parsestr(text)
+    if message.get("Name") is None or message.get("Version") is None:
+        raise ValueError("Invalid core metadata: Name and Version are required")
+    return {
+        "metadata_version": message.get("Metadata-Version"),
+        "name": message.get("Name"),
+        "version": message.get("Version"),
+        "requires_dist": message.get_all("Requires-Dist") or [],
+        "requires_python": message.get("Requires-Python"),
+        "provides_extra": message.get_all("Provides-Extra") or [],
+    }
+
+
+def _verify_hashes(data, hashes, url):
+    for name, digest in hashes.items():
+        try:
+            hasher = hashlib.new(name, data)
+        except ValueError:
+            # unsupported hash algorithm
+            continue
+        if hasher.hexdigest() != digest:
+            raise IndexClientError("Hash mismatch for {}".format(url))
+        return
+
+
+def _find_metadata_member(names):
+    """Find the top-level *.dist-info/METADATA member of a wheel."""
+    for name in names:
+        parts = name.split("/")
+        if (
+            len(parts) == 2
+            and parts[0].endswith(".dist-info")
+            and parts[1] == "METADATA"
+        ):
+            return name
+    raise IndexClientError("No .dist-info/METADATA found in wheel")
+
+
+class LazyRemoteFile(object):
+    """Read-only, seekable file over HTTP range requests.
+
+    Only the byte ranges zipfile actually reads are downloaded (in blocks), so
+    the central directory and a single member of a remote wheel can be read
+    without fetching the whole file.
+    """
+
+    def __init__(self, client, url, length, block_size=LAZY_BLOCK_SIZE):
+        self._client = client
+        self._url = url
+        self._length = length
+        self._block_size = block_size
+        self._blocks = {}
+        self._position = 0
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self._position = offset
+        elif whence == 1:
+            self._position += offset
+        elif whence == 2:
+            self._position = self._length + offset
+        else:
+            raise ValueError("Invalid whence ({})".format(whence))
+        self._position = max(0, min(self._position, self._length))
+        return self._position
+
+    def read(self, size=-1):
+        stop = self._length if size < 0 else min(self._length, self._position + size)
+        if stop <= self._position:
+            return b""
+        first = self._position // self._block_size
+        last = (stop - 1) // self._block_size
+        self._fetch(first, last)
+        data = b"".join(self._blocks[i] for i in range(first, last + 1))
+        start = self._position - first * self._block_size
+        data = data[start : start + stop - self._position]
+        self._position = stop
+        return data
+
+    def prefetch_tail(self, size):
+        """Download the last size bytes, where the central directory lives."""
+        first = max(0, self._length - size) // self._block_size
+        self._fetch(first, (self._length - 1) // self._block_size)
+
+    def _fetch(self, first, last):
+        # download each run of consecutive missing blocks in a single request
+        missing = [i for i in range(first, last + 1) if i not in self._blocks]
+        while missing:
+            run_start = run_stop = missing.pop(0)
+            while missing and missing[0] == run_stop + 1:
+                run_stop = missing.pop(0)
+            start = run_start * self._block_size
+            stop = min(self._length, (run_stop + 1) * self._block_size) - 1
+            status, _, body, _ = self._client.request(
+                self._url,
+                {
+                    "Range": "bytes={}-{}".format(start, stop),
+                    "Accept-Encoding": "identity",
+                },
+            )
+            if status != 206 or len(body) != stop - start + 1:
+                raise IndexClientError(
+                    "Range request for {} returned HTTP {}".format(self._url, status)
+                )
+            for i in range(run_start, run_stop + 1):
+                offset = (i - run_start) * self._block_size
+                self._blocks[i] = body[offset : offset + self._block_size]
+
+
+class IndexClient(object):
+    """Query simple repositories in-process over pooled keep-alive connections.
+
+    Args:
+        index_urls (list): primary index url followed by extra index urls
+        trusted_hosts (set): hosts for which TLS verification is disabled
+        cert (str): path to a CA bundle (defaults to pip's vendored certifi)
+        timeout (float): socket timeout in seconds
+        page_cache (pipgrip.cache.MetadataCache): persistent cache for project
+            pages, revalidated with conditional requests once expired
+        hedge (bool): treat the indexes as mirrors of the same projects, and
+            query them fastest first, querying the next one when a lookup is
+            slower than its usual latencies
+        prefer_binary (bool): pip --prefer-binary
+        only_binary (set): pip --only-binary, canonical project names or ":all:"
+
+    """
+
+    def __init__(
+        self,
+        index_urls,
+        trusted_hosts=(),
+        cert=None,
+        timeout=15,
+        page_cache=None,
+        hedge=False,
+        prefer_binary=False,
+        only_binary=(),
+    ):
+        self.index_urls = [url.rstrip("/") + "/" for url in index_urls]
+        self.prefer_binary = prefer_binary
+        self.only_binary = set(only_binary)
+        self.trusted_hosts = set(trusted_hosts)
+        self.cert = cert
+        self.timeout = timeout
+        self.page_cache = page_cache
+        self.hedge = hedge and len(self.index_urls) > 1
+        self._page_latencies = LatencyTracker()
+        self._metadata_latencies = LatencyTracker()
+        self._index_pages = {}
+        self._file_indexes = {}
+        self._connections = {}
+        self._lock = threading.Lock()
+        self._project_files = {}
+        self._project_flights = SingleFlight()
+        self._ssl_contexts = {}
+
+    def _ssl_context(self, host):
+        verify = host not in self.trusted_hosts
+        if verify not in self._ssl_contexts:
+            if verify:
+                cafile = self.cert
+                if cafile is None:
+                    try:
+                        from pip._vendor import certifi
+
+                        cafile = certifi.where()
+                    except ImportError:
+                        cafile = None
+                context = ssl.create_default_context(cafile=cafile)
+            else:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            self._ssl_contexts[verify] = context
+        return self._ssl_contexts[verify]
+
+    def _proxy_for(self, scheme, netloc):
+        if proxy_bypass(urlparse("//" + netloc).hostname):
+            return None
+        return getproxies().get(scheme)
+
+    def _new_connection(self, scheme, netloc):
+        proxy = self._proxy_for(scheme, netloc)
+        target = urlparse(proxy).netloc if proxy else netloc
+        if scheme == "https":
+            conn = HTTPSConnection(
+                target,
+                timeout=self.timeout,
+                context=self._ssl_context(urlparse("//" + netloc).hostname),
+            )
+            if proxy:
+                conn.set_tunnel(netloc)
+        else:
+            conn = HTTPConnection(target, timeout=self.timeout)
+        return conn
+
+    def _acquire(self, key):
+        with self._lock:
+            idle = self._connections.get(key)
+            if idle:
+                return idle.pop(), True
+        return self._new_connection(*key), False
+
+    def _release(self, key, conn):
+        with self._lock:
+            self._connections.setdefault(key, []).append(conn)
+
+    def close(self):
+        """Close all pooled connections."""
+        with self._lock:
+            connections, self._connections = self._connections, {}
+        for idle in connections.values():
+            for conn in idle:
+                conn.close()
+
+    def _request_once(self, url, headers, method="GET"):
+        parsed = urlparse(url)
+        key = (parsed.scheme, parsed.netloc.rpartition("@")[2])
+        path = parsed.path or "/"
+        if parsed.query:
+            path += "?" + parsed.query
+        headers = dict(headers)
+        if parsed.username:
+            credentials = "{}:{}".format(
+                unquote(parsed.username), unquote(parsed.password or "")
+            )
+            headers["Authorization"] = "Basic " + base64.b64encode(
+                credentials.encode("utf-8")
+            ).decode("ascii")
+
+        if key[0] == "http" and self._proxy_for(*key):
+            # plain http over a proxy requires the absolute url in the request line
+            path = "{}://{}{}".format(key[0], key[1], path)
+
+        conn, reused = self._acquire(key)
+        try:
+            conn.request(method, path, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+        except (HTTPException, socket.error) as exc:
+            conn.close()
+            if reused:
+                # the server closed an idle keep-alive connection, try a fresh one
+                return self._request_once(url, headers, method)
+            raise IndexClientError("{} {} failed: {!r}".format(method, url, exc))
+
+        if response.will_close:
+            conn.close()
+        else:
+            self._release(key, conn)
+        response_headers = {k.lower(): v for k, v in response.getheaders()}
+        if response_headers.get("content-encoding") == "gzip":
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return response.status, response_headers, body
+
+    def _read_file(self, url):
+        """Serve file:// urls like pip does (directories serve their index.html)."""
+        path = url2pathname(urlparse(url).path)
+        headers = {}
+        if os.path.isdir(path):
+            path = os.path.join(path, "index.html")
+            headers["content-type"] = "text/html"
+        if not os.path.isfile(path):
+            return 404, headers, b""
+        with open(path, "rb") as fp:
+            return 200, headers, fp.read()
+
+    def request(self, url, headers=None, method="GET"):
+        """Request url following redirects, return (status, headers, body, url)."""
+        if urlparse(url).scheme == "file":
+            return self._read_file(url) + (url,)
+        headers = dict({"Accept-Encoding": "gzip"}, **(headers or {}))
+        for _ in range(MAX_REDIRECTS):
+            status, response_headers, body = self._request_once(url, headers, method)
+            if status not in REDIRECT_STATUSES:
+                return status, response_headers, body, url
+            url = urljoin(url, response_headers["location"])
+        raise IndexClientError("Too many redirects for {}".format(url))
+
+    def get_project_page(self, index_url, project):
+        """Fetch and parse the project page of a single index."""
+        page_url = url = "{}{}/".format(index_url, project)
+        request_headers = {"Accept": ACCEPT_HEADER}
+        cached = None if self.page_cache is None else self.page_cache.get_page(url)
+        if cached is not None:
+            if cached["fresh"]:
+                return cached["files"]
+            if cached["etag"]:
+                request_headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                request_headers["If-Modified-Since"] = cached["last_modified"]
+        logger.debug("Fetching %s", url)
+        start = time.time()
+        status, headers, body, url = self.request(url, request_headers)
+        self._page_latencies.observe(index_url, time.time() - start)
+        if status == 304 and cached is not None:
+            logger.debug("Revalidated %s", url)
+            self.page_cache.touch_page(page_url)
+            return cached["files"]
+        if status == 404:
+            # like pip, a project missing from one of the indexes is not an error
+            files = []
+        elif status != 200:
+            raise IndexClientError("GET {} returned HTTP {}".format(url, status))
+        else:
+            content_type = headers.get("content-type", "")
+            content_type = content_type.split(";")[0].strip().lower()
+            if content_type == SIMPLE_JSON_CONTENT_TYPE:
+                files = parse_json_page(body, url)
+            else:
+                files = parse_html_page(body, url)
+        if self.page_cache is not None:
+            self.page_cache.set_page(
+                page_url, files, headers.get("etag"), headers.get("last-modified")
+            )
+        return files
+
+    def get_project_files(self, project):
+        """Get the files of a project from all configured indexes."""
+        project = canonicalize_name(project)
+        if project not in self._project_files:
+            # concurrent lookups of the same project wait for the first one
+            self._project_flights.do(project, self._find_project_files, project)
+        return self._project_files[project]
+
+    def _find_project_files(self, project):
+        if project in self._project_files:
+            return
+        if self.hedge:
+            # the first mirror that knows the project answers
+            mirrors = self._page_latencies.rank(self.index_urls)
+            files = hedge(
+                [partial(self._get_index_page, url, project) for url in mirrors],
+                self._page_latencies.deadline(mirrors[0]),
+            )
+        else:
+            # query the extra indexes concurrently with the primary one, but only
+            # wait for them if the indexes before them do not list the project
+            jobs = [
+                spawn(self._get_index_page, url, project) for url in self.index_urls[1:]
+            ]
+            pages = itertools.chain(
+                [self._get_index_page(self.index_urls[0], project)],
+                (job.get() for job in jobs),
+            )
+            files = merge_index_pages(pages)
+        self._project_files[project] = files
+
+    def _get_index_page(self, index_url, project):
+        """Get the files of a project on a single index, cached per index."""
+        key = (index_url, project)
+        if key not in self._index_pages:
+            files = self.get_project_page(index_url, project)
+            for file in files:
+                self._file_indexes[file["url"]] = key
+            self._index_pages[key] = files
+        return self._index_pages[key]
+
+    def _hedge_file(self, file, func):
+        """Call func(file), hedged by calls for the same file on the other mirrors."""
+        if not self.hedge or file["url"] not in self._file_indexes:
+            return func(file)
+        index_url, project = self._file_indexes[file["url"]]
+        mirrors = [index_url] + [
+            url
+            for url in self._page_latencies.rank(self.index_urls)
+            if url != index_url
+        ]
+        return hedge(
+            [
+                partial(self._call_mirror_file, url, project, file["filename"], func)
+                for url in mirrors
+            ],
+            self._metadata_latencies.deadline(index_url),
+            accept=lambda metadata: True,
+        )
+
+    def _call_mirror_file(self, index_url, project, filename, func):
+        for file in self._get_index_page(index_url, project):
+            if file["filename"] == filename:
+                start = time.time()
+                result = func(file)
+                self._metadata_latencies.observe(index_url, time.time() - start)
+                return result
+        raise IndexClientError("{} not found on {}".format(filename, index_url))
+
+    def get_candidates(self, project):
+        """Get (version, file) pairs installable on the running interpreter."""
+        project = canonicalize_name(project)
+        candidates = []
+        for file in self.get_project_files(project):
+            filename = file["filename"]
+            if filename.endswith(".whl") and not is_supported_wheel(filename):
+                continue
+            if not is_compatible_python(file["requires_python"]):
+                continue
+            version = version_from_filename(filename, project)
+            if version is not None:
+                candidates.append((version, file))
+        return candidates
+
+    def get_available_versions(self, project):
+        """Get all versions pip would consider, sorted ascending like pip does."""
+        versions = {version for version, _ in self.get_candidates(project)}
+        return sorted(versions, key=Version)
+
+    def find_best_candidate(self, req, pre):
+        """Find the version and wheel pip would install for a requirement.
+
+        Args:
+            req (pkg_resources.Requirement): requirement without url
+            pre (bool): pip --pre flag
+
+        Returns:
+            tuple: (version, file) where file is the preferred wheel for version,
+                or None if the best version has no compatible wheel.
+
+        """
+        project = canonicalize_name(req.name)
+        candidates = self.get_candidates(project)
+        if ":all:" in self.only_binary or project in self.only_binary:
+            candidates = [c for c in candidates if c[1]["filename"].endswith(".whl")]
+        prereleases = True if pre else None
+        # like pip (PEP 592), yanked files are only selected when nothing else
+        # matches, e.g. for an exact pin of a yanked release
+        allowed = set(
+            req.specifier.filter(
+                {version for version, file in candidates if not file["yanked"]},
+                prereleases=prereleases,
+            )
+        )
+        if not allowed:
+            allowed = set(
+                req.specifier.filter(
+                    {version for version, _ in candidates}, prereleases=prereleases
+                )
+            )
+            if allowed:
+                logger.debug("Only yanked releases of {} match".format(req))
+        if not allowed:
+            raise IndexClientError("No matching distribution found for {}".format(req))
+        if self.prefer_binary:
+            binaries = {
+                version
+                for version, file in candidates
+                if file["filename"].endswith(".whl")
+            }
+            best = max(
+                allowed, key=lambda version: (version in binaries, Version(version))
+            )
+        else:
+            best = max(allowed, key=Version)
+        wheels = [
+            (wheel_tag_rank(file["filename"]), file)
+            for version, file in candidates
+            if version == best and file["filename"].endswith(".whl")
+        ]
+        if not wheels:
+            return best, None
+        return best, min(wheels, key=lambda x: (bool(x[1]["yanked"]), x[0]))[1]
+
+    def get_core_metadata(self, file):
+        """Download and parse the PEP 658 core metadata file of a distribution."""
+        return self._hedge_file(file, self._get_core_metadata)
+
+    def _get_core_metadata(self, file):
+        url = file["url"] + ".metadata"
+        status, _, body, _ = self.request(url)
+        if status != 200:
+            raise IndexClientError("GET {} returned HTTP {}".format(url, status))
+        if isinstance(file["metadata"], dict):
+            _verify_hashes(body, file["metadata"], url)
+        return parse_metadata(body.decode("utf-8", errors="replace"))
+
+    def get_wheel_metadata_lazily(self, file):
+        """Read the core metadata from a remote wheel using HTTP range requests.
+
+        Only the zip central directory and the METADATA member are downloaded.
+        """
+        return self._hedge_file(file, self._get_wheel_metadata_lazily)
+
+    def _get_wheel_metadata_lazily(self, file):
+        url = file["url"]
+        if urlparse(url).scheme == "file":
+            fp = open(url2pathname(urlparse(url).path), "rb")
+        else:
+            status, headers, _, url = self.request(
+                url, {"Accept-Encoding": "identity"}, method="HEAD"
+            )
+            if status != 200 or headers.get("accept-ranges") != "bytes":
+                raise IndexClientError("{} does not support range requests".format(url))
+            fp = LazyRemoteFile(self, url, int(headers["content-length"]))
+            fp.prefetch_tail(LAZY_TAIL_SIZE)
+        try:
+            with zipfile.ZipFile(fp) as wheel:
+                member = _find_metadata_member(wheel.namelist())
+                text = wheel.read(member).decode("utf-8", errors="replace")
+        except zipfile.BadZipfile as exc:
+            raise IndexClientError("Failed to read {}: {}".format(url, exc))
+        finally:
+            if not isinstance(fp, LazyRemoteFile):
+                fp.close()
+        return parse_metadata(text)
@@ -0,0 +1,188 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""
+Version sets as bitsets, an alternative to the interval algebra of Range and Union.
+
+Each package gets a universe: the sorted bounds of the ranges seen for it so far.
+These split all versions into atoms, namely each bound and the open interval below
+it (and the one above the last bound). A union of ranges with bounds in the universe
+is a union of atoms, so it becomes an int with bit 2i + 1 set for the i-th bound and
+bit 2i for the interval below it, and the algebra of such sets becomes bit operations.
+
+Adding a bound renumbers the atoms, so masks are only valid for the generation of
+the universe they were computed for. Ranges bounded by VCS versions, and single
+pre-release versions, which Range does not compare like intervals (see
+Range.is_strictly_lower and Range.is_strictly_higher), are left to the interval
+algebra, as are empty and degenerate ranges, and unions whose ranges overlap or
+touch (which Union.of leaves apart next to such pre-release versions).
+"""
+import bisect
+from typing import Any, Dict, Hashable, List, Optional
+
+from pipgrip.libs.mixology.range import Range
+from pipgrip.libs.mixology.union import Union
+from pipgrip.sorted_versions import version_key
+
+_universes = None  # type: Optional[Dict[Hashable, VersionUniverse]]
+
+
+def set_version_bitsets(enabled):  # type: (bool) -> None
+    """Enable or disable bitsets for the constraints of all packages."""
+    global _universes
+    _universes = {} if enabled else None
+
+
+def get_universe(package):  # type: (Hashable) -> Optional[VersionUniverse]
+    """Return the universe of package, or None if bitsets are disabled."""
+    if _universes is None:
+        return None
+    universe = _universes.get(package)
+    if universe is None:
+        universe = _universes[package] = VersionUniverse()
+    return universe
+
+
+class VersionUniverse(object):
+    """The sorted bounds of the ranges of a package, see the module docstring."""
+
+    def __init__(self):  # type: () -> None
+        self.generation = 0
+        self._keys = []  # type: List[tuple]
+        self._prereleases = []  # type: List[bool]
+        self._prerelease_mask = None  # type: Optional[int]
+
+    @property
+    def full(self):  # type: () -> int
+        """The mask of all versions."""
+        return (1 << (2 * len(self._keys) + 1)) - 1
+
+    def add_bounds(self, constraint):  # type: (Any) -> bool
+        """Add the bounds of constraint, or return False if it is not supported."""
+        if constraint.is_empty():
+            return False
+        bounds = []
+        for range_ in _ranges(constraint):
+            if not _is_interval(range_):
+                return False
+            bounds.extend(
+                bound for bound in (range_.min, range_.max) if bound is not None
+            )
+
+        for bound in bounds:
+            key = version_key(bound)
+            index = bisect.bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                continue
+            self._keys.insert(index, key)
+            self._prereleases.insert(index, bound.is_prerelease())
+            self._prerelease_mask = None
+            self.generation += 1
+        return True
+
+    def mask(self, constraint):  # type: (Any) -> Optional[int]
+        """Return the mask of constraint, or None if it is not supported.
+
+        The bounds of constraint need to be added first.
+
+        """
+        mask = 0
+        previous = -2
+        for range_ in _ranges(constraint):
+            if not _is_interval(range_):
+                return None
+            if range_.min is None:
+                lower = 0
+            else:
+                index = self._index(range_.min)
+                if index is None:
+                    return None
+                lower = 2 * index + (1 if range_.include_min else 2)
+            if range_.max is None:
+                upper = 2 * len(self._keys)
+            else:
+                index = self._index(range_.max)
+                if index is None:
+                    return None
+                upper = 2 * index + (1 if range_.include_max else 0)
+            if lower > upper:
+                return None
+            if lower <= previous + 1:
+                # overlapping or touching ranges, see the module docstring:
+                # Range.difference does not subtract these like one interval
+                return None
+            previous = upper
+            mask |= (1 << (upper + 1)) - (1 << lower)
+        return self.check(mask)
+
+    def check(self, mask):  # type: (int) -> Optional[int]
+        """Return mask, or None if it is empty or contains a single pre-release version."""
+        if self._prerelease_mask is None:
+            self._prerelease_mask = sum(
+                1 << (2 * index + 1)
+                for index, prerelease in enumerate(self._prereleases)
+                if prerelease
+            )
+        isolated = mask & ~(mask << 1) & ~(mask >> 1)
+        if isolated & self._prerelease_mask or not mask:
+            return None
+        return mask
+
+    def _index(self, version):  # type: (Any) -> Optional[int]
+        key = version_key(version)
+        index = bisect.bisect_left(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return index
+        return None
+
+
+def _ranges(constraint):  # type: (Any) -> List[Range]
+    if isinstance(constraint, Union):
+        return constraint.ranges
+    return [constraint]
+
+
+def _is_interval(range_):  # type: (Range) -> bool
+    """Return whether Range treats range_ like the interval between its bounds."""
+    for bound, included in (
+        (range_.min, range_.include_min),
+        (range_.max, range_.include_max),
+    ):
+        if bound is None and included or bound is not None and bound.is_vcs():
+            # e.g. Range.is_contiguous_to compares unbounded ends
+            return False
+    if range_.min is not None and range_.max is not None:
+        if range_.max < range_.min:
+            return False
+        if range_.min == range_.max:
+            return range_.include_min and range_.include_max
+    return True
@@ -30,9 +30,10 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 # SPDX-License-Identifier: BSD-3-Clause
-from typing import Hashable
+from typing import Any, Hashable, List, Optional, Tuple
 from typing import Union as _Union
 
+from pipgrip.libs.mixology.bitset import VersionUniverse, get_universe
 from pipgrip.libs.mixology.package import Package
 from pipgrip.libs.mixology.range import Range
 from pipgrip.libs.mixology.set_relation import SetRelation
@@ -49,6 +50,13 @@ class Constraint(object):
     ):  # type: (Hashable, _Union[Range, Union]) -> None
         self._package = package
         self._constraint = constraint
+        # With bitsets enabled, the universe of the package, and the mask of the
+        # versions allowed by this constraint in it, valid for one generation of
+        # the universe. And the operation that computes _constraint, until needed.
+        self._universe = None  # type: Optional[VersionUniverse]
+        self._mask = None  # type: Optional[int]
+        self._generation = None  # type: Optional[int]
+        self._operation = None  # type: Optional[Tuple[str, Constraint, Constraint]]
 
     @property
     def package(self):  # type: () -> Hashable
@@ -56,21 +64,45 @@ class Constraint(object):
 
     @property
     def constraint(self):  # type: () -> _Union[Range, Union]
+        if self._operation is not None:
+            self._evaluate()
         return self._constraint
 
     @property
     def inverse(self):  # type: () -> Constraint
         new_constraint = self.constraint.inverse
 
-        return self.__class__(self.package, new_constraint)
+        inverse = self.__class__(self.package, new_constraint)
+        masks = _masks(self)
+        if masks is not None:
+            universe, (mask,) = masks
+            inverse._universe = universe
+            inverse._mask = universe.check(universe.full ^ mask)
+            inverse._generation = universe.generation
+        return inverse
 
     def allows_all(self, other):  # type: (Constraint) -> bool
+        masks = _masks(self, other)
+        if masks is not None:
+            _, (mask, other_mask) = masks
+            return not other_mask & ~mask
+
         return self.constraint.allows_all(other.constraint)
 
     def allows_any(self, other):  # type: (Constraint) -> bool
+        masks = _masks(self, other)
+        if masks is not None:
+            _, (mask, other_mask) = masks
+            return bool(mask & other_mask)
+
         return self.constraint.allows_any(other.constraint)
 
     def difference(self, other):  # type: (Constraint) -> Constraint
+        masks = _masks(self, other)
+        if masks is not None:
+            universe, (mask, other_mask) = masks
+            return self._lazy(universe, mask & ~other_mask, "difference", self, other)
+
         return self.__class__(
             self.package, self.constraint.difference(other.constraint)
         )
@@ -79,6 +111,11 @@ class Constraint(object):
         if other.package != self.package:
             raise ValueError("Cannot intersect two constraints for different packages")
 
+        masks = _masks(self, other)
+        if masks is not None:
+            universe, (mask, other_mask) = masks
+            return self._lazy(universe, mask & other_mask, "intersect", self, other)
+
         return self.__class__(self.package, self.constraint.intersect(other.constraint))
 
     def union(self, other):  # type: (Constraint) -> Constraint
@@ -87,8 +124,48 @@ class Constraint(object):
                 "Cannot build an union of two constraints for different packages"
             )
 
+        masks = _masks(self, other)
+        if masks is not None:
+            universe, (mask, other_mask) = masks
+            return self._lazy(universe, mask | other_mask, "union", self, other)
+
         return self.__class__(self.package, self.constraint.union(other.constraint))
 
+    def _lazy(
+        self, universe, mask, *operation
+    ):  # type: (VersionUniverse, int, Any) -> Constraint
+        """Return the result of operation, with mask and without computing it yet."""
+        constraint = self.__class__(self.package, None)
+        constraint._operation = operation
+        constraint._universe = universe
+        constraint._mask = universe.check(mask)
+        constraint._generation = universe.generation
+        if constraint._mask is None:
+            # empty, or not supported by bitsets
+            constraint._evaluate()
+        return constraint
+
+    def _evaluate(self):  # type: () -> None
+        """Compute _constraint from the operations it depends on, oldest first."""
+        stack = [self]
+        while stack:
+            constraint = stack[-1]
+            if constraint._operation is None:
+                stack.pop()
+                continue
+            name, operands = constraint._operation[0], constraint._operation[1:]
+            pending = [
+                operand for operand in operands if operand._operation is not None
+            ]
+            if pending:
+                stack.extend(pending)
+                continue
+            constraint._constraint = getattr(operands[0]._constraint, name)(
+                operands[1]._constraint
+            )
+            constraint._operation = None
+            stack.pop()
+
     def is_subset_of(self, other):  # type: (Constraint) -> bool
         return other.allows_all(self)
 
@@ -107,10 +184,13 @@ class Constraint(object):
             return SetRelation.DISJOINT
 
     def is_any(self):  # type: () -> bool
-        return self._constraint.is_any()
+        return self.constraint.is_any()
 
     def is_empty(self):  # type: () -> bool
-        return self._constraint.is_empty()
+        if self._operation is not None and self._mask is not None:
+            # results of operations with an empty mask are not lazy
+            return False
+        return self.constraint.is_empty()
 
     def __eq__(self, other):  # type: (Constraint) -> bool
         if not isinstance(other, Constraint):
@@ -136,3 +216,33 @@ class Constraint(object):
 
     def __repr__(self):
         return "<Constraint {}>".format(str(self))
+
+
+def _masks(
+    *constraints,
+):  # type: (Constraint) -> Optional[Tuple[VersionUniverse, List[int]]]
+    """Return the universe of the package of constraints and their masks, if supported."""
+    for constraint in constraints:
+        if constraint._universe is None:
+            constraint._universe = get_universe(constraint.package)
+    universe = constraints[0]._universe
+    if universe is None or any(c._universe is not universe for c in constraints[1:]):
+        return None
+
+    # first add all bounds, as these may renumber the atoms
+    for constraint in constraints:
+        if constraint._generation != universe.generation:
+            if not universe.add_bounds(constraint.constraint):
+                constraint._mask = None
+                constraint._generation = universe.generation
+                return None
+
+    masks = []
+    for constraint in constraints:
+        if constraint._generation != universe.generation:
+            constraint._mask = universe.mask(constraint.constraint)
+            constraint._generation = universe.generation
+        if constraint._mask is None:
+            return None
+        masks.append(constraint._mask)
+    return universe, masks
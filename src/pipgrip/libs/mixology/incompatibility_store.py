@@ -0,0 +1,72 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+from typing import Dict, Hashable, List, Tuple
+
+from pipgrip.libs.mixology.incompatibility import Incompatibility
+
+
+class IncompatibilityStore(object):
+    """
+    The incompatibilities of each package, in insertion order.
+
+    An incompatibility is stored once per package: adding it again is a no-op.
+    Incompatibilities are told apart by identity, like the solver always did:
+    the ones created anew for a version chosen again after backtracking are
+    added again, which keeps the derivations (and so the failure messages)
+    the same.
+
+    Each incompatibility has a position per package: its index in
+    for_package().
+    """
+
+    def __init__(self):  # type: () -> None
+        self._by_package = {}  # type: Dict[Hashable, List[Incompatibility]]
+        self._positions = {}  # type: Dict[Tuple[Hashable, Hashable], int]
+
+    def add(self, incompatibility):  # type: (Incompatibility) -> None
+        for term in incompatibility.terms:
+            known = (term.package, incompatibility)
+            if known in self._positions:
+                continue
+
+            incompatibilities = self._by_package.setdefault(term.package, [])
+            self._positions[known] = len(incompatibilities)
+            incompatibilities.append(incompatibility)
+
+    def for_package(self, package):  # type: (Hashable) -> List[Incompatibility]
+        return self._by_package[package]
+
+    def position(
+        self, package, incompatibility
+    ):  # type: (Hashable, Incompatibility) -> int
+        return self._positions[(package, incompatibility)]
@@ -30,7 +30,7 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 # SPDX-License-Identifier: BSD-3-Clause
-from typing import Any, Hashable, List
+from typing import Any, Hashable, List, Optional, Set
 from typing import Union as _Union
 
 from pipgrip.libs.mixology.constraint import Constraint
@@ -116,6 +116,37 @@ class PackageSource(object):
     def dependencies_for(self, package, version):  # type: (Hashable, Any) -> List[Any]
         raise NotImplementedError()
 
+    def known_versions_for(
+        self, package, constraint=None
+    ):  # type: (Hashable, Any) -> Optional[List[Hashable]]
+        """
+        Like versions_for(), but without discovering anything:
+        returns None if the versions of the package are not known yet.
+        """
+        return self.versions_for(package, constraint)
+
+    def known_dependencies_for(
+        self, package, version
+    ):  # type: (Hashable, Any) -> Optional[List[Any]]
+        """
+        Like dependencies_for(), but without discovering anything:
+        returns None if the dependencies of the version are not known yet.
+        """
+        return self.dependencies_for(package, version)
+
+    def metadata_revision(self, package):  # type: (Hashable) -> Hashable
+        """
+        Returns a value that changes whenever the versions or dependencies
+        known for the given package change.
+        """
+        return None
+
+    def take_metadata_changes(self):  # type: () -> Set[Hashable]
+        """
+        Returns the packages whose metadata revision changed since the last call.
+        """
+        return set()
+
     def convert_dependency(
         self, dependency
     ):  # type: (Any) -> _Union[Constraint, Range, Union]
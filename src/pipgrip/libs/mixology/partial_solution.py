@@ -30,13 +30,13 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 # SPDX-License-Identifier: BSD-3-Clause
-from typing import Any, Dict, Hashable, List
+import itertools
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
 
 from pipgrip.libs.mixology._compat import OrderedDict
 from pipgrip.libs.mixology.assignment import Assignment
 from pipgrip.libs.mixology.constraint import Constraint
 from pipgrip.libs.mixology.incompatibility import Incompatibility
-from pipgrip.libs.mixology.package import Package
 from pipgrip.libs.mixology.set_relation import SetRelation
 from pipgrip.libs.mixology.term import Term
 
@@ -59,6 +59,9 @@ class PartialSolution:
         # The decisions made for each package.
         self._decisions = OrderedDict()  # type: Dict[str, Hashable]
 
+        # The keys of _decisions, which carry the extras that were decided.
+        self._decision_packages = {}  # type: Dict[Hashable, Hashable]
+
         # The intersection of all positive Assignments for each package, minus any
         # negative Assignments that refer to that package.
         #
@@ -73,6 +76,36 @@ class PartialSolution:
         # This is derived from self._assignments.
         self._negative = OrderedDict()  # type: Dict[Hashable, Dict[Hashable, Term]]
 
+        # Incremented whenever _positive or _negative changes for a package, so
+        # the relation of a term to this solution is unchanged while the stamp
+        # of its package is.
+        self._stamps = {}  # type: Dict[Hashable, int]
+
+        # The packages whose stamp changed since the last call to
+        # take_stamp_changes().
+        self._stamp_changes = set()  # type: Set[Hashable]
+
+        # The assignments of each package, in the order they were assigned. Each
+        # comes with the package's positive and negative term after registering
+        # it, and the index of the assignment that added the package to
+        # _positive or _negative (where later ones only update its term).
+        self._history = {}  # type: Dict[Hashable, List[Tuple]]
+
+        # The cumulative terms satisfier() computed over a prefix of each
+        # package's history.
+        self._satisfier_terms = {}  # type: Dict[Hashable, List[Optional[Term]]]
+
+        # The terms of _positive that the decisions don't satisfy yet, with the
+        # position of their package in _positive.
+        self._unsatisfied = {}  # type: Dict[Hashable, Tuple[int, Term]]
+        self._unsatisfied_terms = None  # type: Optional[List[Term]]
+        self._positions = {}  # type: Dict[Hashable, int]
+        self._next_position = itertools.count()
+
+        # The packages whose entry in _unsatisfied may have changed since the
+        # last call to take_unsatisfied_changes().
+        self._unsatisfied_changes = set()  # type: Set[Hashable]
+
         # The number of distinct solutions that have been attempted so far.
         self._attempted_solutions = 1
 
@@ -93,18 +126,42 @@ class PartialSolution:
 
     @property
     def unsatisfied(self):  # type: () -> List[Term]
-        decision_packages = {key: key for key in self._decisions.keys()}
-        unsatisfied = [
-            term
-            for term in self._positive.values()
-            if term.package not in self._decisions
+        """Return the terms of _positive that the decisions don't satisfy, in order."""
+        if self._unsatisfied_terms is None:
+            self._unsatisfied_terms = [
+                term for _, term in sorted(self._unsatisfied.values(), key=_position)
+            ]
+        return list(self._unsatisfied_terms)
+
+    def unsatisfied_term(
+        self, package
+    ):  # type: (Hashable) -> Optional[Tuple[int, Term]]
+        """Return the unsatisfied term of package and its position, if any."""
+        return self._unsatisfied.get(package)
+
+    def take_unsatisfied_changes(self):  # type: () -> Set[Hashable]
+        """Return the packages whose unsatisfied term changed since the last call."""
+        changes, self._unsatisfied_changes = self._unsatisfied_changes, set()
+        return changes
+
+    def _update_unsatisfied(self, package):  # type: (Hashable) -> None
+        term = self._positive.get(package)
+        decided = self._decision_packages.get(package)
+        if term is not None and (
+            decided is None
             # if package is in _decisions, but with less extras, this term is also unsatisfied
             # therefore we need to inspect the key in self._decisions
-            or not term.package.req.extras.issubset(
-                decision_packages[term.package].req.extras
-            )
-        ]
-        return unsatisfied
+            or not term.package.req.extras.issubset(decided.req.extras)
+        ):
+            self._unsatisfied[package] = (self._positions[package], term)
+        elif package in self._unsatisfied:
+            del self._unsatisfied[package]
+        self._unsatisfied_terms = None
+        self._unsatisfied_changes.add(package)
+
+    def _add_positive(self, package, term):  # type: (Hashable, Term) -> None
+        self._positive[package] = term
+        self._positions[package] = next(self._next_position)
 
     def decide(self, package, version):  # type: (Hashable, Any) -> None
         """Add an assignment of package as decision and increment the decision level."""
@@ -120,6 +177,7 @@ class PartialSolution:
             # package might contain new extras, so need to replace the key
             del self._decisions[package]
         self._decisions[package] = version
+        self._decision_packages[package] = package
 
         self._assign(
             Assignment.decision(
@@ -145,12 +203,16 @@ class PartialSolution:
         """Add an Assignment to _assignments and _positive or _negative."""
         self._assignments.append(assignment)
         self._register(assignment)
+        self._update_unsatisfied(assignment.package)
 
-    def backtrack(self, decision_level):  # type: (int) -> None
+    def backtrack(self, decision_level):  # type: (int) -> Set[Hashable]
         """Perform backtracking.
 
         Resets the current decision level to decision_level, and removes all
         assignments made after that level.
+
+        Returns the packages of the removed assignments that are no longer
+        required by the remaining assignments.
         """
         self._backtracking = True
 
@@ -158,27 +220,52 @@ class PartialSolution:
         while self._assignments[-1].decision_level > decision_level:
             removed = self._assignments.pop(-1)
             packages.add(removed.package)
+            self._history[removed.package].pop(-1)
             if removed.is_decision() and removed.package in self._decisions:
                 del self._decisions[removed.package]
+                del self._decision_packages[removed.package]
 
-        # Re-compute _positive and _negative for the packages that were removed.
+        # Restore _positive and _negative for the packages that were removed from
+        # their histories, re-adding them in the order registering the remaining
+        # assignments from scratch would.
+        restored = []
         for package in packages:
+            self._touch(package)
             if package in self._positive:
                 del self._positive[package]
+                del self._positions[package]
 
             if package in self._negative:
                 del self._negative[package]
 
-        for assignment in self._assignments:
-            if assignment.package in packages:
-                self._register(assignment)
+            history = self._history[package]
+            del self._satisfier_terms.get(package, [])[len(history) :]
+            if history:
+                restored.append(history[-1])
+
+        for _, positive, negative, added_by in sorted(
+            restored, key=lambda entry: entry[3]
+        ):
+            package = self._assignments[added_by].package
+            if positive is not None:
+                self._add_positive(package, positive)
+            else:
+                self._negative[package] = {package: negative}
+
+        for package in packages:
+            self._update_unsatisfied(package)
+
+        return {package for package in packages if package not in self._positive}
 
     def _register(self, assignment):  # type: (Assignment) -> None
         """Register an Assignment in _positive or _negative."""
         package = assignment.package
+        self._touch(package)
+        history = self._history.setdefault(package, [])
         old_positive = self._positive.get(package)
         if old_positive is not None:
             self._positive[package] = old_positive.intersect(assignment)
+            history.append((assignment, self._positive[package], None, history[-1][3]))
             return
 
         ref = assignment.package
@@ -193,12 +280,32 @@ class PartialSolution:
             if package in self._negative:
                 del self._negative[package]
 
-            self._positive[package] = term
+            self._add_positive(package, term)
+            history.append((assignment, term, None, assignment.index))
         else:
             if package not in self._negative:
                 self._negative[package] = {}
+                added_by = assignment.index
+            else:
+                added_by = history[-1][3]
 
             self._negative[package][package] = term
+            history.append((assignment, None, term, added_by))
+
+    def _touch(self, package):  # type: (Hashable) -> None
+        self._stamps[package] = self._stamps.get(package, 0) + 1
+        self._stamp_changes.add(package)
+
+    def stamp(self, package):  # type: (Hashable) -> int
+        """Return the version of the assignments to package (see _stamps)."""
+        return self._stamps.get(package, 0)
+
+    def take_stamp_changes(self):  # type: () -> Set[Hashable]
+        """Return the packages whose stamp changed since the last call."""
+        if not self._stamp_changes:
+            return self._stamp_changes
+        changes, self._stamp_changes = self._stamp_changes, set()
+        return changes
 
     def satisfier(self, term):  # type: (Term) -> Assignment
         """Return Assignment that satisfies Term.
@@ -206,32 +313,22 @@ class PartialSolution:
         Returns the first Assignment in this solution such that the sublist of
         assignments up to and including that entry collectively satisfies term.
         """
-        assigned_term = None  # type: Term
-
-        for assignment in self._assignments:
-            if assignment.package != term.package:
-                continue
-
-            if (
-                assignment.package != Package.root()
-                and not assignment.package == term.package
-            ):
-                if not assignment.is_positive():
-                    continue
-
-                assert not term.is_positive()
-
-                return assignment
-
-            if assigned_term is None:
-                assigned_term = assignment
-            else:
-                assigned_term = assigned_term.intersect(assignment)
-                if assigned_term is None:
-                    continue
+        # The intersection of the package's assignments so far, starting over
+        # after an empty intersection.
+        assigned_terms = self._satisfier_terms.setdefault(term.package, [])
+
+        for i, entry in enumerate(self._history.get(term.package, [])):
+            assignment = entry[0]
+            if i == len(assigned_terms):
+                assigned_term = assigned_terms[-1] if assigned_terms else None
+                assigned_terms.append(
+                    assignment
+                    if assigned_term is None
+                    else assigned_term.intersect(assignment)
+                )
 
             # As soon as we have enough assignments to satisfy term, return them.
-            if assigned_term.satisfies(term):
+            if assigned_terms[i] is not None and assigned_terms[i].satisfies(term):
                 return assignment
 
         raise RuntimeError("[BUG] {} is not satisfied.".format(term))
@@ -260,3 +357,7 @@ class PartialSolution:
             return SetRelation.OVERLAPPING
 
         return negative.relation(term)
+
+
+def _position(entry):  # type: (Tuple[int, Term]) -> int
+    return entry[0]
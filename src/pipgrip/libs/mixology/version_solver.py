@@ -30,12 +30,14 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 #
 # SPDX-License-Identifier: BSD-3-Clause
+import heapq
+import itertools
 import logging
 import time
-from multiprocessing.pool import ThreadPool
-from typing import Dict, Hashable, List, Optional, Union
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+from typing import Union as _Union
 
-from pipgrip.libs.mixology._compat import OrderedDict
+from pipgrip.concurrency import CANDIDATE, PriorityScheduler
 from pipgrip.libs.mixology.constraint import Constraint
 from pipgrip.libs.mixology.failure import SolverFailure
 from pipgrip.libs.mixology.incompatibility import Incompatibility
@@ -44,17 +46,29 @@ from pipgrip.libs.mixology.incompatibility_cause import (
     NoVersionsCause,
     RootCause,
 )
+from pipgrip.libs.mixology.incompatibility_store import IncompatibilityStore
 from pipgrip.libs.mixology.package_source import PackageSource
 from pipgrip.libs.mixology.partial_solution import PartialSolution
 from pipgrip.libs.mixology.range import Range
 from pipgrip.libs.mixology.result import SolverResult
 from pipgrip.libs.mixology.set_relation import SetRelation
 from pipgrip.libs.mixology.term import Term
+from pipgrip.libs.mixology.union import Union
 
 logger = logging.getLogger(__name__)
 
 _conflict = object()
 
+# How _next_term_to_try() ranks the unsatisfied terms: by their amount of versions
+# and then dependencies, discovering both for each term (FETCH_HEURISTIC), or by
+# what is known of them so far, and then by name (CACHED_HEURISTIC).
+FETCH_HEURISTIC = "fetch"
+CACHED_HEURISTIC = "cached"
+HEURISTICS = (FETCH_HEURISTIC, CACHED_HEURISTIC)
+
+# ranks terms with unknown versions or dependencies last in CACHED_HEURISTIC
+_UNKNOWN = float("inf")
+
 
 class VersionSolver:
     """
@@ -69,12 +83,37 @@ class VersionSolver:
         self,
         source,  # type: PackageSource
         threads=1,  # type: int
+        scheduler=None,  # type: Optional[PriorityScheduler]
+        heuristic=FETCH_HEURISTIC,  # type: str
     ):
+        if heuristic not in HEURISTICS:
+            raise ValueError("Unknown heuristic: {}".format(heuristic))
         self._source = source
-
-        self._incompatibilities = {}  # type: Dict[Hashable, List[Incompatibility]]
+        self._heuristic = heuristic
+
+        self._incompatibilities = IncompatibilityStore()
+        # The packages (and their PartialSolution stamps) whose terms made
+        # _propagate_incompatibility() return None for an incompatibility. As
+        # long as none of their stamps change, neither does the result.
+        self._watches = {}  # type: Dict[Incompatibility, Tuple[Tuple]]
+        # The incompatibilities watching each package, and the ones of each
+        # package that _propagate() has to visit: those without a watch, or
+        # with a watched package whose stamp changed since. An incompatibility
+        # may linger in _watchers after its watch moved elsewhere, which only
+        # costs a visit that the stamps then skip.
+        self._watchers = {}  # type: Dict[Hashable, Set[Incompatibility]]
+        self._pending = {}  # type: Dict[Hashable, Set[Incompatibility]]
         self._solution = PartialSolution()
-        self._threadpool = ThreadPool(threads)
+        # The unsatisfied terms as a heap of (priority, position, sequence, term),
+        # where only the last entry pushed for a package is current, and the
+        # priority of each (package, constraint) with the metadata revision of
+        # the package it was computed at.
+        self._candidates = []  # type: List[Tuple[Tuple, int, int, Term]]
+        self._candidate_sequences = {}  # type: Dict[Hashable, int]
+        self._candidate_sequence = itertools.count()
+        self._candidate_keys = {}  # type: Dict[Tuple, Tuple[Hashable, Tuple]]
+        # shared with the source for speculative discoveries, if any
+        self._scheduler = scheduler or PriorityScheduler(threads)
 
     @property
     def solution(self):  # type: () -> PartialSolution
@@ -136,12 +175,28 @@ class VersionSolver:
 
         while changed:
             package = changed.pop()
+            self._update_watches()
 
             # Iterate in reverse because conflict resolution tends to produce more
             # general incompatibilities as time goes on. If we look at those first,
             # we can derive stronger assignments sooner and more eagerly find
             # conflicts.
-            for incompatibility in reversed(self._incompatibilities[package]):
+            #
+            # Only the pending incompatibilities are visited, as a heap of their
+            # negated positions. One that becomes pending during the loop is
+            # pushed if it comes later in the iteration, so this visits what a
+            # full reversed pass re-evaluating each incompatibility would.
+            incompatibilities = self._incompatibilities.for_package(package)
+            pending = [
+                -self._incompatibilities.position(package, incompatibility)
+                for incompatibility in self._pending.get(package, ())
+            ]
+            heapq.heapify(pending)
+            while pending:
+                position = -heapq.heappop(pending)
+                while pending and -pending[0] == position:
+                    heapq.heappop(pending)
+                incompatibility = incompatibilities[position]
                 result = self._propagate_incompatibility(incompatibility)
 
                 if result is _conflict:
@@ -164,10 +219,16 @@ class VersionSolver:
                     break
                 elif result is not None:
                     changed.add(result)
+                    for dirty in self._update_watches().get(package, ()):
+                        dirty_position = self._incompatibilities.position(
+                            package, dirty
+                        )
+                        if dirty_position < position:
+                            heapq.heappush(pending, -dirty_position)
 
     def _propagate_incompatibility(
         self, incompatibility
-    ):  # type: (Incompatibility) -> Union[str, _conflict, None]
+    ):  # type: (Incompatibility) -> _Union[str, _conflict, None]
         """
         If incompatibility is almost satisfied by _solution, adds the
         negation of the unsatisfied term to _solution.
@@ -178,6 +239,13 @@ class VersionSolver:
 
         Otherwise, returns None.
         """
+        watches = self._watches.get(incompatibility)
+        if watches is not None and all(
+            self._solution.stamp(package) == stamp for package, stamp in watches
+        ):
+            self._settle(incompatibility)
+            return
+
         # The first entry in incompatibility.terms that's not yet satisfied by
         # _solution, if one exists. If we find more than one, _solution is
         # inconclusive for incompatibility and we can't deduce anything.
@@ -189,11 +257,13 @@ class VersionSolver:
                 # If term is already contradicted by _solution, then
                 # incompatibility is contradicted as well and there's nothing new we
                 # can deduce from it.
+                self._watch(incompatibility, term.package)
                 return
             elif relation == SetRelation.OVERLAPPING:
                 # If more than one term is inconclusive, we can't deduce anything about
                 # incompatibility.
                 if unsatisfied is not None and unsatisfied.package != term.package:
+                    self._watch(incompatibility, unsatisfied.package, term.package)
                     return
 
                 # If exactly one term in incompatibility is inconclusive, then it's
@@ -214,6 +284,41 @@ class VersionSolver:
 
         return unsatisfied.package
 
+    def _watch(
+        self, incompatibility, *packages
+    ):  # type: (Incompatibility, *Hashable) -> None
+        self._watches[incompatibility] = tuple(
+            (package, self._solution.stamp(package)) for package in packages
+        )
+        for package in packages:
+            self._watchers.setdefault(package, set()).add(incompatibility)
+        self._settle(incompatibility)
+
+    def _settle(self, incompatibility):  # type: (Incompatibility) -> None
+        """Stop visiting incompatibility, as its watch is current."""
+        for term in incompatibility.terms:
+            pending = self._pending.get(term.package)
+            if pending:
+                pending.discard(incompatibility)
+
+    def _unsettle(
+        self, incompatibility, dirty
+    ):  # type: (Incompatibility, Dict[Hashable, Set[Incompatibility]]) -> None
+        for term in incompatibility.terms:
+            self._pending.setdefault(term.package, set()).add(incompatibility)
+            dirty.setdefault(term.package, set()).add(incompatibility)
+
+    def _update_watches(self):  # type: () -> Dict[Hashable, Set[Incompatibility]]
+        """
+        Makes the watchers of the packages whose stamp changed pending again,
+        and returns them by package.
+        """
+        dirty = {}  # type: Dict[Hashable, Set[Incompatibility]]
+        for package in self._solution.take_stamp_changes():
+            for incompatibility in self._watchers.pop(package, ()):
+                self._unsettle(incompatibility, dirty)
+        return dirty
+
     def _resolve_conflict(
         self, incompatibility
     ):  # type: (Incompatibility) -> Incompatibility
@@ -294,7 +399,9 @@ class VersionSolver:
                 previous_satisfier_level < most_recent_satisfier.decision_level
                 or most_recent_satisfier.cause is None
             ):
-                self._solution.backtrack(previous_satisfier_level)
+                dropped = self._solution.backtrack(previous_satisfier_level)
+                # speculation started by packages that left the solution is moot
+                self._scheduler.cancel(groups={package.name for package in dropped})
                 if new_incompatibility:
                     self._add_incompatibility(incompatibility)
 
@@ -355,31 +462,86 @@ class VersionSolver:
         if not unsatisfied:
             return
 
+        if len(unsatisfied) == 1:
+            return unsatisfied[0]
+
         # Prefer packages with as few remaining versions as possible,
         # so that if a conflict is necessary it's forced quickly.
-        # at a tie, the package with least dependencies is chosen
-        def _get_min(term):
-            versions = self._source.versions_for(
-                term.package, term.constraint.constraint
-            )
-            deps = (
-                self._source.dependencies_for(term.package, versions[0])
-                if versions
-                else []
-            )
-            return len(versions), len(deps)
+        # at a tie, the package with least dependencies is chosen,
+        # and then the one that comes first in unsatisfied (or by name)
+        self._update_candidates()
+        while True:
+            _, _, sequence, term = self._candidates[0]
+            if self._candidate_sequences.get(term.package) == sequence:
+                return term
+            heapq.heappop(self._candidates)
 
-        if len(unsatisfied) == 1:
-            term = unsatisfied[0]
-        else:
-            terms = OrderedDict(
-                zip(unsatisfied, self._threadpool.map(_get_min, unsatisfied))
-            )
-            term = min(terms, key=terms.get)
+    def _update_candidates(self):  # type: () -> None
+        """
+        Push the unsatisfied terms that changed, or whose package metadata
+        changed, onto the candidates heap.
 
-        return term
+        Computing new keys may discover further metadata, hence the loop.
+        """
+        while True:
+            changes = self._solution.take_unsatisfied_changes()
+            changes.update(self._source.take_metadata_changes())
+            if not changes:
+                return
+
+            missing = []
+            for package in changes:
+                entry = self._solution.unsatisfied_term(package)
+                if entry is None:
+                    self._candidate_sequences.pop(package, None)
+                    continue
+                position, term = entry
+                key = _candidate_key(term)
+                revision = self._source.metadata_revision(term.package)
+                cached = self._candidate_keys.get(key)
+                if cached is not None and cached[0] == revision:
+                    self._push_candidate(cached[1], position, term)
+                else:
+                    missing.append((position, term, key, revision))
+
+            terms = [term for _, term, _, _ in missing]
+            if self._heuristic == CACHED_HEURISTIC:
+                priorities = [self._get_known_priority(term) for term in terms]
+            else:
+                priorities = self._scheduler.run_all(
+                    self._get_priority, terms, CANDIDATE
+                )
+            for (position, term, key, revision), priority in zip(missing, priorities):
+                self._candidate_keys[key] = (revision, priority)
+                self._push_candidate(priority, position, term)
+
+    def _push_candidate(
+        self, priority, position, term
+    ):  # type: (Tuple, int, Term) -> None
+        sequence = next(self._candidate_sequence)
+        self._candidate_sequences[term.package] = sequence
+        heapq.heappush(self._candidates, (priority, position, sequence, term))
+
+    def _get_priority(self, term):  # type: (Term) -> Tuple[int, int]
+        versions = self._source.versions_for(term.package, term.constraint.constraint)
+        deps = (
+            self._source.dependencies_for(term.package, versions[0]) if versions else []
+        )
+        return len(versions), len(deps)
+
+    def _get_known_priority(self, term):  # type: (Term) -> Tuple
+        package = term.package
+        versions = self._source.known_versions_for(package, term.constraint.constraint)
+        if versions is None:
+            return _UNKNOWN, _UNKNOWN, str(package)
+        deps = (
+            self._source.known_dependencies_for(package, versions[0])
+            if versions
+            else []
+        )
+        return len(versions), _UNKNOWN if deps is None else len(deps), str(package)
 
-    def _choose_package_version(self):  # type: () -> Union[Hashable, None]
+    def _choose_package_version(self):  # type: () -> _Union[Hashable, None]
         """
         Tries to select a version of a required package.
 
@@ -429,11 +591,16 @@ class VersionSolver:
     def _add_incompatibility(self, incompatibility):  # type: (Incompatibility) -> None
         logger.info("fact: {}".format(incompatibility))
 
-        for term in incompatibility.terms:
-            if term.package not in self._incompatibilities:
-                self._incompatibilities[term.package] = []
+        self._incompatibilities.add(incompatibility)
+        self._unsettle(incompatibility, {})
 
-            if incompatibility in self._incompatibilities[term.package]:
-                continue
 
-            self._incompatibilities[term.package].append(incompatibility)
+def _candidate_key(term):  # type: (Term) -> Tuple
+    # the requirement string carries the extras and url of the package
+    constraint = term.constraint.constraint
+    if isinstance(constraint, Union):
+        constraint = tuple(constraint.ranges)
+    elif constraint.is_empty():
+        # EmptyRange is not hashable
+        constraint = ()
+    return term.package.req.__str__(), constraint
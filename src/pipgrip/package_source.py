@@ -31,8 +31,13 @@
 #
 # SPDX-License-Identifier: BSD-3-Clause
 import logging
-from typing import Any, Dict, Hashable, List, Optional
+import subprocess
+import threading
+from multiprocessing.pool import ThreadPool
+from typing import Any, Dict, Hashable, List, Optional, Set
 
+from pipgrip.cache import DEFAULT_CACHE_TTL, OFFLINE_FAILURE_STR, open_metadata_cache
+from pipgrip.concurrency import SPECULATIVE, PriorityScheduler, SingleFlight
 from pipgrip.libs.mixology.constraint import Constraint
 from pipgrip.libs.mixology.package import Package
 from pipgrip.libs.mixology.package_source import PackageSource as BasePackageSource
@@ -40,18 +45,39 @@ from pipgrip.libs.mixology.range import Range
 from pipgrip.libs.mixology.union import Union
 from pipgrip.libs.semver import Version, VersionRange, parse_constraint
 from pipgrip.pipper import (
+    discover_cached_dependencies_and_versions,
     discover_dependencies_and_versions,
+    get_requirements,
     is_unneeded_dep,
     parse_req,
 )
+from pipgrip.sorted_versions import SortedVersions
 
 logger = logging.getLogger(__name__)
 
+# prefetching is opt-in, as it may discover packages the solver never needs
+DEFAULT_PREFETCH_DEPTH = -1
+DEFAULT_PREFETCH_BUDGET = 100
+# speculation is opt-in too: it adds discoveries, and which ones finish first
+# depends on thread timing
+DEFAULT_SPECULATION_BUDGET = 0
+
 
 def is_vcs_version(version):  # type: (str) -> bool
     return Version.parse(version).is_vcs()
 
 
+def _filter_versions(
+    versions, constraint
+):  # type: (List[Version], Any) -> List[Version]
+    """Return the versions allowed by constraint, in the same order."""
+    return [
+        version
+        for version in versions
+        if not constraint or constraint.allows_any(Range(version, version, True, True))
+    ]
+
+
 def render_pin(package, version):  # type: (str, str) -> str
     if package.startswith("."):
         return package
@@ -127,19 +153,46 @@ class PackageSource(BasePackageSource):
         index_url,
         extra_index_url,
         pre,
+        offline=False,
+        cache_ttl=DEFAULT_CACHE_TTL,
     ):  # type: () -> None
         self._root_version = Version.parse("0.0.0")
         self._root_dependencies = []
         self._packages = {}
         self._packages_metadata = {}
+        # the keys of _packages[name][extras], sorted for _versions_for
+        self._sorted_versions = {}
+        # bumped whenever _packages changes for a name, see metadata_revision
+        self._revisions = {}
+        self._changed = set()
+        # the solver discovers packages from multiple threads
+        self._lock = threading.RLock()
+        self._discoveries = SingleFlight()
+        self._scheduler = None
+        self._speculation_budget = 0
+        # (key, extras, url) -> Job of the speculative discoveries submitted
+        self._speculations = {}
+        # pip string -> results of speculative discoveries, see start_speculation
+        self._speculated = {}
         self.cache_dir = cache_dir
         self.no_cache_dir = no_cache_dir
         self.index_url = index_url
         self.extra_index_url = extra_index_url
         self.pre = pre
+        self.offline = offline
+        self.metadata_cache = (
+            None
+            if no_cache_dir
+            else open_metadata_cache(cache_dir, index_url, extra_index_url, cache_ttl)
+        )
 
         super(PackageSource, self).__init__()
 
+    def close(self):  # type: () -> None
+        """Close the metadata cache."""
+        if self.metadata_cache is not None:
+            self.metadata_cache.close()
+
     @property
     def root_version(self):
         return self._root_version
@@ -148,10 +201,16 @@ class PackageSource(BasePackageSource):
         self, name, extras, version, deps=None
     ):  # type: (str, str, Optional[Dict[str, str]]) -> None
         version = Version.parse(version)
+        with self._lock:
+            self._add(name, extras, version, deps)
+
+    def _add(self, name, extras, version, deps):
         if name not in self._packages:
             self._packages[name] = {extras: {}}
+            self._sorted_versions[name] = {extras: SortedVersions()}
         if extras not in self._packages[name]:
             self._packages[name][extras] = {}
+            self._sorted_versions[name][extras] = SortedVersions()
 
         if version in self._packages[name][extras]:
             if self._packages[name][extras][version] is not None:
@@ -159,6 +218,11 @@ class PackageSource(BasePackageSource):
                     raise ValueError("{} ({}) already exists".format(name, version))
                 # already discovered, now called with deps is None from discovering a different version
                 return
+        else:
+            self._sorted_versions[name][extras].add(version)
+
+        self._revisions[name] = self._revisions.get(name, 0) + 1
+        self._changed.add(name)
 
         # not existing and deps undiscovered
         if deps is None:
@@ -174,35 +238,278 @@ class PackageSource(BasePackageSource):
 
         self._packages[name][extras][version] = dependencies
 
-    def discover_and_add(self, package):  # type: (str, str) -> None
-        # converting from semver constraint to pkg_resources string
+    def metadata_revision(self, package):  # type: (Hashable) -> int
+        with self._lock:
+            return self._revisions.get(package, 0)
+
+    def take_metadata_changes(self):  # type: () -> Set[str]
+        with self._lock:
+            changed, self._changed = self._changed, set()
+        return changed
+
+    def discover_and_add(self, package):  # type: (str, str) -> Dict[str, Any]
+        # concurrent discoveries of the same package wait for the first one
         req = parse_req(package)
-        to_create = discover_dependencies_and_versions(
+        args = (req.__str__(), self._discover_and_add, req)
+        with self._lock:
+            scheduler = self._scheduler
+        if scheduler is None:
+            return self._discoveries.do(*args)
+        # take over a queued speculative discovery of the package
+        to_create = scheduler.run(self._discoveries.do, args, key=req.__str__())
+        # which may have run speculatively after all
+        self._add_speculated(req)
+        return to_create
+
+    def _discover_and_add(self, req, group=None):
+        package = req.__str__()
+        if group is None:
+            to_create = self._add_speculated(req)
+            if to_create is not None:
+                # its dependencies were speculated on when it was discovered
+                return to_create
+        to_create = self._discover_known(req)
+        if to_create is None:
+            if self.offline and req.key != ".":
+                raise RuntimeError("{} {}".format(OFFLINE_FAILURE_STR, package))
+            to_create = self._fetch(package)
+            if self.metadata_cache is not None and req.key != "." and req.url is None:
+                self.metadata_cache.set_metadata(to_create)
+        if group is None:
+            self._add_discovered(req, to_create)
+        else:
+            with self._lock:
+                self._speculated[package] = to_create
+        # speculative discoveries inherit the group of the one that started them
+        self._speculate(to_create["requires"], group or req.key)
+        return to_create
+
+    def _add_speculated(self, req):
+        """Add the results of a speculative discovery of req, if any."""
+        with self._lock:
+            to_create = self._speculated.pop(req.__str__(), None)
+            if to_create is not None:
+                self._add_discovered(req, to_create)
+        return to_create
+
+    def _add_discovered(self, req, to_create):
+        with self._lock:
+            for version in to_create["available"]:
+                self.add(req.key, req.extras, version)
+            if not self._has_dependencies(req.key, req.extras, to_create["version"]):
+                # else already added by a concurrent discovery of another specifier
+                self.add(
+                    req.key,
+                    req.extras,
+                    to_create["version"],
+                    deps=to_create["requires"],
+                )
+
+            # shared by all extras variants of the distribution
+            if req.key not in self._packages_metadata:
+                self._packages_metadata[req.key] = {}
+            self._packages_metadata[req.key][Version.parse(to_create["version"])] = {
+                "pip_string": req.__str__(),
+                "requires_dist": to_create.get("requires_dist"),
+                "available": to_create["available"],
+            }
+
+    def _discover_known(self, req):
+        """Get package information without discovering req, or None."""
+        to_create = self._discover_from_other_extras(req)
+        if to_create is None and self.metadata_cache is not None:
+            to_create = discover_cached_dependencies_and_versions(
+                package=req.__str__(),
+                metadata_cache=self.metadata_cache,
+                index_url=self.index_url,
+                extra_index_url=self.extra_index_url,
+                pre=self.pre,
+                offline=self.offline,
+            )
+        return to_create
+
+    def _fetch(self, package):  # type: (str) -> Dict[str, Any]
+        """Discover package using the package indexes and pip."""
+        return discover_dependencies_and_versions(
             package=package,
             index_url=self.index_url,
             extra_index_url=self.extra_index_url,
             cache_dir=self.cache_dir,
             no_cache_dir=self.no_cache_dir,
             pre=self.pre,
-        )
-        for version in to_create["available"]:
-            self.add(req.key, req.extras, version)
-        self.add(
-            req.key,
-            req.extras,
-            to_create["version"],
-            deps=to_create["requires"],
+            metadata_cache=self.metadata_cache,
         )
 
-        # currently unused
-        if req.key not in self._packages_metadata:
-            self._packages_metadata[req.key] = {}
-        self._packages_metadata[req.key][to_create["version"]] = {
-            "pip_string": req.__str__(),
-            "requires": to_create["requires"],
-            "available": to_create["available"],
+    def _discover_from_other_extras(self, req):
+        """Derive package information from metadata discovered for other extras.
+
+        The core metadata of a distribution does not depend on the requested
+        extras, so only the conditional dependencies need to be evaluated again.
+        Returns None if the version pip would select for req, applying its
+        specifier and --pre to the available versions, was not discovered yet.
+
+        """
+        with self._lock:
+            discovered = dict(self._packages_metadata.get(req.key, {}))
+        if not discovered:
+            return None
+        if req.url is not None:
+            version = Version.parse(req.url)
+        else:
+            available = set()
+            for metadata in discovered.values():
+                available.update(metadata["available"])
+            allowed = req.specifier.filter(
+                [version for version in available if not is_vcs_version(version)],
+                prereleases=True if self.pre else None,
+            )
+            versions = [Version.parse(version) for version in allowed]
+            if not versions:
+                return None
+            version = max(versions)
+        metadata = discovered.get(version)
+        if metadata is None or metadata["requires_dist"] is None:
+            return None
+        logger.debug("deriving %s from discovered metadata", req)
+        return {
+            "version": str(version),
+            "available": metadata["available"],
+            "requires": get_requirements(metadata["requires_dist"], req.extras),
+            "requires_dist": metadata["requires_dist"],
         }
 
+    def _has_dependencies(self, name, extras, version):
+        versions = self._packages.get(name, {}).get(extras, {})
+        return versions.get(Version.parse(version)) is not None
+
+    def _is_discovered(self, package):  # type: (str) -> bool
+        req = parse_req(package)
+        with self._lock:
+            versions = self._packages.get(req.key, {}).get(req.extras)
+            if versions is None:
+                return False
+            # a direct reference adds its own version to a discovered package
+            return req.url is None or Version.parse(req.url) in versions
+
+    def _prefetch(self, package):  # type: (str) -> List[str]
+        try:
+            return self.discover_and_add(package)["requires"]
+        except (RuntimeError, subprocess.CalledProcessError) as exc:
+            # the solver will raise when the package turns out to be needed
+            logger.debug("prefetching %s failed: %s", package, exc)
+            return []
+
+    def prefetch(
+        self,
+        depth,
+        budget=DEFAULT_PREFETCH_BUDGET,
+        threads=1,
+    ):  # type: (int, int, int) -> None
+        """Discover the root dependencies and their dependencies breadth-first.
+
+        Each level of the dependency graph is discovered concurrently, following
+        the dependencies of the versions pip selects, so that the solver mostly
+        finds the packages it needs already discovered. Failures are ignored
+        here and raised by the solver if the package turns out to be needed.
+
+        Args:
+            depth (int): levels of dependencies to follow below the root dependencies
+            budget (int): maximum amount of packages to discover
+            threads (int): maximum amount of concurrent discoveries
+
+        """
+        frontier = [dep.pip_string for dep in self._root_dependencies]
+        seen = set()
+        for _ in range(depth + 1):
+            level = []
+            for package in frontier:
+                req = parse_req(package)
+                key = (req.key, req.extras, req.url)
+                if key in seen or self._is_discovered(package):
+                    continue
+                seen.add(key)
+                level.append(package)
+            level = level[:budget]
+            if not level:
+                break
+            budget -= len(level)
+            logger.debug("prefetching %s", ", ".join(level))
+            frontier = [
+                dep for deps in self._prefetch_all(level, threads) for dep in deps
+            ]
+
+    def _prefetch_all(
+        self, packages, threads
+    ):  # type: (List[str], int) -> List[List[str]]
+        pool = ThreadPool(min(threads, len(packages)))
+        try:
+            return pool.map(self._prefetch, packages)
+        finally:
+            pool.close()
+            pool.join()
+
+    def start_speculation(
+        self, scheduler, budget
+    ):  # type: (PriorityScheduler, int) -> None
+        """Discover newly found dependencies in the background while solving.
+
+        Whenever a discovery finds new dependencies, the newest version allowed
+        by each of them is discovered by speculative jobs on the scheduler,
+        whose discoveries in turn speculate on their own dependencies. The
+        solver then mostly finds the packages it reaches already discovered,
+        takes over the queued job, or waits for the discovery in flight.
+        Speculative results are only added once the solver asks for the
+        package, so what the solver knows (see known_versions_for) and so its
+        decisions do not depend on how far the speculation got.
+        Failures are ignored here and raised by the solver if the package turns
+        out to be needed.
+
+        Speculative jobs are grouped by the package whose dependencies started
+        the speculation, see PriorityScheduler.cancel.
+
+        Args:
+            scheduler (PriorityScheduler): scheduler shared with the solver
+            budget (int): maximum amount of packages to discover speculatively
+
+        """
+        with self._lock:
+            self._scheduler = scheduler
+            self._speculation_budget = budget
+
+    def stop_speculation(self):  # type: () -> None
+        """Stop discovering in the background, dropping queued discoveries."""
+        with self._lock:
+            scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler.cancel()
+
+    def _speculate(self, requires, group):  # type: (List[str], str) -> None
+        with self._lock:
+            self._refund_cancelled_speculations()
+            for package in requires:
+                if self._scheduler is None or self._speculation_budget <= 0:
+                    return
+                req = parse_req(package)
+                key = (req.key, req.extras, req.url)
+                if key in self._speculations or self._is_discovered(package):
+                    continue
+                self._speculation_budget -= 1
+                self._speculations[key] = self._scheduler.submit(
+                    self._discoveries.do,
+                    (req.__str__(), self._discover_and_add, req, group),
+                    priority=SPECULATIVE,
+                    key=req.__str__(),
+                    group=group,
+                )
+
+    def _refund_cancelled_speculations(self):  # type: () -> None
+        # with self._lock held: discoveries cancelled before they ran (when the
+        # solver backtracked) did not use the budget, and may be speculated again
+        for key, job in list(self._speculations.items()):
+            if job.cancelled:
+                del self._speculations[key]
+                self._speculation_budget += 1
+
     def root_dep(self, package):  # type: (str, str) -> None
         if is_unneeded_dep(package):
             return
@@ -219,33 +526,55 @@ class PackageSource(BasePackageSource):
 
         """
         extras = package.req.extras
-        if package not in self._packages or extras not in self._packages[package]:
+        if not self._is_discovered(package.req.__str__()):
             # unseen package, safe to take initially parsed req directly
             self.discover_and_add(package.req.__str__())
-        if package not in self._packages:
-            return []
+        with self._lock:
+            if package not in self._packages:
+                return []
+            # a copy, as other threads may add versions
+            candidates = self._sorted_versions[package][extras].candidates(constraint)
 
-        versions = []
-        for version in self._packages[package][extras].keys():
-            if not constraint or constraint.allows_any(
-                Range(version, version, True, True)
-            ):
-                versions.append(version)
+        return _filter_versions(candidates, constraint)
 
-        return sorted(versions, reverse=True)
+    def known_versions_for(
+        self, package, constraint=None
+    ):  # type: (Hashable, Any) -> Optional[List[Hashable]]
+        if package == self.root:
+            return [self.root_version]
+        with self._lock:
+            versions = self._sorted_versions.get(package, {}).get(package.req.extras)
+            if versions is None:
+                return None
+            candidates = versions.candidates(constraint)
+
+        return _filter_versions(candidates, constraint)
+
+    def known_dependencies_for(
+        self, package, version
+    ):  # type: (Hashable, Any) -> Optional[List[Any]]
+        if package == self.root:
+            return self._root_dependencies
+        with self._lock:
+            return (
+                self._packages.get(package, {}).get(package.req.extras, {}).get(version)
+            )
 
     def dependencies_for(self, package, version):  # type: (Hashable, Any) -> List[Any]
         req = package.req
         if package == self.root:
             return self._root_dependencies
 
-        if (
-            req.extras not in self._packages[package]
-            or self._packages[package][req.extras][version] is None
-        ):
+        with self._lock:
+            undiscovered = (
+                req.extras not in self._packages[package]
+                or self._packages[package][req.extras][version] is None
+            )
+        if undiscovered:
             # populate dependencies for version
             self.discover_and_add(render_pin(req.extras_name, str(version)))
-        return self._packages[package][req.extras][version]
+        with self._lock:
+            return self._packages[package][req.extras][version]
 
     def convert_dependency(self, dependency):  # type: (Dependency) -> Constraint
         """Convert a user-defined dependency into a format Mixology understands."""
@@ -0,0 +1,282 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Long-lived pip processes, to pay for interpreter and pip imports only once.
+
+Each worker (``python -m pipgrip.pip_worker``) imports pip and then runs pip
+commands in-process, reading one JSON request per line from stdin and writing
+one JSON response per line to the original stdout.
+
+Workers run pip with the environment variables and working directory they were
+started with, so the pool replaces idle workers once those change.
+"""
+import atexit
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+logger = logging.getLogger(__name__)
+
+# restart workers regularly, as pip is not designed to run repeatedly in-process
+PIP_WORKER_MAX_JOBS = 50
+
+
+class PipWorkerError(RuntimeError):
+    """Raised when a pip worker can not be started or stops responding."""
+
+
+def _get_environment():
+    return os.getcwd(), dict(os.environ)
+
+
+class _PipWorker(object):
+    def __init__(self):
+        self.environment = _get_environment()
+        env = os.environ.copy()
+        # Enable Python's UTF-8 mode.
+        env["PYTHONUTF8"] = "1"
+        self.jobs = 0
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "pipgrip.pip_worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=env,
+        )
+        response = self._read()
+        if not response.get("ready"):
+            self.close()
+            raise PipWorkerError(
+                "Failed to start pip worker: {}".format(response.get("error"))
+            )
+
+    def _read(self):
+        line = self.process.stdout.readline()
+        if not line:
+            raise PipWorkerError("pip worker exited unexpectedly")
+        return json.loads(line.decode("utf-8"))
+
+    def run(self, args):
+        self.jobs += 1
+        request = json.dumps({"args": args}) + "\n"
+        self.process.stdin.write(request.encode("utf-8"))
+        self.process.stdin.flush()
+        response = self._read()
+        return response["returncode"], response["output"] + response["console"]
+
+    def close(self):
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except (IOError, OSError):
+                pass
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class PipWorkerPool(object):
+    """Run pip commands on a pool of long-lived pip processes.
+
+    Workers are started on demand, up to size concurrently running commands.
+    Workers that crash are replaced, workers are recycled after
+    PIP_WORKER_MAX_JOBS commands, and idle workers started with other environment
+    variables or another working directory are replaced before use. If workers
+    can not be started at all, the pool disables itself and run returns None, so
+    callers can fall back to a regular pip subprocess.
+
+    Args:
+        size (int): maximum amount of worker processes
+        max_jobs (int): amount of commands after which a worker is replaced
+
+    """
+
+    def __init__(self, size, max_jobs=PIP_WORKER_MAX_JOBS):
+        self.size = size
+        self.max_jobs = max_jobs
+        self._idle = []
+        self._started = 0
+        self._disabled = False
+        self._condition = threading.Condition()
+        atexit.register(self.close)
+
+    def _acquire(self):
+        environment = _get_environment()
+        stale = []
+        with self._condition:
+            while not self._disabled and not self._idle and self._started >= self.size:
+                self._condition.wait()
+            while self._idle and self._idle[-1].environment != environment:
+                stale.append(self._idle.pop())
+                self._started -= 1
+            worker = None
+            start = not self._disabled and not self._idle
+            if start:
+                self._started += 1
+            elif not self._disabled:
+                worker = self._idle.pop()
+        for stale_worker in stale:
+            stale_worker.close()
+        if not start:
+            return worker
+        try:
+            return _PipWorker()
+        except (PipWorkerError, OSError, ValueError) as exc:
+            logger.debug("Disabling pip workers: {}".format(exc))
+            with self._condition:
+                self._started -= 1
+                self._disabled = True
+                self._condition.notify_all()
+            return None
+
+    def _release(self, worker, healthy):
+        if healthy and worker.jobs < self.max_jobs:
+            with self._condition:
+                self._idle.append(worker)
+                self._condition.notify()
+            return
+        worker.close()
+        with self._condition:
+            self._started -= 1
+            self._condition.notify()
+
+    def run(self, args):
+        """Run pip with args.
+
+        Returns:
+            tuple: (returncode, combined stdout and stderr output), or None if the
+                command could not be run on a worker
+
+        """
+        if self._disabled or self.size < 1:
+            return None
+        worker = self._acquire()
+        if worker is None:
+            return None
+        healthy = False
+        try:
+            result = worker.run(args)
+            healthy = True
+            return result
+        except (PipWorkerError, IOError, OSError, ValueError) as exc:
+            logger.debug(
+                "pip worker failed, falling back to subprocess: {}".format(exc)
+            )
+            return None
+        finally:
+            self._release(worker, healthy)
+
+    def close(self):
+        """Stop all idle workers."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._started -= len(idle)
+        for worker in idle:
+            worker.close()
+
+
+def _run_pip(pip_main, args):
+    """Run pip in-process.
+
+    Returns:
+        tuple: (returncode, output written to sys.stdout and sys.stderr, output
+            written to the stdout and stderr file descriptors, like the output of
+            build subprocesses)
+
+    """
+    output = StringIO()
+    console = tempfile.TemporaryFile()
+    saved_fds = [os.dup(1), os.dup(2)]
+    os.dup2(console.fileno(), 1)
+    os.dup2(console.fileno(), 2)
+    stdout, stderr = sys.stdout, sys.stderr
+    sys.stdout = sys.stderr = output
+    try:
+        returncode = pip_main(args)
+    except SystemExit as exc:
+        if exc.code is None or isinstance(exc.code, int):
+            returncode = exc.code
+        else:
+            output.write("{}\n".format(exc.code))
+            returncode = 1
+    except Exception:  # noqa: B902 report any pip crash like a failed subprocess
+        logger.exception("pip crashed")
+        returncode = 1
+    finally:
+        sys.stdout, sys.stderr = stdout, stderr
+        for fd, saved_fd in enumerate(saved_fds, 1):
+            os.dup2(saved_fd, fd)
+            os.close(saved_fd)
+    console.seek(0)
+    console_output = console.read().decode("utf-8", "replace")
+    console.close()
+    return returncode or 0, output.getvalue(), console_output
+
+
+def main():
+    # keep the protocol pipe apart, as pip and its subprocesses write to fd 1
+    # (their output is captured per job, see _run_pip)
+    protocol = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    os.dup2(devnull, 2)
+
+    def respond(response):
+        protocol.write(json.dumps(response) + "\n")
+        protocol.flush()
+
+    try:
+        try:
+            from pip._internal.cli.main import main as pip_main
+        except ImportError:  # pip<19.3
+            from pip._internal import main as pip_main
+    except ImportError as exc:
+        respond({"ready": False, "error": str(exc)})
+        return
+    # used by pip in usage messages
+    sys.argv = ["pip"]
+    respond({"ready": True})
+    for line in iter(sys.stdin.readline, ""):
+        returncode, output, console = _run_pip(pip_main, json.loads(line)["args"])
+        respond({"returncode": returncode, "output": output, "console": console})
+
+
+if __name__ == "__main__":
+    main()
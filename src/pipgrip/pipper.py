@@ -38,14 +38,22 @@ import re
 import shutil
 import subprocess
 import sys
+import threading
+import time
+from multiprocessing import cpu_count
 from tempfile import NamedTemporaryFile, mkdtemp
 
 import pkg_resources
 from click import echo as _echo
 from packaging.markers import default_environment
 from packaging.utils import canonicalize_name
+from packaging.version import parse as parse_version
 
+from pipgrip.cache import normalize_version
 from pipgrip.compat import PIP_VERSION, urlparse
+from pipgrip.concurrency import ConcurrencyGovernor, SingleFlight, spawn
+from pipgrip.index import IndexClient, IndexClientError, get_index_settings
+from pipgrip.pip_worker import PipWorkerPool
 
 logger = logging.getLogger(__name__)
 
@@ -53,6 +61,12 @@ REPORT_FAILURE_STR = "Failed to get report for"
 BUILD_FAILURE_STR = "Failed to download/build wheel for"
 VERSIONS_FAILURE_STR = "Failed to get available versions for"
 
+# collect concurrent pip report requests for this many seconds into one pip call
+REPORT_BATCH_WINDOW = 0.05
+REPORT_BATCH_SIZE = 32
+# maximum amount of concurrent calls to the package indexes
+MAX_INDEX_REQUESTS = 32
+
 
 def read_requirements(path):
     re_comments = re.compile(r"(?:^|\s+)#")
@@ -100,12 +114,66 @@ def parse_req(requirement, extras=None):
         req.name + "[" + ",".join(sorted(req.extras)) + "]" if req.extras else req.name
     )
     req.extras = frozenset(req.extras)
-    _parse_req_cache[cache_key] = req
-    return req
+    # atomic, so concurrent callers all get the same instance
+    return _parse_req_cache.setdefault(cache_key, req)
+
+
+_pip_workers = PipWorkerPool(size=max(8, cpu_count() * 2))
+
+
+def set_pip_workers(size):
+    """Set the maximum amount of long-lived pip processes (0 to disable)."""
+    _pip_workers.size = size
+
+
+def close_pip_workers():
+    """Stop the idle long-lived pip processes."""
+    _pip_workers.close()
+
 
+# adapt the amount of concurrent subprocesses and index calls to the system load
+_subprocess_governor = ConcurrencyGovernor("subprocess", max(8, cpu_count() * 2))
+_index_governor = ConcurrencyGovernor("index", MAX_INDEX_REQUESTS)
+
+
+def set_max_subprocesses(size):
+    """Set the maximum amount of concurrent subprocesses."""
+    _subprocess_governor.max_limit = size
+
+
+def shutdown():
+    """Stop the long-lived pip processes and close the index connections."""
+    close_pip_workers()
+    close_index_clients()
+
+
+def stream_bash_command(args, echo=False, failure_expected=False):
+    """Mimic subprocess.run, while processing the command output in real time.
+
+    Non-interactive pip commands are run on a long-lived pip process if possible.
+    Commands exiting non-zero (like pip after network timeouts) count as failed
+    calls for the subprocess concurrency governor, unless failure_expected (like
+    for the versions probe).
+    """
+    _subprocess_governor.acquire()
+    start = time.time()
+    retcode = None
+    try:
+        retcode, out = _run_command(args, echo)
+    finally:
+        failed = retcode is None or (bool(retcode) and not failure_expected)
+        _subprocess_governor.release(time.time() - start, failed)
+    if retcode:
+        raise subprocess.CalledProcessError(retcode, args, output=out)
+    return out
+
+
+def _run_command(args, echo):
+    if not echo and args[:3] == [sys.executable, "-m", "pip"]:
+        result = _pip_workers.run(args[3:])
+        if result is not None:
+            return result
 
-def stream_bash_command(args, echo=False):
-    """Mimic subprocess.run, while processing the command output in real time."""
     # https://gist.github.com/ddelange/6517e3267fb74eeee804e3b1490b1c1d
     out = []
     env = os.environ.copy()
@@ -123,11 +191,7 @@ def stream_bash_command(args, echo=False):
         if echo:
             _echo(decoded_line.rstrip())
     process.stdout.close()
-    out = "".join(out)
-    retcode = process.wait()
-    if retcode:
-        raise subprocess.CalledProcessError(retcode, args, output=out)
-    return out
+    return process.wait(), "".join(out)
 
 
 def _get_install_args(
@@ -259,15 +323,60 @@ def install_packages(
             os.remove(constraints_file)
 
 
-_available_versions_cache = {}
+_index_clients = {}
+_index_clients_lock = threading.Lock()
+_hedge_indexes = False
 
 
-def _get_available_versions(package, index_url, extra_index_url, pre):
-    cache_key = (package, pre)
-    if cache_key in _available_versions_cache:
-        return _available_versions_cache[cache_key]
+def set_index_hedging(enabled):
+    """Treat the package indexes as mirrors, hedging slow lookups (see IndexClient)."""
+    global _hedge_indexes
+    _hedge_indexes = enabled
 
-    logger.debug("Finding possible versions for {}".format(package))
+
+def _get_index_client(index_url, extra_index_url, page_cache=None):
+    """Get the (shared) in-process index client, or None if pip must be used."""
+    cache_key = (index_url, extra_index_url, page_cache)
+    with _index_clients_lock:
+        if cache_key not in _index_clients:
+            settings = get_index_settings(index_url, extra_index_url)
+            _index_clients[cache_key] = (
+                None
+                if settings is None
+                else IndexClient(
+                    page_cache=page_cache, hedge=_hedge_indexes, **settings
+                )
+            )
+        return _index_clients[cache_key]
+
+
+def close_index_clients():
+    """Close the pooled connections of all index clients."""
+    with _index_clients_lock:
+        for client in _index_clients.values():
+            if client is not None:
+                client.close()
+        _index_clients.clear()
+
+
+def _get_available_versions_from_index(
+    package, index_url, extra_index_url, metadata_cache=None
+):
+    client = _get_index_client(index_url, extra_index_url, metadata_cache)
+    if client is None:
+        return None
+    try:
+        with _index_governor.slot():
+            return client.get_available_versions(package)
+    except (IndexClientError, KeyError, ValueError) as exc:
+        logger.debug(
+            "Falling back to pip for available versions of {}: {}".format(package, exc)
+        )
+        return None
+
+
+def _get_versions_probe_args(package, index_url, extra_index_url, pre):
+    """Get pip args that fail listing the available versions of package."""
     args = _get_wheel_args(
         index_url=index_url, extra_index_url=extra_index_url, pre=pre
     ) + [package + "==42.42.post424242"]
@@ -275,42 +384,133 @@ def _get_available_versions(package, index_url, extra_index_url, pre):
     if [20, 3] <= PIP_VERSION < [21, 1]:
         # https://github.com/ddelange/pipgrip/issues/42
         args += ["--use-deprecated", "legacy-resolver"]
+    return args
 
-    try:
-        out = stream_bash_command(args)
-    except subprocess.CalledProcessError as err:
-        # expected. we forced this by using a non-existing version number.
-        out = getattr(err, "output") or ""
-    else:
-        logger.warning(out)
-        raise RuntimeError("Unexpected success:" + " ".join(args))
+
+def _parse_versions_probe(package, out):
+    """Parse the available versions from the output of the versions probe."""
     out = out.splitlines()
     for line in out[::-1]:
         if "Could not find a version that satisfies the requirement" in line:
-            all_versions = line.split("from versions: ", 1)[1].rstrip(")").split(", ")
-            if pre:
-                return all_versions
-            # filter out pre-releases
-            available_versions = [
-                v for v in all_versions if not re.findall(r"[a-zA-Z]", v)
-            ]
+            return line.split("from versions: ", 1)[1].rstrip(")").split(", ")
+    raise RuntimeError("{} {}".format(VERSIONS_FAILURE_STR, package))
+
+
+def _get_available_versions_from_pip(package, index_url, extra_index_url, pre):
+    args = _get_versions_probe_args(package, index_url, extra_index_url, pre)
+    try:
+        out = stream_bash_command(args, failure_expected=True)
+    except subprocess.CalledProcessError as err:
+        # expected. we forced this by using a non-existing version number.
+        return _parse_versions_probe(package, getattr(err, "output") or "")
+    logger.warning(out)
+    raise RuntimeError("Unexpected success:" + " ".join(args))
+
+
+def _get_index_metadata(req, index_url, extra_index_url, pre, metadata_cache=None):
+    """Get core metadata from the index without pip, or None if not possible.
+
+    Uses PEP 658 (PEP 714) metadata files served next to the wheel, or else reads
+    the METADATA member of the remote wheel using HTTP range requests.
+    """
+    client = _get_index_client(index_url, extra_index_url, metadata_cache)
+    if client is None:
+        return None
+    try:
+        with _index_governor.slot():
+            version, file = client.find_best_candidate(req, pre)
+            if file is None:
+                logger.debug("No compatible wheel for {} {}".format(req.name, version))
+                return None
+            if file["metadata"] is None:
+                logger.debug("Lazily reading metadata from {}".format(file["url"]))
+                metadata = client.get_wheel_metadata_lazily(file)
+            else:
+                metadata = client.get_core_metadata(file)
+    except (IndexClientError, KeyError, ValueError) as exc:
+        logger.debug("Falling back to pip for metadata of {}: {}".format(req, exc))
+        return None
+    # the same for every interpreter, unlike that of platform wheels and builds
+    metadata["portable"] = file["filename"].endswith("-none-any.whl")
+    return metadata
+
+
+_available_versions_cache = {}
+
+
+_available_versions_flights = SingleFlight()
+
+
+def _get_available_versions(
+    package, index_url, extra_index_url, pre, metadata_cache=None
+):
+    cache_key = (package, pre)
+    if cache_key in _available_versions_cache:
+        return _available_versions_cache[cache_key]
+    # concurrent callers wait for the first one to find the versions
+    return _available_versions_flights.do(
+        cache_key,
+        _find_available_versions,
+        package,
+        index_url,
+        extra_index_url,
+        pre,
+        metadata_cache,
+    )
+
+
+def _find_available_versions(package, index_url, extra_index_url, pre, metadata_cache):
+    available_versions = _get_known_available_versions(package, pre, metadata_cache)
+    if available_versions is not None:
+        return available_versions
+
+    logger.debug("Finding possible versions for {}".format(package))
+    all_versions = _get_available_versions_from_index(
+        package, index_url, extra_index_url, metadata_cache
+    )
+    if all_versions is None:
+        all_versions = _get_available_versions_from_pip(
+            package, index_url, extra_index_url, pre
+        )
+    return _set_available_versions(package, pre, all_versions, metadata_cache)
+
+
+def _get_known_available_versions(package, pre, metadata_cache):
+    """Get the available versions found before, or None."""
+    cache_key = (package, pre)
+    if cache_key in _available_versions_cache:
+        return _available_versions_cache[cache_key]
+    if metadata_cache is not None:
+        available_versions = metadata_cache.get_versions(package, pre, fresh=True)
+        if available_versions is not None:
             _available_versions_cache[cache_key] = available_versions
             return available_versions
-    raise RuntimeError("{} {}".format(VERSIONS_FAILURE_STR, package))
+    return None
 
 
-def _get_package_report(
-    package,
+def _set_available_versions(package, pre, all_versions, metadata_cache):
+    """Filter and cache the available versions found."""
+    if pre:
+        available_versions = all_versions
+    else:
+        # filter out pre-releases
+        available_versions = [v for v in all_versions if not re.findall(r"[a-zA-Z]", v)]
+    _available_versions_cache[(package, pre)] = available_versions
+    if metadata_cache is not None:
+        metadata_cache.set_versions(package, pre, available_versions)
+    return available_versions
+
+
+def _get_report_args(
+    packages,
+    report_file,
     index_url,
     extra_index_url,
     pre,
     cache_dir,
     no_cache_dir,
 ):
-    """Get metadata (install report) using pip's --dry-run --report functionality."""
-    logger.debug(
-        "Getting report for {} (with fallback cache_dir {})".format(package, cache_dir)
-    )
+    """Get pip args that write the install report of packages to report_file."""
     args = [
         sys.executable,
         "-m",
@@ -345,15 +545,64 @@ def _get_package_report(
             "--trusted-host",
             urlparse(extra_index_url).hostname,
         ]
+    return args + ["--report", report_file] + list(packages)
+
+
+def _get_packages_report(
+    packages,
+    index_url,
+    extra_index_url,
+    pre,
+    cache_dir,
+    no_cache_dir,
+):
+    """Get metadata (install report) of one or more packages in a single pip call.
 
+    Raises subprocess.CalledProcessError if pip fails for any of the packages.
+    """
     # Windows disallows opening fp a second time (within the pip subprocess)
     # So close it here, and delete it manually
     with NamedTemporaryFile(delete=False, mode="w+") as fp:
         report_file = fp.name
 
-    args += ["--report", report_file, package]
+    args = _get_report_args(
+        packages,
+        report_file,
+        index_url=index_url,
+        extra_index_url=extra_index_url,
+        pre=pre,
+        cache_dir=cache_dir,
+        no_cache_dir=no_cache_dir,
+    )
     try:
         stream_bash_command(args)
+        with io.open(report_file, "r", encoding="utf-8") as fp:
+            return json.load(fp)
+    finally:
+        os.remove(report_file)
+
+
+def _get_package_report(
+    package,
+    index_url,
+    extra_index_url,
+    pre,
+    cache_dir,
+    no_cache_dir,
+):
+    """Get metadata (install report) using pip's --dry-run --report functionality."""
+    logger.debug(
+        "Getting report for {} (with fallback cache_dir {})".format(package, cache_dir)
+    )
+    try:
+        return _get_packages_report(
+            [package],
+            index_url=index_url,
+            extra_index_url=extra_index_url,
+            pre=pre,
+            cache_dir=cache_dir,
+            no_cache_dir=no_cache_dir,
+        )
     except subprocess.CalledProcessError as err:
         output = getattr(err, "output") or ""
         logger.error(
@@ -362,11 +611,117 @@ def _get_package_report(
             )
         )
         raise RuntimeError("{} {}".format(REPORT_FAILURE_STR, package))
-    else:
-        with io.open(report_file, "r", encoding="utf-8") as fp:
-            return json.load(fp)
-    finally:
-        os.remove(report_file)
+
+
+class _ReportBatcher(object):
+    """Coalesce concurrent report requests into a single pip call.
+
+    When other report requests are in flight, the first caller waits up to
+    REPORT_BATCH_WINDOW seconds (or until REPORT_BATCH_SIZE requests joined),
+    collecting requests with the same pip options from other threads, and then
+    runs pip for all of them at once. A caller without company runs pip right
+    away. If the batched call fails, every package is retried on its own
+    (concurrently, within the subprocess concurrency limit), so that failures are
+    reported for the culprit package only.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._active = 0
+
+    def get_metadata(self, req, **options):
+        """Get core metadata of the distribution pip selects for req."""
+        entry = {"req": req, "done": threading.Event(), "result": None, "exc": None}
+        if REPORT_BATCH_SIZE <= 1:
+            self._run_single(entry, options)
+        else:
+            key = tuple(sorted(options.items()))
+            with self._lock:
+                self._active += 1
+                leader = key not in self._pending
+                if leader:
+                    self._pending[key] = {"entries": [], "full": threading.Event()}
+                batch = self._pending[key]
+                batch["entries"].append(entry)
+                if len(batch["entries"]) >= REPORT_BATCH_SIZE:
+                    batch["full"].set()
+                alone = self._active == 1
+            try:
+                if leader:
+                    if not alone:
+                        # others are resolving too, and may join this batch
+                        batch["full"].wait(REPORT_BATCH_WINDOW)
+                    with self._lock:
+                        del self._pending[key]
+                    self._run(batch["entries"], options)
+                entry["done"].wait()
+            finally:
+                with self._lock:
+                    self._active -= 1
+        if entry["exc"] is not None:
+            raise entry["exc"]
+        return entry["result"]
+
+    def _run(self, batch, options):
+        entries = list(batch)
+        try:
+            while batch:
+                # pip refuses the same project twice in one --no-deps call
+                chunk, batch, names = [], [], set()
+                for entry in entries:
+                    if entry["done"].is_set():
+                        continue
+                    if entry["req"].key in names or len(chunk) >= REPORT_BATCH_SIZE:
+                        batch.append(entry)
+                    else:
+                        names.add(entry["req"].key)
+                        chunk.append(entry)
+                if len(chunk) == 1:
+                    self._run_single(chunk[0], options)
+                else:
+                    self._run_chunk(chunk, options)
+        finally:
+            for entry in entries:
+                if not entry["done"].is_set():
+                    entry["exc"] = RuntimeError(
+                        "{} {}".format(REPORT_FAILURE_STR, entry["req"])
+                    )
+                    entry["done"].set()
+
+    def _run_chunk(self, chunk, options):
+        packages = [entry["req"].__str__() for entry in chunk]
+        logger.debug("Getting batched report for {}".format(" ".join(packages)))
+        try:
+            report = _get_packages_report(packages, **options)
+            metadata = {
+                canonicalize_name(install["metadata"]["name"]): install["metadata"]
+                for install in report["install"]
+            }
+            results = [metadata[entry["req"].key] for entry in chunk]
+        except (subprocess.CalledProcessError, KeyError, ValueError) as exc:
+            logger.debug("Batched report failed, retrying one by one: {}".format(exc))
+            jobs = [spawn(self._run_single, entry, options) for entry in chunk]
+            for job in jobs:
+                job.done.wait()
+            return
+        for entry, result in zip(chunk, results):
+            entry["result"] = result
+            entry["done"].set()
+
+    def _run_single(self, entry, options):
+        try:
+            report = _get_package_report(entry["req"].__str__(), **options)
+            entry["result"] = report["install"][0]["metadata"]
+        except Exception as exc:  # noqa: B902 re-raised in the requesting thread
+            entry["exc"] = exc
+        finally:
+            # also when retried in a job, which would swallow the exception
+            entry["done"].set()
+
+
+_report_batcher = _ReportBatcher()
 
 
 def _download_wheel(
@@ -526,11 +881,54 @@ def _get_wheel_requirements(metadata, extras_requested):
     return result
 
 
+def get_requirements(requires_dist, extras):
+    """Evaluate raw Requires-Dist for the current environment and requested extras."""
+    return _get_wheel_requirements({"requires_dist": requires_dist}, sorted(extras))
+
+
 def is_unneeded_dep(package):
     """Evaluate a single package in the context of the current environment."""
     return not _get_wheel_requirements({"requires_dist": [package]}, [])
 
 
+def _get_pip_metadata(req, index_url, extra_index_url, cache_dir, pre, no_cache_dir):
+    """Get core metadata of the distribution pip selects for req."""
+    if PIP_VERSION >= [22, 2]:
+        if req.key == "." or req.url is not None:
+            report = _get_package_report(
+                package=req.__str__(),
+                index_url=index_url,
+                extra_index_url=extra_index_url,
+                pre=pre,
+                cache_dir=cache_dir,
+                no_cache_dir=no_cache_dir,
+            )
+            return report["install"][0]["metadata"]
+        return _report_batcher.get_metadata(
+            req,
+            index_url=index_url,
+            extra_index_url=extra_index_url,
+            pre=pre,
+            cache_dir=cache_dir,
+            no_cache_dir=no_cache_dir,
+        )
+    # old python (<=3.6) fallback
+    wheel_dir = mkdtemp()
+    try:
+        wheel_fname = _download_wheel(
+            package=req.__str__(),
+            index_url=index_url,
+            extra_index_url=extra_index_url,
+            pre=pre,
+            cache_dir=cache_dir,
+            no_cache_dir=no_cache_dir,
+            wheel_dir=wheel_dir,
+        )
+        return _extract_metadata(wheel_fname)
+    finally:
+        shutil.rmtree(wheel_dir)
+
+
 def discover_dependencies_and_versions(
     package,
     index_url,
@@ -538,6 +936,7 @@ def discover_dependencies_and_versions(
     cache_dir,
     pre,
     no_cache_dir=False,  # added as last arg with default to avoid a breaking change
+    metadata_cache=None,
 ):
     """Get information for a package.
 
@@ -548,50 +947,64 @@ def discover_dependencies_and_versions(
         cache_dir (str): directory for storing wheels
         pre (bool): pip --pre flag
         no_cache_dir (bool): pip --no-cache-dir flag
+        metadata_cache (pipgrip.cache.MetadataCache): cache for index requests
 
     Returns:
         dict: package information:
             'version': the version resolved by pip
             'available': all available versions resolved by pip
             'requires': all requirements as found in corresponding wheel (dist_requires)
+            'requires_dist': raw Requires-Dist of the wheel, including markers
+            'requires_python': raw Requires-Python of the wheel
+            'portable': whether the metadata holds for any interpreter (read from
+                a pure Python wheel on the index)
 
     """
     req = parse_req(package)
 
-    extras_requested = sorted(req.extras)
-
     logger.info("discovering %s", req)
-    if PIP_VERSION >= [22, 2]:
-        report = _get_package_report(
-            package=req.__str__(),
+    wheel_metadata = None
+    versions_job = None
+    if req.key != "." and req.url is None:
+        if _get_index_client(index_url, extra_index_url, metadata_cache) is None:
+            # both take a pip call, so list the versions while getting the metadata
+            versions_job = spawn(
+                _get_available_versions,
+                req.name,
+                index_url,
+                extra_index_url,
+                pre,
+                metadata_cache,
+            )
+        wheel_metadata = _get_index_metadata(
+            req, index_url, extra_index_url, pre, metadata_cache
+        )
+    if wheel_metadata is None:
+        wheel_metadata = _get_pip_metadata(
+            req,
             index_url=index_url,
             extra_index_url=extra_index_url,
-            pre=pre,
             cache_dir=cache_dir,
+            pre=pre,
             no_cache_dir=no_cache_dir,
         )
-        wheel_metadata = report["install"][0]["metadata"]
-    else:  # old python (<=3.6) fallback
-        wheel_dir = mkdtemp()
-        try:
-            wheel_fname = _download_wheel(
-                package=req.__str__(),
-                index_url=index_url,
-                extra_index_url=extra_index_url,
-                pre=pre,
-                cache_dir=cache_dir,
-                no_cache_dir=no_cache_dir,
-                wheel_dir=wheel_dir,
-            )
-            wheel_metadata = _extract_metadata(wheel_fname)
-        finally:
-            shutil.rmtree(wheel_dir)
-    wheel_requirements = _get_wheel_requirements(wheel_metadata, extras_requested)
+    available_versions = None
+    if versions_job is not None:
+        available_versions = versions_job.get()
+    elif req.key != "." and req.url is None:
+        # the index client lists the versions from the project page it just fetched
+        available_versions = _get_available_versions(
+            req.name, index_url, extra_index_url, pre, metadata_cache
+        )
+    return _get_discovery_result(req, wheel_metadata, available_versions)
+
+
+def _get_discovery_result(req, wheel_metadata, available_versions):
+    """Combine the metadata and available versions (None for direct references)."""
+    wheel_requirements = _get_wheel_requirements(wheel_metadata, sorted(req.extras))
     wheel_version = req.url or wheel_metadata["version"]
     available_versions = (
-        _get_available_versions(req.name, index_url, extra_index_url, pre)
-        if req.key != "." and req.url is None
-        else [wheel_version]
+        [wheel_version] if available_versions is None else list(available_versions)
     )
     if wheel_version not in available_versions:
         available_versions.append(wheel_version)
@@ -601,4 +1014,106 @@ def discover_dependencies_and_versions(
         "version": wheel_version,
         "available": available_versions,
         "requires": wheel_requirements,
+        "requires_dist": wheel_metadata.get("requires_dist") or [],
+        "requires_python": wheel_metadata.get("requires_python"),
+        "portable": wheel_metadata.get("portable", False),
+    }
+
+
+def _find_best_version(
+    req, available_versions, index_url, extra_index_url, pre, metadata_cache, offline
+):
+    """Get the version pip would select for req, or None if there is none."""
+    for op, version in req.specs:
+        if op in ("==", "===") and "*" not in version:
+            return version
+    if not offline:
+        client = _get_index_client(index_url, extra_index_url, metadata_cache)
+        if client is not None:
+            # also takes yanked releases into account
+            try:
+                with _index_governor.slot():
+                    return client.find_best_candidate(req, pre)[0]
+            except (IndexClientError, KeyError, ValueError):
+                return None
+    allowed = list(
+        req.specifier.filter(available_versions, prereleases=True if pre else None)
+    )
+    return max(allowed, key=parse_version) if allowed else None
+
+
+def discover_cached_dependencies_and_versions(
+    package,
+    metadata_cache,
+    index_url,
+    extra_index_url,
+    pre,
+    offline=False,
+):
+    """Get information for a package from the metadata cache.
+
+    Args:
+        package (str): pip requirement format spec compliant package
+        metadata_cache (pipgrip.cache.MetadataCache): persistent metadata cache
+        index_url (str): primary PyPI index url
+        extra_index_url (str): secondary PyPI index url
+        pre (bool): pip --pre flag
+        offline (bool): use the last seen available versions instead of the index
+
+    Returns:
+        dict: package information like discover_dependencies_and_versions,
+            or None if the selected version is not in the cache
+
+    """
+    req = parse_req(package)
+    if req.key == "." or req.url is not None:
+        return None
+    cached_metadata = metadata_cache.get_metadata(req.key)
+    if not cached_metadata:
+        return None
+
+    if offline:
+        available_versions = metadata_cache.get_versions(req.key, pre)
+        if available_versions is None:
+            available_versions = sorted(
+                (
+                    metadata["version"]
+                    for metadata in cached_metadata.values()
+                    if pre or not re.findall(r"[a-zA-Z]", metadata["version"])
+                ),
+                key=parse_version,
+            )
+    else:
+        available_versions = list(
+            _get_available_versions(
+                req.name, index_url, extra_index_url, pre, metadata_cache
+            )
+        )
+    version = _find_best_version(
+        req,
+        available_versions,
+        index_url,
+        extra_index_url,
+        pre,
+        metadata_cache,
+        offline,
+    )
+    wheel_metadata = (
+        None if version is None else cached_metadata.get(normalize_version(version))
+    )
+    if wheel_metadata is None:
+        return None
+
+    logger.info("discovered %s in metadata cache", req)
+    wheel_version = wheel_metadata["version"]
+    if wheel_version not in available_versions:
+        available_versions.append(wheel_version)
+
+    return {
+        "name": wheel_metadata["name"],
+        "version": wheel_version,
+        "available": available_versions,
+        "requires": _get_wheel_requirements(wheel_metadata, sorted(req.extras)),
+        "requires_dist": wheel_metadata["requires_dist"],
+        "requires_python": wheel_metadata["requires_python"],
     }
@@ -0,0 +1,133 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+"""Versions of a package, sorted for answering constraint queries by bisection."""
+import bisect
+from typing import Any, List, Tuple
+
+from pipgrip.libs.mixology.range import Range
+from pipgrip.libs.mixology.union import Union
+from pipgrip.libs.semver import Version
+
+
+def version_key(version):  # type: (Version) -> Tuple
+    """Return a key that sorts like comparing versions (Version._cmp) does."""
+    return (
+        version.major,
+        version.minor,
+        version.patch,
+        version.rest,
+        # pre-releases always come before no pre-release string
+        not version.is_prerelease(),
+        _parts_key(version.prerelease),
+        # builds always come after no build string
+        bool(version.build),
+        _parts_key(version.build),
+    )
+
+
+def _parts_key(parts):  # type: (List) -> Tuple
+    # numeric parts come before alphanumeric ones, missing parts before both
+    return tuple((0, part) if isinstance(part, int) else (1, part) for part in parts)
+
+
+class SortedVersions(object):
+    """The versions of a package, sorted by their version_key.
+
+    VCS versions are kept apart: constraints do not order them like the other
+    versions (see Range.is_strictly_lower), so they are always candidates.
+
+    """
+
+    def __init__(self):  # type: () -> None
+        self._keys = []  # type: List[Tuple]
+        self._versions = []  # type: List[Version]
+        self._vcs_versions = []  # type: List[Version]
+
+    def __len__(self):  # type: () -> int
+        return len(self._versions) + len(self._vcs_versions)
+
+    def add(self, version):  # type: (Version) -> None
+        """Add a version that was not added before."""
+        if version.is_vcs():
+            self._vcs_versions.append(version)
+            return
+        key = version_key(version)
+        index = bisect.bisect(self._keys, key)
+        self._keys.insert(index, key)
+        self._versions.insert(index, version)
+
+    def candidates(self, constraint=None):  # type: (Any) -> List[Version]
+        """Return the versions within the bounds of constraint, newest first.
+
+        This is a superset of the versions constraint allows: the bounds are
+        taken inclusively, so the candidates still need to be checked against
+        constraint itself.
+
+        """
+        if constraint is None:
+            windows = [(0, len(self._keys))]
+        elif constraint.is_empty():
+            return []
+        else:
+            ranges = (
+                constraint.ranges if isinstance(constraint, Union) else [constraint]
+            )
+            windows = sorted(self._window(range_) for range_ in ranges)
+
+        # merge overlapping windows, then take them from newest to oldest
+        merged = []  # type: List[List[int]]
+        for lower, upper in windows:
+            if merged and lower <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], upper)
+            elif lower < upper:
+                merged.append([lower, upper])
+        candidates = []  # type: List[Version]
+        for lower, upper in reversed(merged):
+            candidates.extend(reversed(self._versions[lower:upper]))
+
+        if self._vcs_versions:
+            return sorted(candidates + self._vcs_versions, reverse=True)
+        return candidates
+
+    def _window(self, range_):  # type: (Range) -> Tuple[int, int]
+        lower = (
+            0
+            if range_.min is None
+            else bisect.bisect_left(self._keys, version_key(range_.min))
+        )
+        upper = (
+            len(self._keys)
+            if range_.max is None
+            else bisect.bisect_right(self._keys, version_key(range_.max))
+        )
+        return lower, upper
@@ -0,0 +1,148 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import sys
+import threading
+import time
+
+import pytest
+
+import pipgrip.cache
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+# asyncio syntax
+collect_ignore = ["test_aio.py"] if sys.version_info < (3, 5) else []
+
+
+class IndexServer(ThreadingMixIn, HTTPServer):
+    """Stand-in package index serving canned responses from a routes dict."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ("127.0.0.1", 0), IndexRequestHandler)
+        # path -> (status, headers, body)
+        self.routes = {}
+        # (path, headers) of every request received
+        self.requests = []
+        # client addresses, one per opened connection
+        self.connections = []
+        # amount of body bytes served
+        self.bytes_sent = 0
+        # path -> seconds to wait before responding
+        self.delays = {}
+        # path -> event to wait for before responding
+        self.blocked = {}
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server_address[1])
+
+    def add(self, path, body, status=200, headers=None):
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        self.routes[path] = (status, headers or {}, body)
+
+
+class IndexRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections.append(self.client_address)
+
+    def do_HEAD(self):
+        self._respond(head=True)
+
+    def do_GET(self):
+        self._respond()
+
+    def _respond(self, head=False):
+        self.server.requests.append((self.path, dict(self.headers.items())))
+        time.sleep(self.server.delays.get(self.path, 0))
+        if self.path in self.server.blocked:
+            self.server.blocked[self.path].wait(10)
+        status, headers, body = self.server.routes.get(
+            self.path, (404, {}, b"not found")
+        )
+        etag = headers.get("ETag")
+        if etag and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+        byte_range = self.headers.get("Range")
+        if byte_range and headers.get("Accept-Ranges") == "bytes":
+            start, stop = byte_range.split("=", 1)[1].split("-")
+            start, stop = int(start), min(int(stop), len(body) - 1)
+            headers = dict(
+                headers,
+                **{"Content-Range": "bytes {}-{}/{}".format(start, stop, len(body))}
+            )
+            status, body = 206, body[start : stop + 1]
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head:
+            self.server.bytes_sent += len(body)
+            self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture()
+def index_server():
+    server = IndexServer()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def user_cache_dir(tmp_path, monkeypatch):
+    """Keep the persistent metadata cache of each test apart from the user's."""
+    cache_dir = str(tmp_path / "pipgrip-cache")
+    monkeypatch.setattr(pipgrip.cache, "user_cache_dir", lambda: cache_dir)
+    return cache_dir
@@ -0,0 +1,211 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import asyncio
+import hashlib
+import json
+import threading
+
+import pytest
+
+import pipgrip.aio
+import pipgrip.index
+import pipgrip.pipper
+from pipgrip.aio import AsyncDiscovery, AsyncPackageSource, AsyncPipWorkerPool
+from pipgrip.concurrency import ConcurrencyGovernor
+from pipgrip.index import SIMPLE_JSON_CONTENT_TYPE
+from pipgrip.libs.semver import Version
+from pipgrip.pipper import MAX_INDEX_REQUESTS, REPORT_FAILURE_STR
+from tests.test_index import CLICK_JSON, METADATA
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_async_pip_worker_pool():
+    async def run_pip(size):
+        pool = AsyncPipWorkerPool(size)
+        try:
+            return await asyncio.gather(
+                pool.run(["--version"]), pool.run(["--version"]), pool.run(["nope"])
+            )
+        finally:
+            await pool.close()
+
+    # workers, and subprocesses if disabled
+    for size in (2, 0):
+        version, again, unknown = run(run_pip(size))
+        assert version[0] == 0
+        assert version[1].startswith("pip ")
+        assert again == version
+        assert unknown[0] != 0
+        assert 'unknown command "nope"' in unknown[1]
+
+
+def test_async_pip_worker_pool_governor(monkeypatch):
+    governor = ConcurrencyGovernor("test", max_limit=8, memory_pressure=lambda: False)
+    monkeypatch.setattr(pipgrip.aio, "_subprocess_governor", governor)
+
+    async def run_pip(args, failure_expected=False):
+        pool = AsyncPipWorkerPool(0)
+        try:
+            return await pool.run(args, failure_expected)
+        finally:
+            await pool.close()
+
+    assert run(run_pip(["nope"], failure_expected=True))[0] != 0
+    assert governor.limit == 8
+    assert run(run_pip(["nope"]))[0] != 0
+    assert governor.limit == 4
+
+
+@pytest.mark.parametrize(
+    "requests, expected",
+    [(None, MAX_INDEX_REQUESTS), (1000, MAX_INDEX_REQUESTS), (4, 4)],
+)
+def test_async_discovery_requests(requests, expected):
+    async def create():
+        engine = AsyncDiscovery(None, None, None, True, False, requests=requests)
+        try:
+            # index calls beyond the index governor's maximum would only wait
+            return engine._executor._max_workers
+        finally:
+            await engine.close()
+
+    assert run(create()) == expected
+
+
+def test_async_package_source(index_server, monkeypatch):
+    def patch_pip_output(*args, **kwargs):
+        raise AssertionError("pip should not be called")
+
+    monkeypatch.setattr(pipgrip.pipper, "stream_bash_command", patch_pip_output)
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    monkeypatch.setattr(pipgrip.index, "_load_pip_config", lambda: {})
+
+    click_json = json.loads(json.dumps(CLICK_JSON))
+    click_json["files"][1]["core-metadata"] = {
+        "sha256": hashlib.sha256(METADATA.encode("utf-8")).hexdigest()
+    }
+    index_server.add(
+        "/simple/click/",
+        json.dumps(click_json),
+        headers={"Content-Type": SIMPLE_JSON_CONTENT_TYPE},
+    )
+    index_server.add("/files/click-7.0-py2.py3-none-any.whl.metadata", METADATA)
+
+    source = AsyncPackageSource(
+        cache_dir=None,
+        no_cache_dir=True,
+        index_url=index_server.url + "/simple",
+        extra_index_url=None,
+        pre=False,
+    )
+    try:
+        source.root_dep("click[test]")
+        source.prefetch(depth=0)
+        assert source._is_discovered("click[test]")
+        assert source.run(source.engine.discover("click[test]")) == {
+            "name": "Click",
+            "version": "7.0",
+            "available": ["6.7", "7.0"],
+            "requires": ["pytest"],
+            "requires_dist": [
+                'colorama; platform_system == "Windows"',
+                'pytest; extra == "test"',
+            ],
+            "requires_python": ">=2.7",
+            "portable": True,
+        }
+        dependencies = source._packages["click"][frozenset(["test"])][
+            Version.parse("7.0")
+        ]
+        assert [dep.name for dep in dependencies] == ["pytest"]
+
+        # the project page is fetched once
+        paths = [path for path, _ in index_server.requests]
+        assert paths.count("/simple/click/") == 1
+
+        # no wheel for 6.7, so pip is asked, and failures are remembered
+        pip_calls = []
+
+        async def run_pip(args):
+            pip_calls.append(args)
+            return 1, "ERROR: no"
+
+        source.engine._pip.run = run_pip
+        for _ in range(2):
+            with pytest.raises(RuntimeError, match=REPORT_FAILURE_STR):
+                source.discover_and_add("click==6.7")
+        assert len(pip_calls) == 1
+        assert pip_calls[0][:2] == ["install", "-qq"]
+    finally:
+        source.close()
+        pipgrip.pipper.close_index_clients()
+
+
+def test_async_package_source_prefetch_concurrently(monkeypatch):
+    packages = ["a", "b", "c"]
+    started = {package: threading.Event() for package in packages}
+    discovered = []
+
+    def discover_known(req):
+        # e.g. the metadata cache asking the index: all lookups run at once
+        started[req.key].set()
+        for package, event in started.items():
+            assert event.wait(10), package
+        return None
+
+    async def discover(package):
+        discovered.append(package)
+        return {"version": "1.0", "available": ["1.0"], "requires": []}
+
+    source = AsyncPackageSource(
+        cache_dir=None,
+        no_cache_dir=True,
+        index_url=None,
+        extra_index_url=None,
+        pre=False,
+    )
+    try:
+        monkeypatch.setattr(source, "_discover_known", discover_known)
+        monkeypatch.setattr(source, "_prefetch", lambda package: [])
+        monkeypatch.setattr(source.engine, "discover", discover)
+        source._prefetch_all(packages, threads=1)
+        assert sorted(discovered) == packages
+    finally:
+        source.close()
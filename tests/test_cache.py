@@ -0,0 +1,270 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import os
+import sys
+
+import pytest
+from click.testing import CliRunner
+
+import pipgrip.cache
+import pipgrip.package_source
+import pipgrip.pipper
+from pipgrip.cache import (
+    OFFLINE_FAILURE_STR,
+    MetadataCache,
+    get_cache_path,
+    get_environment_key,
+    normalize_version,
+)
+from pipgrip.cli import main
+from pipgrip.libs.semver import Version
+from pipgrip.package_source import PackageSource
+
+CLICK_METADATA = {
+    "name": "Click",
+    "version": "7.0",
+    "requires_dist": [
+        'colorama; platform_system == "Windows"',
+        'pytest; extra == "test"',
+    ],
+    "requires_python": ">=2.7",
+}
+
+
+def test_get_cache_path(user_cache_dir):
+    assert get_cache_path("/tmp/abc") == os.path.join(
+        "/tmp/abc", "pipgrip", "metadata.sqlite3"
+    )
+    assert get_cache_path() == os.path.join(user_cache_dir, "metadata.sqlite3")
+
+
+def test_normalize_version():
+    assert normalize_version("1.0.0-RC1") == "1.0.0rc1"
+    assert normalize_version("not-a-version") == "not-a-version"
+
+
+def test_metadata_cache(tmp_path):
+    path = str(tmp_path / "nested" / "metadata.sqlite3")
+    cache = MetadataCache(path, "https://pypi.org/simple")
+    assert cache.get_metadata("click") == {}
+    assert cache.get_versions("click", pre=False) is None
+
+    cache.set_metadata(dict(CLICK_METADATA, available=["7.0"]))
+    cache.set_versions("Click", False, ["6.7", "7.0"])
+    cache.close()
+
+    cache = MetadataCache(path, "https://pypi.org/simple")
+    assert cache.get_metadata("CLICK") == {"7.0": CLICK_METADATA}
+    assert cache.get_versions("click", pre=False) == ["6.7", "7.0"]
+    assert cache.get_versions("click", pre=True) is None
+    cache.close()
+
+    # entries are kept apart per index
+    cache = MetadataCache(path, "https://example.com/simple")
+    assert cache.get_metadata("click") == {}
+    cache.close()
+
+
+def test_metadata_cache_environment(tmp_path, monkeypatch):
+    path = str(tmp_path / "metadata.sqlite3")
+    cache = MetadataCache(path, "")
+    # e.g. built by pip from an sdist, and read from a pure Python wheel
+    cache.set_metadata(CLICK_METADATA)
+    cache.set_metadata(dict(CLICK_METADATA, version="7.1", portable=True))
+    assert sorted(cache.get_metadata("click")) == ["7.0", "7.1"]
+    cache.close()
+
+    # another interpreter only reuses the metadata of pure Python wheels
+    monkeypatch.setattr(pipgrip.cache, "get_environment_key", lambda: "other")
+    cache = MetadataCache(path, "")
+    assert sorted(cache.get_metadata("click")) == ["7.1"]
+    cache.close()
+
+
+def test_get_environment_key(monkeypatch):
+    assert get_environment_key()
+    # packaging<20
+    monkeypatch.setattr(pipgrip.cache, "sys_tags", None)
+    assert get_environment_key() == "py{}{}-{}".format(
+        sys.version_info[0], sys.version_info[1], sys.platform
+    )
+
+
+def test_package_source_metadata_cache(monkeypatch):
+    discovered = []
+
+    def discover_dependencies_and_versions(package, **kwargs):
+        discovered.append(package)
+        return dict(CLICK_METADATA, available=["6.7", "7.0"], requires=["pytest"])
+
+    def get_available_versions_from_pip(*args):
+        raise AssertionError("offline mode requested available versions")
+
+    monkeypatch.setattr(
+        pipgrip.package_source,
+        "discover_dependencies_and_versions",
+        discover_dependencies_and_versions,
+    )
+    monkeypatch.setattr(pipgrip.pipper, "_get_index_client", lambda *args: None)
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_get_available_versions_from_pip",
+        lambda *args: ["6.7", "7.0"],
+    )
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    kwargs = {
+        "cache_dir": None,
+        "no_cache_dir": False,
+        "index_url": None,
+        "extra_index_url": None,
+    }
+
+    PackageSource(pre=False, **kwargs).discover_and_add("click[test]>=6")
+    assert discovered == ["click[test]>=6"]
+
+    # a new run only has to list the versions
+    source = PackageSource(pre=False, **kwargs)
+    source.discover_and_add("click[test]>=6")
+    source.discover_and_add("click==7.0")
+    assert discovered == ["click[test]>=6"]
+    dependencies = source._packages["click"][frozenset(["test"])][Version.parse("7.0")]
+    assert [dep.name for dep in dependencies] == ["pytest"]
+    assert source._packages["click"][frozenset()][Version.parse("7.0")] == []
+
+    # offline runs use the last seen versions
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_get_available_versions_from_pip",
+        get_available_versions_from_pip,
+    )
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    source = PackageSource(pre=False, offline=True, **kwargs)
+    source.discover_and_add("click<8")
+    assert sorted(source._packages["click"][frozenset()]) == [
+        Version.parse("6.7"),
+        Version.parse("7.0"),
+    ]
+    with pytest.raises(RuntimeError, match=OFFLINE_FAILURE_STR + " click==6.7"):
+        source.discover_and_add("click==6.7")
+    assert discovered == ["click[test]>=6"]
+
+    # --no-cache-dir disables the metadata cache
+    source = PackageSource(pre=False, **dict(kwargs, no_cache_dir=True))
+    source.discover_and_add("click[test]>=6")
+    assert discovered == ["click[test]>=6"] * 2
+
+
+def test_offline_no_cache_dir():
+    result = CliRunner().invoke(main, ["--offline", "--no-cache-dir", "click"])
+    assert result.exit_code
+    assert "--offline has no effect with --no-cache-dir" in result.output
+
+
+def test_metadata_cache_ttl(tmp_path):
+    cache = MetadataCache(str(tmp_path / "metadata.sqlite3"), "", ttl=600)
+    cache.set_versions("click", True, ["7.0", "8.0rc1"])
+    cache.set_page("https://pypi.org/simple/click/", [], etag='"abc"')
+    assert cache.get_versions("click", True, fresh=True) == ["7.0", "8.0rc1"]
+    assert cache.get_page("https://pypi.org/simple/click/")["fresh"]
+
+    cache.ttl = 0
+    assert cache.get_versions("click", True, fresh=True) is None
+    assert cache.get_versions("click", True) == ["7.0", "8.0rc1"]
+    assert cache.get_page("https://pypi.org/simple/click/") == {
+        "etag": '"abc"',
+        "last_modified": None,
+        "files": [],
+        "fresh": False,
+    }
+    cache.ttl = 600
+    cache.touch_page("https://pypi.org/simple/click/")
+    assert cache.get_page("https://pypi.org/simple/click/")["fresh"]
+    cache.close()
+
+
+def test_metadata_cache_revalidates_by_default(tmp_path):
+    cache = MetadataCache(str(tmp_path / "metadata.sqlite3"), "")
+    cache.set_versions("click", False, ["7.0"])
+    cache.set_page("https://pypi.org/simple/click/", [], etag='"abc"')
+    assert cache.get_versions("click", False, fresh=True) is None
+    assert not cache.get_page("https://pypi.org/simple/click/")["fresh"]
+    cache.close()
+
+
+def test_metadata_cache_schema_version(tmp_path):
+    path = str(tmp_path / "metadata.sqlite3")
+    cache = MetadataCache(path, "")
+    cache.set_metadata(CLICK_METADATA)
+    with cache._connection:
+        cache._connection.execute("PRAGMA user_version = 0")
+    cache.close()
+
+    # outdated caches are dropped
+    cache = MetadataCache(path, "")
+    assert cache.get_metadata("click") == {}
+    cache.close()
+
+
+@pytest.mark.parametrize("pre", [True, False])
+def test_get_available_versions_cache(pre, monkeypatch, tmp_path):
+    listed = []
+
+    def get_available_versions_from_pip(package, *args):
+        listed.append(package)
+        return ["7.0", "8.0rc1"]
+
+    monkeypatch.setattr(pipgrip.pipper, "_get_index_client", lambda *args: None)
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_get_available_versions_from_pip",
+        get_available_versions_from_pip,
+    )
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    cache = MetadataCache(str(tmp_path / "metadata.sqlite3"), "", ttl=600)
+    expected = ["7.0", "8.0rc1"] if pre else ["7.0"]
+
+    for _ in range(2):
+        assert (
+            pipgrip.pipper._get_available_versions("click", None, None, pre, cache)
+            == expected
+        )
+    assert listed == ["click"]
+
+    # next runs reuse the persisted list within the ttl
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    assert (
+        pipgrip.pipper._get_available_versions("click", None, None, pre, cache)
+        == expected
+    )
+    assert listed == ["click"]
+    cache.close()
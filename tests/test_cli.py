@@ -196,6 +196,11 @@ def invoke_patched(
         "_get_available_versions",
         mock_get_available_versions,
     )
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_get_index_client",
+        lambda *args: None,
+    )
     monkeypatch.setattr(
         pipgrip.pipper,
         "default_environment",
@@ -0,0 +1,356 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import threading
+import time
+
+import pytest
+
+import pipgrip.concurrency
+import pipgrip.package_source
+import pipgrip.pipper
+from pipgrip.concurrency import (
+    BLOCKING,
+    CANDIDATE,
+    SPECULATIVE,
+    ConcurrencyGovernor,
+    LatencyTracker,
+    PriorityScheduler,
+    SingleFlight,
+    hedge,
+)
+from pipgrip.libs.semver import Version
+from pipgrip.package_source import PackageSource
+
+
+def run_concurrently(func, args_list, started=None):
+    threads = [threading.Thread(target=func, args=args) for args in args_list]
+    for thread in threads:
+        thread.start()
+    if started is not None:
+        started.set()
+    for thread in threads:
+        thread.join()
+
+
+class Clock(object):
+    """Stands in for the time module, moving only when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_priority_scheduler():
+    scheduler = PriorityScheduler(1)
+    started = threading.Event()
+    release = threading.Event()
+    ran = []
+
+    def block():
+        started.set()
+        release.wait()
+
+    def record(name):
+        ran.append(name)
+        if name == "error":
+            raise ValueError(name)
+        return name.upper()
+
+    # occupy the only worker, so that the following jobs are queued
+    scheduler.submit(block, priority=BLOCKING)
+    started.wait()
+    scheduler.submit(record, ("speculative",), SPECULATIVE)
+    scheduler.submit(record, ("x",), SPECULATIVE, group="x")
+    scheduler.submit(record, ("candidate",), CANDIDATE)
+    queued = scheduler.submit(record, ("queued",), SPECULATIVE, key="k")
+    assert scheduler.submit(record, ("other",), SPECULATIVE, key="k") is queued
+    assert scheduler.cancel(groups={"x"}) == 1
+
+    # a blocking call takes over the queued job with the same key
+    assert scheduler.run(record, ("blocking",), key="k") == "QUEUED"
+    with pytest.raises(ValueError, match="error"):
+        scheduler.run(record, ("error",))
+    assert ran == ["queued", "error"]
+
+    release.set()
+    scheduler.join()
+    assert ran == ["queued", "error", "candidate", "speculative"]
+
+    assert scheduler.run_all(record, ["a", "b", "c"]) == ["A", "B", "C"]
+    scheduler.close()
+    with pytest.raises(ValueError, match="closed"):
+        scheduler.submit(record, ("late",))
+
+
+def test_concurrency_governor(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(pipgrip.concurrency, "time", clock)
+    memory_pressure = []
+    governor = ConcurrencyGovernor(
+        "test", max_limit=8, memory_pressure=lambda: bool(memory_pressure)
+    )
+    assert governor.limit == 8
+
+    def call(latency, failed=False):
+        governor.acquire()
+        governor.release(latency, failed)
+
+    # multiplicative decrease on failure, once per round trip
+    call(0.1)
+    call(0.1, failed=True)
+    assert governor.limit == 4
+    call(0.1, failed=True)
+    assert governor.limit == 4
+    clock.now += 0.3
+    call(0.1, failed=True)
+    assert governor.limit == 2
+
+    # additive increase, limit calls per step
+    for expected in [2, 3, 3, 3, 4]:
+        call(0.1)
+        assert governor.limit == expected
+
+    # slow calls signal congestion
+    clock.now += 0.3
+    call(1)
+    assert governor.limit == 2
+
+    # so does memory pressure
+    memory_pressure.append(True)
+    clock.now += 1.1
+    call(0.1)
+    assert governor.limit == 1
+
+    # calls wait for a free slot
+    holding = threading.Event()
+    release = threading.Event()
+    acquired = threading.Event()
+
+    def hold():
+        with governor.slot():
+            holding.set()
+            release.wait()
+
+    def take():
+        with governor.slot():
+            acquired.set()
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert holding.wait(10)
+    taker = threading.Thread(target=take)
+    taker.start()
+    assert not acquired.wait(0.05)
+    release.set()
+    assert acquired.wait(10)
+    holder.join()
+    taker.join()
+
+    with pytest.raises(ValueError):
+        with governor.slot():
+            raise ValueError()
+
+    governor.max_limit = 3
+    assert governor.limit == 3
+
+
+def test_hedge():
+    called = []
+    stalled = threading.Event()
+
+    def answer(value, stall=False):
+        def call():
+            called.append(value)
+            if stall:
+                stalled.wait()
+            if isinstance(value, Exception):
+                raise value
+            return value
+
+        return call
+
+    # fast calls are not hedged
+    assert hedge([answer("a"), answer("b")], 60) == "a"
+    assert called == ["a"]
+
+    # slow calls are, the first answer wins
+    assert hedge([answer("a", stall=True), answer("b")], 0.01) == "b"
+    stalled.set()
+
+    # failed and rejected calls are hedged right away, without waiting 60 seconds
+    start = time.time()
+    assert hedge([answer(ValueError()), answer([]), answer(["c"])], 60) == ["c"]
+    assert hedge([answer(ValueError()), answer([])], 60) == []
+    with pytest.raises(ValueError, match="last"):
+        hedge([answer(ValueError("first")), answer(ValueError("last"))], 60)
+    assert time.time() - start < 30
+
+
+def test_latency_tracker():
+    tracker = LatencyTracker(percentile=0.9, default=2)
+    for latency in range(10):
+        tracker.observe("slow", latency)
+    tracker.observe("fast", 0.1)
+    # untried backends first, then by median latency
+    assert tracker.rank(["slow", "fast", "new"]) == ["new", "fast", "slow"]
+    assert tracker.deadline("slow") == 8
+    assert tracker.deadline("fast") == 2
+
+
+def test_single_flight(monkeypatch):
+    single_flight = SingleFlight()
+    calls = []
+    results = []
+    followers = []
+    condition = threading.Condition()
+
+    class Call(pipgrip.concurrency._Call):
+        def __init__(self):
+            super(Call, self).__init__()
+            wait = self.done.wait
+
+            def follow(*args):
+                with condition:
+                    followers.append(self)
+                    condition.notify_all()
+                return wait(*args)
+
+            self.done.wait = follow
+
+    monkeypatch.setattr(pipgrip.concurrency, "_Call", Call)
+
+    def slow(key):
+        with condition:
+            calls.append(key)
+            condition.notify_all()
+            # return once all followers wait for a call
+            while len(followers) < 4:
+                condition.wait()
+        if key == "error":
+            raise ValueError(key)
+        return key.upper()
+
+    def call(key):
+        try:
+            results.append(single_flight.do(key, slow, key))
+        except ValueError as exc:
+            results.append(exc)
+
+    leaders = [threading.Thread(target=call, args=(key,)) for key in "a b".split()]
+    leaders.append(threading.Thread(target=call, args=("error",)))
+    for thread in leaders:
+        thread.start()
+    with condition:
+        while len(calls) < 3:
+            condition.wait()
+    # the calls are in flight, so these wait for them
+    run_concurrently(call, [("a",)] * 3 + [("error",)])
+    for thread in leaders:
+        thread.join()
+
+    assert sorted(calls) == ["a", "b", "error"]
+    assert sorted(r for r in results if isinstance(r, str)) == ["A"] * 4 + ["B"]
+    errors = [r for r in results if isinstance(r, ValueError)]
+    assert len(errors) == 2
+    assert errors[0] is errors[1]
+
+    # finished calls are not remembered
+    assert single_flight.do("a", slow, "a") == "A"
+    assert calls.count("a") == 2
+    with pytest.raises(ValueError, match="error"):
+        single_flight.do("error", slow, "error")
+
+
+def test_package_source_concurrent_discovery(monkeypatch):
+    discovered = []
+    started = threading.Event()
+
+    def discover_dependencies_and_versions(package, **kwargs):
+        discovered.append(package)
+        # keep the discovery in flight until all callers started
+        assert started.wait(10)
+        return {
+            "name": "click",
+            "version": "7.0",
+            "available": ["6.7", "7.0"],
+            "requires": ["colorama"],
+        }
+
+    monkeypatch.setattr(
+        pipgrip.package_source,
+        "discover_dependencies_and_versions",
+        discover_dependencies_and_versions,
+    )
+    source = PackageSource(
+        cache_dir=None,
+        no_cache_dir=True,
+        index_url=None,
+        extra_index_url=None,
+        pre=False,
+    )
+    run_concurrently(
+        source.discover_and_add,
+        [("click>=6",)] * 4 + [("click<8",)] * 4,
+        started,
+    )
+    # one discovery per requirement, the second one does not fail on adding 7.0
+    assert sorted(discovered) == ["click<8", "click>=6"]
+    dependencies = source._packages["click"][frozenset()][Version.parse("7.0")]
+    assert [dep.name for dep in dependencies] == ["colorama"]
+
+
+def test_get_available_versions_concurrently(monkeypatch):
+    listed = []
+
+    started = threading.Event()
+
+    def get_available_versions_from_pip(package, *args):
+        listed.append(package)
+        assert started.wait(10)
+        return ["7.0"]
+
+    monkeypatch.setattr(pipgrip.pipper, "_get_index_client", lambda *args: None)
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_get_available_versions_from_pip",
+        get_available_versions_from_pip,
+    )
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    run_concurrently(
+        pipgrip.pipper._get_available_versions,
+        [("click", None, None, False)] * 4,
+        started,
+    )
+    assert listed == ["click"]
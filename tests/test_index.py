@@ -0,0 +1,578 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import hashlib
+import io
+import json
+import random
+import threading
+import time
+import zipfile
+
+import pytest
+
+import pipgrip.index
+import pipgrip.pipper
+from pipgrip.cache import MetadataCache
+from pipgrip.index import (
+    SIMPLE_JSON_CONTENT_TYPE,
+    IndexClient,
+    IndexClientError,
+    get_index_settings,
+    is_compatible_python,
+    parse_metadata,
+    version_from_filename,
+)
+from pipgrip.pipper import (
+    _get_available_versions,
+    discover_dependencies_and_versions,
+    parse_req,
+)
+
+CLICK_JSON = {
+    "meta": {"api-version": "1.0"},
+    "name": "click",
+    "files": [
+        {
+            "filename": "click-6.7.tar.gz",
+            "url": "https://files.example.com/click-6.7.tar.gz",
+            "hashes": {
+                "sha256": "f15516df478d5a56180fbf80e68f206010e6d160fc39fa508b65e035fd75130b"
+            },
+        },
+        {
+            "filename": "click-7.0-py2.py3-none-any.whl",
+            "url": "/files/click-7.0-py2.py3-none-any.whl",
+            "hashes": {},
+            "requires-python": ">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*",
+        },
+        {
+            "filename": "click-7.1.dev0-py2.py3-none-any.whl",
+            "url": "/files/click-7.1.dev0-py2.py3-none-any.whl",
+            "hashes": {},
+            "yanked": "broken",
+        },
+        {
+            "filename": "click-8.0-py3-none-any.whl",
+            "url": "/files/click-8.0-py3-none-any.whl",
+            "hashes": {},
+            "requires-python": "<2",
+        },
+        {
+            "filename": "click-8.1-cp27-cp27m-win32.whl",
+            "url": "/files/click-8.1-cp27-cp27m-win32.whl",
+            "hashes": {},
+        },
+    ],
+}
+
+CLICK_HTML = """<!DOCTYPE html>
+<html>
+  <body>
+    <a href="https://files.example.com/click-6.7.tar.gz#sha256=f15516df478d5a56180fbf80e68f206010e6d160fc39fa508b65e035fd75130b">click-6.7.tar.gz</a>
+    <a href="../../files/click-7.0-py2.py3-none-any.whl" data-requires-python="&gt;=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*">click-7.0-py2.py3-none-any.whl</a>
+    <a href="../../files/click-7.1.dev0-py2.py3-none-any.whl" data-yanked="">click-7.1.dev0-py2.py3-none-any.whl</a>
+    <a href="../../files/click-8.0-py3-none-any.whl" data-requires-python="&lt;2">click-8.0-py3-none-any.whl</a>
+    <a href="../../files/click-8.1-cp27-cp27m-win32.whl">click-8.1-cp27-cp27m-win32.whl</a>
+  </body>
+</html>
+"""
+
+
+@pytest.mark.parametrize(
+    "filename, project, expected",
+    [
+        ("click-7.0-py2.py3-none-any.whl", "click", "7.0"),
+        ("Click-7.0-py2.py3-none-any.whl", "click", "7.0"),
+        ("click-7.0-1-py2.py3-none-any.whl", "click", "7.0"),
+        ("click-7.0.tar.gz", "click", "7.0"),
+        ("jupyterlab-black-0.2.1.tar.gz", "jupyterlab-black", "0.2.1"),
+        ("jupyterlab_black-0.2.1.zip", "jupyterlab-black", "0.2.1"),
+        ("zope.interface-5.0.0rc1.tar.gz", "zope-interface", "5.0.0rc1"),
+        ("click-7.0.exe", "click", None),
+        ("click-nonsense.tar.gz", "click", None),
+        ("other-7.0.tar.gz", "click", None),
+    ],
+)
+def test_version_from_filename(filename, project, expected):
+    assert version_from_filename(filename, project) == expected
+
+
+def test_is_compatible_python():
+    assert is_compatible_python(None)
+    assert is_compatible_python(">=2.7")
+    assert not is_compatible_python("<2")
+    assert is_compatible_python("not a specifier")
+
+
+@pytest.mark.parametrize(
+    "content_type, body",
+    [
+        (SIMPLE_JSON_CONTENT_TYPE, json.dumps(CLICK_JSON)),
+        ("text/html; charset=utf-8", CLICK_HTML),
+    ],
+    ids=("PEP 691", "PEP 503"),
+)
+def test_get_available_versions(content_type, body, index_server):
+    index_server.add("/simple/click/", body, headers={"Content-Type": content_type})
+    client = IndexClient([index_server.url + "/simple"])
+
+    files = client.get_project_files("Click")
+    assert [f["url"] for f in files][:2] == [
+        "https://files.example.com/click-6.7.tar.gz",
+        index_server.url + "/files/click-7.0-py2.py3-none-any.whl",
+    ]
+    assert files[0]["hashes"] == {
+        "sha256": "f15516df478d5a56180fbf80e68f206010e6d160fc39fa508b65e035fd75130b"
+    }
+    assert files[2]["yanked"]
+
+    # like pip: yanked files are listed, incompatible wheels are not
+    assert client.get_available_versions("click") == ["6.7", "7.0", "7.1.dev0"]
+    assert index_server.requests[-1][1]["Accept"].startswith(SIMPLE_JSON_CONTENT_TYPE)
+
+    # keep-alive connections are reused
+    client.get_available_versions("click")
+    assert len(index_server.connections) == 1
+    client.close()
+
+
+def test_get_available_versions_multiple_indexes(index_server):
+    index_server.add(
+        "/primary/click/",
+        json.dumps(CLICK_JSON),
+        headers={"Content-Type": SIMPLE_JSON_CONTENT_TYPE},
+    )
+    index_server.add(
+        "/extra/click/",
+        '<a href="/files/click-9.0.tar.gz">click-9.0.tar.gz</a>',
+        headers={"Content-Type": "text/html"},
+    )
+    index_server.add(
+        "/redirect/click/", "", status=301, headers={"Location": "/extra/click/"}
+    )
+    client = IndexClient(
+        [
+            index_server.url + "/missing",
+            index_server.url + "/redirect/",
+            index_server.url + "/primary",
+        ]
+    )
+    # the first index that lists the project serves all of its files
+    assert client.get_available_versions("click") == ["9.0"]
+
+    index_server.add("/primary/click/", "oops", status=500)
+    client = IndexClient([index_server.url + "/primary"])
+    with pytest.raises(IndexClientError, match="HTTP 500"):
+        client.get_available_versions("click")
+
+
+def test_get_project_files_concurrently(index_server):
+    index_server.add(
+        "/primary/click/",
+        '<a href="/primary/click-7.0.tar.gz">click-7.0.tar.gz</a>'
+        '<a href="/primary/click-8.0.tar.gz">click-8.0.tar.gz</a>',
+        headers={"Content-Type": "text/html"},
+    )
+    index_server.add(
+        "/extra/click/",
+        '<a href="/extra/click-6.0.tar.gz">click-6.0.tar.gz</a>'
+        '<a href="/extra/click-7.0.tar.gz">click-7.0.tar.gz</a>',
+        headers={"Content-Type": "text/html"},
+    )
+    index_server.delays = {"/primary/click/": 0.5, "/extra/click/": 0.5}
+    client = IndexClient([index_server.url + "/primary", index_server.url + "/extra"])
+
+    start = time.time()
+    files = client.get_project_files("click")
+    assert time.time() - start < 0.9
+    # files are not mixed across indexes
+    assert [f["url"][len(index_server.url) :] for f in files] == [
+        "/primary/click-7.0.tar.gz",
+        "/primary/click-8.0.tar.gz",
+    ]
+    assert client.get_available_versions("click") == ["7.0", "8.0"]
+
+    # the extra index is only waited for if the primary one lacks the project
+    index_server.delays = {"/primary/six/": 0.5, "/extra/six/": 0.5}
+    index_server.add(
+        "/extra/six/",
+        '<a href="/extra/six-1.0.tar.gz">six-1.0.tar.gz</a>',
+        headers={"Content-Type": "text/html"},
+    )
+    start = time.time()
+    assert client.get_available_versions("six") == ["1.0"]
+    assert time.time() - start < 0.9
+
+
+def test_get_project_files_slow_extra_index(index_server):
+    index_server.add(
+        "/primary/click/",
+        '<a href="/primary/click-7.0.tar.gz">click-7.0.tar.gz</a>',
+        headers={"Content-Type": "text/html"},
+    )
+    release = threading.Event()
+    index_server.blocked = {"/extra/click/": release}
+    client = IndexClient([index_server.url + "/primary", index_server.url + "/extra"])
+    start = time.time()
+    try:
+        # answered by the primary index while the extra one hangs (for 10 seconds)
+        assert client.get_available_versions("click") == ["7.0"]
+        assert time.time() - start < 5
+    finally:
+        release.set()
+    client.close()
+
+
+def test_get_project_page_cache(index_server, tmp_path):
+    index_server.add(
+        "/simple/click/",
+        json.dumps(CLICK_JSON),
+        headers={"Content-Type": SIMPLE_JSON_CONTENT_TYPE, "ETag": '"v1"'},
+    )
+    page_url = index_server.url + "/simple/click/"
+    cache = MetadataCache(str(tmp_path / "metadata.sqlite3"), "", ttl=600)
+    files = IndexClient(
+        [index_server.url + "/simple"], page_cache=cache
+    ).get_project_files("click")
+    assert cache.get_page(page_url)["etag"] == '"v1"'
+    assert len(index_server.requests) == 1
+
+    # fresh pages are reused by other runs without any request
+    client = IndexClient([index_server.url + "/simple"], page_cache=cache)
+    assert client.get_project_files("click") == files
+    assert len(index_server.requests) == 1
+
+    # expired pages are revalidated
+    cache.ttl = 0
+    client = IndexClient([index_server.url + "/simple"], page_cache=cache)
+    assert client.get_project_files("click") == files
+    assert index_server.requests[-1][1]["If-None-Match"] == '"v1"'
+    assert len(index_server.requests) == 2
+
+    # and replaced when modified
+    index_server.add(
+        "/simple/click/",
+        '<a href="/files/click-9.0.tar.gz">click-9.0.tar.gz</a>',
+        headers={"Content-Type": "text/html", "ETag": '"v2"'},
+    )
+    client = IndexClient([index_server.url + "/simple"], page_cache=cache)
+    assert client.get_available_versions("click") == ["9.0"]
+    assert cache.get_page(page_url)["etag"] == '"v2"'
+    client.close()
+    cache.close()
+
+
+def test_get_index_settings(monkeypatch):
+    monkeypatch.setattr(
+        pipgrip.index,
+        "_load_pip_config",
+        lambda: {
+            "global.index-url": "https://global.example.com/simple",
+            ":env:.extra-index-url": "https://a.example.com/simple https://b.example.com/simple",
+            "global.trusted-host": "a.example.com",
+        },
+    )
+    settings = get_index_settings(None, None)
+    assert settings["index_urls"] == [
+        "https://global.example.com/simple",
+        "https://a.example.com/simple",
+        "https://b.example.com/simple",
+    ]
+    assert settings["trusted_hosts"] == {"a.example.com"}
+    assert not settings["prefer_binary"]
+    assert settings["only_binary"] == set()
+
+    settings = get_index_settings("https://cli.example.com/simple", None)
+    assert settings["index_urls"][0] == "https://cli.example.com/simple"
+    assert "cli.example.com" in settings["trusted_hosts"]
+
+    monkeypatch.setattr(
+        pipgrip.index,
+        "_load_pip_config",
+        lambda: {
+            "install.prefer-binary": "yes",
+            "global.only-binary": "Zope.Interface,:none:",
+        },
+    )
+    settings = get_index_settings(None, None)
+    assert settings["prefer_binary"]
+    assert settings["only_binary"] == {"zope-interface"}
+
+    monkeypatch.setattr(
+        pipgrip.index, "_load_pip_config", lambda: {"global.no-index": "true"}
+    )
+    assert get_index_settings(None, None) is None
+
+
+def test_pipper_available_versions(index_server, monkeypatch):
+    def patch_pip_output(*args, **kwargs):
+        raise AssertionError("pip should not be called")
+
+    monkeypatch.setattr(pipgrip.pipper, "stream_bash_command", patch_pip_output)
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    monkeypatch.setattr(pipgrip.index, "_load_pip_config", lambda: {})
+    index_server.add(
+        "/simple/click/",
+        json.dumps(CLICK_JSON),
+        headers={"Content-Type": SIMPLE_JSON_CONTENT_TYPE},
+    )
+    index_url = index_server.url + "/simple"
+    assert _get_available_versions("click", index_url, None, pre=False) == [
+        "6.7",
+        "7.0",
+    ]
+    assert _get_available_versions("click", index_url, None, pre=True) == [
+        "6.7",
+        "7.0",
+        "7.1.dev0",
+    ]
+    pipgrip.pipper.close_index_clients()
+
+
+METADATA = """Metadata-Version: 2.1
+Name: Click
+Version: 7.0
+Requires-Python: >=2.7
+Requires-Dist: colorama; platform_system == "Windows"
+Requires-Dist: pytest; extra == "test"
+Provides-Extra: test
+
+Composable command line interface toolkit
+"""
+
+
+def test_parse_metadata():
+    assert parse_metadata(METADATA) == {
+        "metadata_version": "2.1",
+        "name": "Click",
+        "version": "7.0",
+        "requires_dist": [
+            'colorama; platform_system == "Windows"',
+            'pytest; extra == "test"',
+        ],
+        "requires_python": ">=2.7",
+        "provides_extra": ["test"],
+    }
+    with pytest.raises(ValueError, match="Name and Version"):
+        parse_metadata("Metadata-Version: 2.1\n")
+
+
+def test_find_best_candidate(index_server):
+    index_server.add(
+        "/simple/click/",
+        json.dumps(CLICK_JSON),
+        headers={"Content-Type": SIMPLE_JSON_CONTENT_TYPE},
+    )
+    client = IndexClient([index_server.url + "/simple"])
+
+    version, file = client.find_best_candidate(parse_req("click"), pre=False)
+    assert version == "7.0"
+    assert file["filename"] == "click-7.0-py2.py3-none-any.whl"
+    # yanked versions are only selected when nothing else matches
+    assert client.find_best_candidate(parse_req("click"), pre=True)[0] == "7.0"
+    assert client.find_best_candidate(parse_req("click==7.1.dev0"), pre=True)[0] == (
+        "7.1.dev0"
+    )
+    assert client.find_best_candidate(parse_req("click>7.0"), pre=True)[0] == (
+        "7.1.dev0"
+    )
+    # sdist only
+    assert client.find_best_candidate(parse_req("click<7"), pre=False) == ("6.7", None)
+    with pytest.raises(IndexClientError, match="No matching distribution"):
+        client.find_best_candidate(parse_req("click>9"), pre=False)
+
+
+@pytest.mark.parametrize(
+    "kwargs, req, expected",
+    [
+        ({}, "foo", "2.0"),
+        ({"prefer_binary": True}, "foo", "1.0"),
+        ({"prefer_binary": True}, "foo>1", "2.0"),
+        ({"only_binary": {"foo"}}, "foo", "1.0"),
+        ({"only_binary": {":all:"}}, "foo>1", None),
+        ({"only_binary": {"bar"}}, "foo", "2.0"),
+    ],
+)
+def test_find_best_candidate_binary(index_server, kwargs, req, expected):
+    index_server.add(
+        "/simple/foo/",
+        json.dumps(
+            {
+                "meta": {"api-version": "1.0"},
+                "name": "foo",
+                "files": [
+                    {
+                        "filename": "foo-1.0-py2.py3-none-any.whl",
+                        "url": "/1",
+                        "hashes": {},
+                    },
+                    {"filename": "foo-2.0.tar.gz", "url": "/2", "hashes": {}},
+                ],
+            }
+        ),
+        headers={"Content-Type": SIMPLE_JSON_CONTENT_TYPE},
+    )
+    client = IndexClient([index_server.url + "/simple"], **kwargs)
+
+    if expected is None:
+        with pytest.raises(IndexClientError, match="No matching distribution"):
+            client.find_best_candidate(parse_req(req), pre=False)
+    else:
+        assert client.find_best_candidate(parse_req(req), pre=False)[0] == expected
+
+
+def test_discover_dependencies_and_versions_pep658(index_server, monkeypatch):
+    def patch_pip_output(*args, **kwargs):
+        raise AssertionError("pip should not be called")
+
+    monkeypatch.setattr(pipgrip.pipper, "stream_bash_command", patch_pip_output)
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+    monkeypatch.setattr(pipgrip.index, "_load_pip_config", lambda: {})
+
+    click_json = json.loads(json.dumps(CLICK_JSON))
+    click_json["files"][1]["core-metadata"] = {
+        "sha256": hashlib.sha256(METADATA.encode("utf-8")).hexdigest()
+    }
+    index_server.add(
+        "/simple/click/",
+        json.dumps(click_json),
+        headers={"Content-Type": SIMPLE_JSON_CONTENT_TYPE},
+    )
+    index_server.add("/files/click-7.0-py2.py3-none-any.whl.metadata", METADATA)
+
+    assert discover_dependencies_and_versions(
+        "click[test]",
+        index_url=index_server.url + "/simple",
+        extra_index_url=None,
+        cache_dir=None,
+        pre=False,
+    ) == {
+        "name": "Click",
+        "version": "7.0",
+        "available": ["6.7", "7.0"],
+        "requires": ["pytest"],
+        "requires_dist": [
+            'colorama; platform_system == "Windows"',
+            'pytest; extra == "test"',
+        ],
+        "requires_python": ">=2.7",
+        "portable": True,
+    }
+    pipgrip.pipper.close_index_clients()
+
+
+def test_get_core_metadata_hash_mismatch(index_server):
+    index_server.add("/files/click-7.0-py2.py3-none-any.whl.metadata", METADATA)
+    client = IndexClient([index_server.url + "/simple"])
+    file = {
+        "url": index_server.url + "/files/click-7.0-py2.py3-none-any.whl",
+        "metadata": {"sha256": "0" * 64},
+    }
+    with pytest.raises(IndexClientError, match="Hash mismatch"):
+        client.get_core_metadata(file)
+    file["metadata"] = True
+    assert client.get_core_metadata(file)["version"] == "7.0"
+
+
+def test_file_index(tmpdir):
+    tmpdir.mkdir("simple").mkdir("click").join("index.html").write(CLICK_HTML)
+    client = IndexClient(["file://" + str(tmpdir.join("simple"))])
+    assert client.get_available_versions("click") == ["6.7", "7.0", "7.1.dev0"]
+    assert client.get_project_files("six") == []
+
+
+def _make_wheel(padding):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as wheel:
+        # incompressible payload, like the shared objects in binary wheels
+        wheel.writestr("click/_speedups.so", padding)
+        wheel.writestr("click/__init__.py", "")
+        wheel.writestr("click-7.0.dist-info/METADATA", METADATA)
+        wheel.writestr("click-7.0.dist-info/RECORD", "")
+    return buffer.getvalue()
+
+
+def test_get_wheel_metadata_lazily(index_server):
+    rng = random.Random(42)
+    wheel = _make_wheel(bytes(bytearray(rng.getrandbits(8) for _ in range(2**19))))
+    path = "/files/click-7.0-py2.py3-none-any.whl"
+    index_server.add(path, wheel, headers={"Accept-Ranges": "bytes"})
+    client = IndexClient([index_server.url + "/simple"])
+
+    metadata = client.get_wheel_metadata_lazily({"url": index_server.url + path})
+    assert metadata["requires_dist"] == [
+        'colorama; platform_system == "Windows"',
+        'pytest; extra == "test"',
+    ]
+    assert index_server.bytes_sent < len(wheel) / 4
+
+    # servers without range support are not read lazily
+    index_server.add(path, wheel)
+    with pytest.raises(IndexClientError, match="does not support range requests"):
+        client.get_wheel_metadata_lazily({"url": index_server.url + path})
+
+
+def test_hedge_mirrors(index_server):
+    metadata_paths = []
+    for mirror in ("slow", "fast"):
+        path = "/{}files/click-7.0-py2.py3-none-any.whl".format(mirror)
+        index_server.add(
+            "/{}/click/".format(mirror),
+            '<a href="{}" data-core-metadata="true">{}</a>'.format(
+                path, path.rsplit("/", 1)[1]
+            ),
+            headers={"Content-Type": "text/html"},
+        )
+        index_server.add(path + ".metadata", METADATA)
+        metadata_paths.append(path + ".metadata")
+    client = IndexClient(
+        [index_server.url + "/slow", index_server.url + "/fast"], hedge=True
+    )
+    client._page_latencies.default = client._metadata_latencies.default = 0.2
+
+    # the primary index is slow, the mirror answers
+    index_server.delays = {"/slow/click/": 1}
+    start = time.time()
+    files = client.get_project_files("click")
+    assert time.time() - start < 0.8
+    assert files[0]["url"] == index_server.url + "/fastfiles/" + files[0]["filename"]
+
+    # the file on the fastest mirror is slow, the same file on the other one answers
+    time.sleep(1)
+    assert client._page_latencies.rank(client.index_urls)[0].endswith("/fast/")
+    index_server.delays = {metadata_paths[1]: 1}
+    start = time.time()
+    assert client.get_core_metadata(files[0])["version"] == "7.0"
+    assert time.time() - start < 0.8
+    assert metadata_paths[0] in [path for path, _ in index_server.requests]
+    client.close()
@@ -0,0 +1,304 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import threading
+
+import pytest
+
+import pipgrip.package_source
+from pipgrip.concurrency import BLOCKING, SPECULATIVE, PriorityScheduler
+from pipgrip.libs.mixology.package import Package
+from pipgrip.libs.mixology.version_solver import CACHED_HEURISTIC, VersionSolver
+from pipgrip.libs.semver import Version
+from pipgrip.package_source import PackageSource
+from pipgrip.pipper import parse_req
+
+
+@pytest.fixture()
+def source(monkeypatch):
+    source = PackageSource(
+        cache_dir=None,
+        no_cache_dir=True,
+        index_url=None,
+        extra_index_url=None,
+        pre=False,
+    )
+    source.discovered = []
+
+    def discover_dependencies_and_versions(package, **kwargs):
+        source.discovered.append(package)
+        return {
+            "name": "Click",
+            "version": "7.0",
+            "available": ["6.7", "7.0"],
+            "requires": ["colorama"],
+            "requires_dist": [
+                'colorama; platform_system != "Plan9"',
+                'pytest; extra == "test"',
+                'sphinx; extra == "docs"',
+            ],
+            "requires_python": None,
+        }
+
+    monkeypatch.setattr(
+        pipgrip.package_source,
+        "discover_dependencies_and_versions",
+        discover_dependencies_and_versions,
+    )
+    return source
+
+
+def test_extras_share_metadata(source):
+    source.discover_and_add("click>=6")
+    assert source.discovered == ["click>=6"]
+
+    package = Package("click[docs,test]>=6")
+    assert source._versions_for(package) == [Version.parse("7.0"), Version.parse("6.7")]
+    dependencies = source.dependencies_for(package, Version.parse("7.0"))
+    assert [dep.name for dep in dependencies] == ["colorama", "pytest", "sphinx"]
+    dependencies = source.dependencies_for(Package("click[test]"), Version.parse("7.0"))
+    assert [dep.name for dep in dependencies] == ["colorama", "pytest"]
+    assert source.discovered == ["click>=6"]
+
+    # other versions are still discovered
+    source.dependencies_for(Package("click[test]"), Version.parse("6.7"))
+    assert source.discovered == ["click>=6", "click[test]==6.7"]
+
+
+def test_extras_share_metadata_of_selected_version(source, monkeypatch):
+    def discover_dependencies_and_versions(package, pre, **kwargs):
+        source.discovered.append(package)
+        req = parse_req(package)
+        pinned = [version for op, version in req.specs if op == "=="]
+        return {
+            "name": "Click",
+            "version": pinned[0] if pinned else "7.1rc1" if pre else "7.0",
+            "available": ["6.7", "7.0", "7.1rc1"],
+            "requires": [],
+            "requires_dist": [],
+        }
+
+    monkeypatch.setattr(
+        pipgrip.package_source,
+        "discover_dependencies_and_versions",
+        discover_dependencies_and_versions,
+    )
+    source.discover_and_add("click==6.7")
+    # pip would select 7.0, which was not discovered yet
+    assert source.discover_and_add("click[test]>=6")["version"] == "7.0"
+    assert source.discover_and_add("click[docs]<7")["version"] == "6.7"
+    assert source.discovered == ["click==6.7", "click[test]>=6"]
+
+    # and with --pre, the pre-release
+    source.pre = True
+    assert source.discover_and_add("click[dev]")["version"] == "7.1rc1"
+    assert source.discovered == ["click==6.7", "click[test]>=6", "click[dev]"]
+
+
+def test_known_versions_and_dependencies(source):
+    package = Package("click")
+    assert source.known_versions_for(package) is None
+    assert source.metadata_revision(package) == 0
+
+    source.discover_and_add("click")
+    assert source.take_metadata_changes() == {"click"}
+    assert source.metadata_revision(package) > 0
+    versions = source.known_versions_for(package)
+    assert versions == [Version.parse("7.0"), Version.parse("6.7")]
+    dependencies = source.known_dependencies_for(package, versions[0])
+    assert [dep.name for dep in dependencies] == ["colorama"]
+    assert source.known_dependencies_for(package, versions[1]) is None
+    # other extras are not derived yet
+    assert source.known_versions_for(Package("click[test]")) is None
+    assert source.discovered == ["click"]
+
+
+GRAPH = {
+    "a": ["b", "c>=1"],
+    "b": ["d"],
+    "c": ["broken", "e"],
+    "d": ["f"],
+}
+
+
+@pytest.fixture()
+def graph_source(monkeypatch):
+    source = PackageSource(
+        cache_dir=None,
+        no_cache_dir=True,
+        index_url=None,
+        extra_index_url=None,
+        pre=False,
+    )
+    source.discovered = []
+
+    def discover_dependencies_and_versions(package, **kwargs):
+        source.discovered.append(package)
+        name = package.split(">")[0]
+        if name == "broken":
+            raise RuntimeError("Failed to get report for broken")
+        if name == "crash":
+            raise TypeError("not a discovery error")
+        return {
+            "name": name,
+            "version": "1.0",
+            "available": ["1.0"],
+            "requires": GRAPH.get(name, []),
+            "requires_dist": GRAPH.get(name, []),
+        }
+
+    monkeypatch.setattr(
+        pipgrip.package_source,
+        "discover_dependencies_and_versions",
+        discover_dependencies_and_versions,
+    )
+    return source
+
+
+@pytest.mark.parametrize(
+    "depth, budget, expected",
+    [
+        (0, 100, ["a"]),
+        (1, 100, ["a", "b", "c>=1"]),
+        (2, 100, ["a", "b", "broken", "c>=1", "d", "e"]),
+        (5, 100, ["a", "b", "broken", "c>=1", "d", "e", "f"]),
+        (5, 4, ["a", "b", "c>=1", "d"]),
+    ],
+)
+def test_prefetch(depth, budget, expected, graph_source):
+    graph_source.root_dep("a")
+    graph_source.prefetch(depth=depth, budget=budget, threads=4)
+    assert sorted(graph_source.discovered) == expected
+
+    # the solver finds prefetched packages discovered
+    graph_source._versions_for(Package("a"))
+    graph_source.dependencies_for(Package("a"), Version.parse("1.0"))
+    assert sorted(graph_source.discovered) == expected
+
+
+def test_prefetch_unexpected_error(graph_source):
+    graph_source.root_dep("crash")
+    with pytest.raises(TypeError, match="not a discovery error"):
+        graph_source.prefetch(depth=0)
+
+
+@pytest.mark.parametrize(
+    "budget, expected",
+    [
+        (0, ["a"]),
+        (2, ["a", "b", "c>=1"]),
+        (100, ["a", "b", "broken", "c>=1", "d", "e", "f"]),
+    ],
+)
+def test_speculation(budget, expected, graph_source):
+    scheduler = PriorityScheduler(4)
+    graph_source.start_speculation(scheduler, budget=budget)
+    graph_source.discover_and_add("a")
+    scheduler.join()
+    graph_source.stop_speculation()
+    scheduler.close()
+    assert sorted(graph_source.discovered) == expected
+
+    # speculation stopped
+    graph_source.discover_and_add("g")
+    assert sorted(graph_source.discovered) == sorted(expected + ["g"])
+
+
+def test_speculation_cancelled(graph_source):
+    scheduler = PriorityScheduler(1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    scheduler.submit(block, priority=BLOCKING)
+    assert started.wait(10)
+    graph_source.start_speculation(scheduler, budget=2)
+    graph_source.discover_and_add("a")
+    # the solver backtracked before the speculative discoveries of b and c ran
+    assert scheduler.cancel(groups={"a"}) == 2
+
+    # so they are refunded, and speculated again
+    graph_source._speculate(GRAPH["a"], "a")
+    release.set()
+    scheduler.join()
+    graph_source.stop_speculation()
+    scheduler.close()
+    assert sorted(graph_source.discovered) == ["a", "b", "c>=1"]
+
+
+class EagerScheduler(PriorityScheduler):
+    """Runs speculative jobs right away, in the thread submitting them."""
+
+    def submit(self, func, args=(), priority=SPECULATIVE, key=None, group=None):
+        job = super(EagerScheduler, self).submit(func, args, priority, key, group)
+        if priority == SPECULATIVE:
+            self.wait(job)
+        return job
+
+
+@pytest.mark.parametrize("scheduler_class", [PriorityScheduler, EagerScheduler])
+def test_speculation_cached_heuristic(scheduler_class, graph_source):
+    # with its thread blocked, the scheduler only runs the speculative discoveries
+    # the solver takes over, or all of them right away (EagerScheduler)
+    scheduler = scheduler_class(1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    scheduler.submit(block, priority=BLOCKING)
+    assert started.wait(10)
+    graph_source.root_dep("d")
+    graph_source.root_dep("e")
+    graph_source.start_speculation(scheduler, budget=100)
+    solver = VersionSolver(
+        graph_source, scheduler=scheduler, heuristic=CACHED_HEURISTIC
+    )
+    solver.solve()
+    release.set()
+    graph_source.stop_speculation()
+    scheduler.close()
+
+    # f is only known to the solver once it discovers f itself, even if f was
+    # discovered speculatively when d was
+    assert [str(package) for package in solver.solution.decisions] == [
+        "_root_",
+        "d",
+        "e",
+        "f",
+    ]
+    assert sorted(graph_source.discovered) == ["d", "e", "f"]
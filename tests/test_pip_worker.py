@@ -0,0 +1,140 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import os
+import subprocess
+import sys
+
+import pytest
+
+import pipgrip.pip_worker
+import pipgrip.pipper
+from pipgrip.pip_worker import PipWorkerError, PipWorkerPool, _run_pip
+from pipgrip.pipper import stream_bash_command
+
+
+def test_pip_worker_pool():
+    pool = PipWorkerPool(size=1, max_jobs=2)
+    try:
+        returncode, output = pool.run(["--version"])
+        assert returncode == 0
+        assert output.startswith("pip ")
+        (worker,) = pool._idle
+
+        # failures are reported like for a pip subprocess
+        returncode, output = pool.run(["install", "--no-such-option"])
+        assert returncode == 2
+        assert "no such option" in output
+
+        # recycled after max_jobs
+        assert not pool._idle
+        assert worker.process.poll() is not None
+        assert pool.run(["--version"])[0] == 0
+
+        # crashed workers are replaced
+        (worker,) = pool._idle
+        worker.process.kill()
+        worker.process.wait()
+        assert pool.run(["--version"]) is None
+        assert pool.run(["--version"])[0] == 0
+    finally:
+        pool.close()
+    assert not pool._idle
+
+
+def test_pip_worker_pool_environment(monkeypatch):
+    pool = PipWorkerPool(size=1)
+    try:
+        assert pool.run(["--version"])[0] == 0
+        (worker,) = pool._idle
+
+        # workers started in another environment are replaced
+        monkeypatch.setenv("PIPGRIP_TEST_PIP_WORKER", "1")
+        assert pool.run(["--version"])[0] == 0
+        assert pool._idle != [worker]
+        assert worker.process.poll() is not None
+        assert pool._started == 1
+    finally:
+        pool.close()
+
+
+def test_run_pip_console_output():
+    def pip_main(args):
+        sys.stdout.write("Building wheel for {}\n".format(args[0]))
+        # like a build subprocess inheriting the file descriptors
+        os.write(2, b"error: subprocess-exited-with-error\n")
+        return 1
+
+    returncode, output, console = _run_pip(pip_main, ["sdist-only"])
+    assert returncode == 1
+    assert output == "Building wheel for sdist-only\n"
+    assert console == "error: subprocess-exited-with-error\n"
+
+
+def test_pip_worker_pool_disabled(monkeypatch):
+    def pip_worker():
+        raise PipWorkerError("Failed to start pip worker")
+
+    monkeypatch.setattr(pipgrip.pip_worker, "_PipWorker", pip_worker)
+    pool = PipWorkerPool(size=1)
+    assert pool.run(["--version"]) is None
+    assert pool._disabled
+    assert pool._started == 0
+
+
+class MockPipWorkerPool(object):
+    def __init__(self, result):
+        self.result = result
+        self.calls = []
+
+    def run(self, args):
+        self.calls.append(args)
+        return self.result
+
+
+def test_stream_bash_command_pip_worker(monkeypatch):
+    pool = MockPipWorkerPool((0, "Successfully built"))
+    monkeypatch.setattr(pipgrip.pipper, "_pip_workers", pool)
+    assert stream_bash_command([sys.executable, "-m", "pip", "wheel", "six"]) == (
+        "Successfully built"
+    )
+    assert pool.calls == [["wheel", "six"]]
+
+    pool.result = (1, "ERROR: No matching distribution found for six")
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        stream_bash_command([sys.executable, "-m", "pip", "wheel", "six"])
+    assert excinfo.value.output == pool.result[1]
+
+    # interactive commands and non-pip commands run as subprocess
+    pool.result = None
+    assert stream_bash_command([sys.executable, "-c", "print(42)"]) == "42\n"
+    assert len(pool.calls) == 2
@@ -33,11 +33,20 @@
 import json
 import os
 import subprocess
+import threading
 
 import pytest
 
 import pipgrip.pipper
-from pipgrip.pipper import _download_wheel, _get_available_versions, _get_package_report
+from pipgrip.concurrency import ConcurrencyGovernor
+from pipgrip.pipper import (
+    _download_wheel,
+    _get_available_versions,
+    _get_package_report,
+    _ReportBatcher,
+    discover_dependencies_and_versions,
+    parse_req,
+)
 
 
 @pytest.mark.parametrize(
@@ -329,6 +338,125 @@ def test_get_package_report(package, pip_output, expected, monkeypatch):
     )
 
 
+def test_report_batcher(monkeypatch):
+    calls = []
+    retries = {}
+    blocked = threading.Event()
+    unblock = threading.Event()
+
+    def patch_pip_output(args, **kwargs):
+        packages = args[args.index("--report") + 2 :]
+        calls.append(packages)
+        if packages == ["blocker"]:
+            blocked.set()
+            assert unblock.wait(10)
+        if packages[0] in retries and len(packages) == 1:
+            # retries run concurrently: wait until all of them started
+            retries[packages[0]].set()
+            for package, event in retries.items():
+                assert event.wait(10), package
+        if "broken" in packages:
+            raise subprocess.CalledProcessError(returncode=1, cmd="", output="")
+        with open(args[args.index("--report") + 1], "w") as fp:
+            json.dump(
+                {
+                    "install": [
+                        {"metadata": {"name": package.split("[")[0].upper()}}
+                        for package in packages
+                    ]
+                },
+                fp,
+            )
+
+    monkeypatch.setattr(pipgrip.pipper, "stream_bash_command", patch_pip_output)
+    # batches only wait when full, or when the tests hang
+    monkeypatch.setattr(pipgrip.pipper, "REPORT_BATCH_WINDOW", 60)
+    batcher = _ReportBatcher()
+    results = {}
+
+    def get_metadata(package, pre=False):
+        try:
+            results[package] = batcher.get_metadata(
+                parse_req(package),
+                index_url=None,
+                extra_index_url=None,
+                pre=pre,
+                cache_dir=None,
+                no_cache_dir=False,
+            )
+        except RuntimeError as exc:
+            results[package] = str(exc)
+
+    def run_concurrently(packages):
+        # a lone request does not wait for company
+        blocked.clear()
+        unblock.clear()
+        blocker = threading.Thread(target=get_metadata, args=("blocker", True))
+        blocker.start()
+        assert blocked.wait(10)
+
+        # while it is in flight, requests are batched
+        monkeypatch.setattr(pipgrip.pipper, "REPORT_BATCH_SIZE", len(packages))
+        threads = [
+            threading.Thread(target=get_metadata, args=(package,))
+            for package in packages
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        unblock.set()
+        blocker.join()
+        calls.remove(["blocker"])
+
+    # duplicate projects go in separate pip calls
+    run_concurrently(["click", "six", "click[test]"])
+    assert sorted(map(sorted, calls)) == [["click", "six"], ["click[test]"]]
+    assert results == {
+        "blocker": {"name": "BLOCKER"},
+        "click": {"name": "CLICK"},
+        "six": {"name": "SIX"},
+        "click[test]": {"name": "CLICK"},
+    }
+
+    # failed batches are retried one by one
+    calls[:] = []
+    retries.update(click=threading.Event(), broken=threading.Event())
+    run_concurrently(["click", "broken"])
+    assert sorted(map(sorted, calls)) == [["broken"], ["broken", "click"], ["click"]]
+    assert results["click"] == {"name": "CLICK"}
+    assert results["broken"] == "Failed to get report for broken"
+
+
+def test_report_batcher_unexpected_error(monkeypatch):
+    calls = []
+
+    def get_packages_report(packages, **options):
+        calls.append(packages)
+        # rather than retrying forever
+        assert len(calls) < 10
+        raise subprocess.CalledProcessError(returncode=1, cmd="", output="")
+
+    def get_package_report(package, **options):
+        calls.append([package])
+        raise OSError("pip worker died")
+
+    monkeypatch.setattr(pipgrip.pipper, "_get_packages_report", get_packages_report)
+    monkeypatch.setattr(pipgrip.pipper, "_get_package_report", get_package_report)
+    monkeypatch.setattr(pipgrip.pipper, "REPORT_BATCH_SIZE", 2)
+    entries = [
+        {"req": parse_req(package), "done": threading.Event(), "exc": None}
+        for package in ("a", "b", "c")
+    ]
+    _ReportBatcher()._run(list(entries), {})
+
+    # the failed chunk is retried one by one, and then the rest of the batch
+    assert sorted(map(sorted, calls)) == [["a"], ["a", "b"], ["b"], ["c"]]
+    for entry in entries:
+        assert entry["done"].is_set()
+        assert isinstance(entry["exc"], OSError)
+
+
 @pytest.mark.parametrize(
     "package, pre, pip_output, expected",
     [
@@ -364,6 +492,16 @@ def test_get_available_versions(package, pre, pip_output, expected, monkeypatch)
         "stream_bash_command",
         patch_pip_output,
     )
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_get_index_client",
+        lambda *args: None,
+    )
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_available_versions_cache",
+        {},
+    )
 
     assert (
         _get_available_versions(
@@ -381,3 +519,53 @@ def test_stream_bash_command():
     pipgrip.pipper.stream_bash_command(["ls"])
     with pytest.raises(subprocess.CalledProcessError, match=".nonexist"):
         pipgrip.pipper.stream_bash_command(["cat", ".nonexist"])
+
+
+def test_stream_bash_command_governor(monkeypatch):
+    governor = ConcurrencyGovernor("test", max_limit=8, memory_pressure=lambda: False)
+    monkeypatch.setattr(pipgrip.pipper, "_subprocess_governor", governor)
+
+    # expected failures say nothing about the load
+    with pytest.raises(subprocess.CalledProcessError):
+        pipgrip.pipper.stream_bash_command(["cat", ".nonexist"], failure_expected=True)
+    assert governor.limit == 8
+
+    with pytest.raises(subprocess.CalledProcessError):
+        pipgrip.pipper.stream_bash_command(["cat", ".nonexist"])
+    assert governor.limit == 4
+
+
+def test_discover_lists_versions_concurrently(monkeypatch):
+    started = {"versions": threading.Event(), "metadata": threading.Event()}
+
+    def get_available_versions_from_pip(package, *args):
+        started["versions"].set()
+        # fails if the metadata is only requested afterwards
+        assert started["metadata"].wait(5)
+        return ["1.0", "2.0rc1", "2.0"]
+
+    def get_pip_metadata(req, **kwargs):
+        started["metadata"].set()
+        assert started["versions"].wait(5)
+        return {"name": "Foo", "version": "2.0", "requires_dist": ["bar>1"]}
+
+    monkeypatch.setattr(pipgrip.pipper, "_get_index_client", lambda *args: None)
+    monkeypatch.setattr(
+        pipgrip.pipper,
+        "_get_available_versions_from_pip",
+        get_available_versions_from_pip,
+    )
+    monkeypatch.setattr(pipgrip.pipper, "_get_pip_metadata", get_pip_metadata)
+    monkeypatch.setattr(pipgrip.pipper, "_available_versions_cache", {})
+
+    assert discover_dependencies_and_versions(
+        "foo", index_url=None, extra_index_url=None, cache_dir=None, pre=False
+    ) == {
+        "name": "Foo",
+        "version": "2.0",
+        "available": ["1.0", "2.0"],
+        "requires": ["bar>1"],
+        "requires_dist": ["bar>1"],
+        "requires_python": None,
+        "portable": False,
+    }
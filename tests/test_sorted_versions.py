@@ -0,0 +1,119 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import pytest
+
+from pipgrip.libs.mixology.range import Range
+from pipgrip.libs.semver import Version
+from pipgrip.sorted_versions import SortedVersions, version_key
+
+VERSIONS = [
+    "2.0",
+    "1.0",
+    "2.0rc1",
+    "1.0.post1",
+    "1.0+local",
+    "1.5",
+    "2.0.1",
+    "1.0a1",
+    "git+https://github.com/ddelange/pipgrip.git@abc",
+]
+
+
+def _range(min_=None, max_=None, include_min=True, include_max=False):
+    return Range(
+        min_ and Version.parse(min_),
+        max_ and Version.parse(max_),
+        include_min,
+        include_max,
+    )
+
+
+def test_version_key():
+    versions = [Version.parse(version) for version in VERSIONS]
+    assert sorted(versions, key=version_key) == sorted(versions)
+
+
+@pytest.mark.parametrize(
+    "constraint",
+    [
+        None,
+        _range(),
+        _range("1.0", "2.0"),
+        _range("1.0", "2.0", include_min=False, include_max=True),
+        _range("1.0", "1.0", include_max=True),
+        _range("2.0rc1"),
+        _range(max_="1.0"),
+        _range("1.0", "1.5").union(_range("2.0", "2.0", include_max=True)),
+        _range("3.0"),
+        _range("1.0", "1.0", include_min=False),
+        _range(
+            "git+https://github.com/ddelange/pipgrip.git@abc",
+            "git+https://github.com/ddelange/pipgrip.git@abc",
+            include_max=True,
+        ),
+    ],
+)
+def test_candidates(constraint):
+    versions = [Version.parse(version) for version in VERSIONS]
+    sorted_versions = SortedVersions()
+    for version in versions:
+        sorted_versions.add(version)
+    assert len(sorted_versions) == len(VERSIONS)
+
+    candidates = sorted_versions.candidates(constraint)
+    assert candidates == sorted(candidates, reverse=True)
+    assert len(set(candidates)) == len(candidates)
+    # candidates are a superset of the versions constraint allows
+    allowed = [
+        version
+        for version in sorted(versions, reverse=True)
+        if constraint is None
+        or constraint.allows_any(Range(version, version, True, True))
+    ]
+    assert [version for version in candidates if version in allowed] == allowed
+
+
+def test_candidates_are_bounded():
+    sorted_versions = SortedVersions()
+    for version in VERSIONS:
+        sorted_versions.add(Version.parse(version))
+
+    candidates = sorted_versions.candidates(_range("1.5", "2.0"))
+    # vcs versions are always candidates
+    assert [str(version) for version in candidates] == [
+        VERSIONS[-1],
+        "2.0",
+        "2.0rc1",
+        "1.5",
+    ]
+    assert sorted_versions.candidates(Range().difference(Range())) == []
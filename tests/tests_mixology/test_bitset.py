@@ -0,0 +1,201 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+import pytest
+
+from pipgrip.libs.mixology.bitset import VersionUniverse, set_version_bitsets
+from pipgrip.libs.mixology.constraint import Constraint
+from pipgrip.libs.mixology.package import Package
+from pipgrip.libs.mixology.range import Range
+from pipgrip.libs.mixology.union import Union
+from pipgrip.libs.semver import Version
+from tests.tests_mixology.helpers import check_solver_result
+
+
+def _range(min_=None, max_=None, include_min=False, include_max=False):
+    return Range(
+        Version.parse(min_) if min_ else None,
+        Version.parse(max_) if max_ else None,
+        include_min,
+        include_max,
+    )
+
+
+def _version(version):
+    return _range(version, version, True, True)
+
+
+@pytest.fixture
+def bitsets():
+    set_version_bitsets(True)
+    yield
+    set_version_bitsets(False)
+
+
+def test_version_universe_masks():
+    universe = VersionUniverse()
+    assert universe.add_bounds(_range("1.0.0", "2.0.0", True))
+    assert universe.add_bounds(_version("1.5.0"))
+    assert universe.full == 0b1111111
+
+    # gap, 1.0.0, gap, 1.5.0, gap, 2.0.0, gap from the lowest bit up
+    assert universe.mask(_range("1.0.0", "2.0.0", True)) == 0b0011110
+    assert universe.mask(_version("1.5.0")) == 0b0001000
+    assert universe.mask(_range(max_="1.5.0")) == 0b0000111
+    assert universe.mask(Union.of(_range(max_="1.0.0"), _range("2.0.0"))) == 0b1000001
+    assert universe.mask(Range()) == universe.full
+
+    # a bound that was not added
+    assert universe.mask(_range("3.0.0", include_min=True)) is None
+
+
+@pytest.mark.parametrize(
+    "constraint",
+    [
+        Range(include_min=True),
+        _range("2.0.0", "1.0.0", True),
+        _range("1.0.0", "1.0.0", True),
+    ],
+)
+def test_version_universe_unsupported(constraint):
+    universe = VersionUniverse()
+    assert not universe.add_bounds(constraint)
+    assert universe.generation == 0
+
+
+def test_version_universe_isolated_prerelease():
+    universe = VersionUniverse()
+    assert universe.add_bounds(_version("1.0.0b1"))
+    assert universe.mask(_version("1.0.0b1")) is None
+    assert universe.mask(_range("1.0.0b1", include_min=True)) == 0b110
+
+
+def test_version_universe_touching_ranges():
+    universe = VersionUniverse()
+    union = Union.of(_range("1.0.0", "3.0.0"), _version("3.0.0a1"))
+    assert [str(range_) for range_ in union.ranges] == [">1.0.0,<3.0.0", "3.0.0a1"]
+    assert universe.add_bounds(union)
+    assert universe.mask(union) is None
+
+
+@pytest.mark.parametrize(
+    "a, b",
+    [
+        (_range("1.0.0", "2.0.0", True), _range("1.5.0", include_min=True)),
+        (
+            _range("1.0.0", "2.0.0", True),
+            Union.of(_range(max_="1.0.0"), _range("3.0.0", include_min=True)),
+        ),
+        (_version("1.5.0"), _range("1.0.0", "2.0.0", True)),
+        (_range(max_="1.0.0"), _range("1.0.0", include_min=True)),
+        (Range(), Union.of(_range(max_="1.5.0"), _range("1.5.0"))),
+        (_range("1.0.0b1", "2.0.0", True), _range("1.0.0", include_min=True)),
+        # a union that Union.of leaves apart around a pre-release version
+        (
+            _range(max_="3.0.0", include_max=True),
+            Union.of(_range("1.0.0", "3.0.0"), _version("3.0.0a1"), _version("3.0.0")),
+        ),
+    ],
+)
+def test_constraint_operations(bitsets, a, b):
+    package = Package("a")
+
+    def operations():
+        left = Constraint(package, a)
+        right = Constraint(package, b)
+        return [
+            left.allows_all(right),
+            left.allows_any(right),
+            str(left.inverse),
+            str(left.difference(right)),
+            str(left.intersect(right)),
+            str(left.union(right)),
+            left.intersect(right).is_empty(),
+            left.difference(right).is_empty(),
+            str(right.difference(left)),
+            left.union(right).allows_all(right.difference(left)),
+        ]
+
+    with_bitsets = operations()
+    set_version_bitsets(False)
+    assert with_bitsets == operations()
+
+
+def test_constraint_operations_are_lazy(bitsets):
+    package = Package("a")
+    left = Constraint(package, _range("1.0.0", "2.0.0", True))
+    right = Constraint(package, _range("1.5.0", include_min=True))
+
+    intersection = left.intersect(right)
+    assert intersection._operation is not None
+    assert not intersection.is_empty()
+    assert left.allows_all(intersection)
+    assert intersection._operation is not None
+
+    assert str(intersection) == "a (>=1.5.0,<2.0.0)"
+    assert intersection._operation is None
+
+
+def test_solver_with_bitsets(bitsets, source):
+    source.root_dep("foo", "1.0.0")
+    source.root_dep("bar", "1.0.0")
+
+    source.add("foo", "1.0.0", deps={"shared": ">=2.0.0 <3.0.0"})
+    source.add("bar", "1.0.0", deps={"shared": ">=2.9.0 <4.0.0"})
+    source.add("shared", "2.5.0")
+    source.add("shared", "3.5.0")
+
+    error = """\
+Because no versions of shared match >=2.9.0,<3.0.0
+ and bar (1.0.0) depends on shared (>=2.9.0 <4.0.0), bar (1.0.0) requires shared (>=3.0.0,<4.0.0).
+And because foo (1.0.0) depends on shared (>=2.0.0 <3.0.0), bar (1.0.0) is incompatible with foo (1.0.0).
+So, because root depends on both foo (1.0.0) and bar (1.0.0), version solving failed."""
+
+    check_solver_result(source, error=error)
+
+
+def test_solver_backtracking_with_bitsets(bitsets, source):
+    source.root_dep("c", "*")
+    source.root_dep("y", "^2.0.0")
+
+    source.add("a", "1.0.0", deps={"x": ">=1.0.0"})
+    source.add("b", "1.0.0", deps={"x": "<2.0.0"})
+
+    source.add("c", "1.0.0")
+    source.add("c", "2.0.0", deps={"a": "*", "b": "*"})
+
+    source.add("x", "0.0.0")
+    source.add("x", "1.0.0", deps={"y": "1.0.0"})
+    source.add("x", "2.0.0")
+
+    source.add("y", "1.0.0")
+    source.add("y", "2.0.0")
+
+    check_solver_result(source, {"c": "1.0.0", "y": "2.0.0"}, tries=2)
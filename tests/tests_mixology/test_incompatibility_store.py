@@ -0,0 +1,87 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+import pytest
+
+from pipgrip.libs.mixology.incompatibility_store import IncompatibilityStore
+from pipgrip.libs.mixology.package import Package
+from pipgrip.libs.mixology.version_solver import VersionSolver
+from pipgrip.libs.semver import Version
+
+
+def test_incompatibilities_are_stored_once(source):
+    source.add("a", "1.0.0", deps={"b": "^1.0.0", "c": "^1.0.0 || ^3.0.0"})
+    a, b, c = Package("a"), Package("b"), Package("c")
+    version = Version.parse("1.0.0")
+
+    store = IncompatibilityStore()
+    first = source.incompatibilities_for(a, version)
+    for incompatibility in first + first[:1]:
+        store.add(incompatibility)
+
+    assert store.for_package(a) == first
+    assert store.for_package(b) == first[:1]
+    assert store.for_package(c) == first[1:]
+    assert store.position(a, first[1]) == 1
+    assert store.position(c, first[1]) == 0
+    with pytest.raises(KeyError):
+        store.for_package(Package("d"))
+
+    # incompatibilities created again are stored again, like the solver always did
+    again = source.incompatibilities_for(a, version)
+    store.add(again[0])
+    assert store.for_package(b) == [first[0], again[0]]
+
+
+def test_solver_stores_incompatibilities_once(source):
+    source.root_dep("a", "*")
+    source.root_dep("b", "*")
+
+    source.add("a", "2.0.0", deps={"c": "^1.0.0"})
+    source.add("a", "1.0.0")
+    source.add("b", "2.0.0", deps={"c": "^3.0.0"})
+    source.add("b", "1.0.0", deps={"c": "^2.0.0"})
+    source.add("c", "3.0.0")
+    source.add("c", "2.0.0")
+    source.add("c", "1.0.0")
+
+    solver = VersionSolver(source)
+    result = solver.solve()
+    assert {str(p): str(v) for p, v in result.decisions.items()} == {
+        "_root_": "0.0.0",
+        "a": "1.0.0",
+        "b": "2.0.0",
+        "c": "3.0.0",
+    }
+    for package in (Package("a"), Package("b"), Package("c")):
+        incompatibilities = solver._incompatibilities.for_package(package)
+        assert len(incompatibilities) == len(set(incompatibilities))
@@ -0,0 +1,89 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+from pipgrip.libs.mixology.constraint import Constraint
+from pipgrip.libs.mixology.incompatibility import Incompatibility
+from pipgrip.libs.mixology.incompatibility_cause import DependencyCause
+from pipgrip.libs.mixology.package import Package
+from pipgrip.libs.mixology.partial_solution import PartialSolution
+from pipgrip.libs.mixology.range import Range
+from pipgrip.libs.mixology.term import Term
+from pipgrip.libs.semver import Version
+
+
+def _term(name, min_, max_, is_positive=True):
+    version_range = Range(Version.parse(min_), Version.parse(max_), True)
+    return Term(Constraint(Package(name), version_range), is_positive)
+
+
+def test_backtrack_restores_terms_in_order():
+    cause = Incompatibility([_term("a", "1.0.0", "2.0.0")], DependencyCause())
+    solution = PartialSolution()
+    solution.decide(Package("a"), Version.parse("1.0.0"))
+    solution.derive(_term("b", "1.0.0", "3.0.0").constraint, False, cause)
+    solution.derive(_term("c", "1.0.0", "3.0.0").constraint, True, cause)
+    solution.decide(Package("c"), Version.parse("1.0.0"))
+    solution.derive(_term("b", "3.0.0", "4.0.0").constraint, True, cause)
+    solution.derive(_term("d", "1.0.0", "3.0.0").constraint, True, cause)
+    solution.derive(_term("c", "1.0.0", "2.0.0").constraint, True, cause)
+
+    assert [str(p) for p in solution._positive] == ["a", "c", "b", "d"]
+    c_term = _term("c", "1.0.0", "1.5.0")
+    assert solution.satisfier(c_term).is_decision()
+
+    assert solution.backtrack(1) == {Package("b"), Package("d")}
+    # c was added before b, and b is only excluded again
+    assert [str(p) for p in solution._positive] == ["a", "c"]
+    assert [str(p) for p in solution._negative] == ["b"]
+    assert solution.satisfier(_term("c", "1.0.0", "4.0.0")).index == 2
+
+
+def test_unsatisfied():
+    cause = Incompatibility([_term("a", "1.0.0", "2.0.0")], DependencyCause())
+    solution = PartialSolution()
+    solution.derive(_term("a", "1.0.0", "2.0.0").constraint, True, cause)
+    solution.derive(_term("b[x]", "1.0.0", "2.0.0").constraint, True, cause)
+    solution.derive(_term("c", "1.0.0", "2.0.0").constraint, False, cause)
+    assert [str(t.package) for t in solution.unsatisfied] == ["a", "b"]
+
+    solution.decide(Package("a"), Version.parse("1.0.0"))
+    # the decision for b lacks the required extra
+    solution.decide(Package("b"), Version.parse("1.0.0"))
+    assert [t.package.req.extras_name for t in solution.unsatisfied] == ["b[x]"]
+    solution.decide(Package("b[x]"), Version.parse("1.0.0"))
+    assert solution.unsatisfied == []
+
+    solution.backtrack(1)
+    assert [t.package.req.extras_name for t in solution.unsatisfied] == ["b[x]"]
+    # like _positive, packages restored by backtracking move to the end
+    solution.backtrack(0)
+    assert [str(t.package) for t in solution.unsatisfied] == ["b", "a"]
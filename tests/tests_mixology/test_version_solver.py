@@ -0,0 +1,196 @@
+# BSD 3-Clause License
+#
+# Copyright (c) 2020 - 2024, ddelange, <ddelange@delange.dev>
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the following disclaimer in the documentation
+#    and/or other materials provided with the distribution.
+#
+# 3. Neither the name of the copyright holder nor the names of its
+#    contributors may be used to endorse or promote products derived from
+#    this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# SPDX-License-Identifier: BSD-3-Clause
+from typing import List
+
+import pytest
+
+from pipgrip.libs.mixology.constraint import Constraint
+from pipgrip.libs.mixology.incompatibility import Incompatibility
+from pipgrip.libs.mixology.incompatibility_cause import RootCause
+from pipgrip.libs.mixology.package import Package
+from pipgrip.libs.mixology.range import Range
+from pipgrip.libs.mixology.term import Term
+from pipgrip.libs.mixology.version_solver import CACHED_HEURISTIC, VersionSolver
+from tests.tests_mixology.package_source import PackageSource
+
+
+class RevisionedPackageSource(PackageSource):
+    def __init__(self):  # type: () -> None
+        self._revisions = {}
+        self._changed = set()
+        super(RevisionedPackageSource, self).__init__()
+
+    def add(self, name, version, deps=None):
+        super(RevisionedPackageSource, self).add(name, version, deps=deps)
+        self._revisions[name] = self._revisions.get(name, 0) + 1
+        self._changed.add(name)
+
+    def metadata_revision(self, package):
+        return self._revisions.get(package, 0)
+
+    def take_metadata_changes(self):
+        changed, self._changed = self._changed, set()
+        return changed
+
+
+def _start(solver):  # type: (VersionSolver) -> VersionSolver
+    # decide the root package, leaving its dependencies unsatisfied
+    root = solver._source.root
+    solver._add_incompatibility(
+        Incompatibility([Term(Constraint(root, Range()), False)], RootCause())
+    )
+    solver._propagate(root)
+    solver._propagate(solver._choose_package_version())
+    return solver
+
+
+def test_next_term_to_try():
+    source = RevisionedPackageSource()
+    source.root_dep("a", "*")
+    source.root_dep("b", "*")
+    source.root_dep("c", ">=2.0.0")
+    for version in ["1.0.0", "2.0.0"]:
+        source.add("a", version)
+        source.add("c", version, deps={"a": "*"})
+    for version in ["1.0.0", "2.0.0", "3.0.0"]:
+        source.add("b", version)
+
+    solver = _start(VersionSolver(source))
+
+    priorities = []
+    get_priority = solver._get_priority
+    solver._get_priority = lambda term: priorities.append(term) or get_priority(term)
+
+    # c has a single version left, but a dependency
+    assert str(solver._next_term_to_try().package) == "c"
+    assert len(priorities) == 3
+    # priorities are cached until a term or its package's metadata change
+    assert str(solver._next_term_to_try().package) == "c"
+    assert len(priorities) == 3
+
+    source.add("c", "3.0.0", deps={"a": "*"})
+    source.add("c", "4.0.0", deps={"a": "*"})
+    assert str(solver._next_term_to_try().package) == "a"
+    assert len(priorities) == 4
+
+    # at a tie, the first unsatisfied term is chosen
+    assert [str(term.package) for term in solver.solution.unsatisfied] == [
+        "c",
+        "b",
+        "a",
+    ]
+    source.add("a", "3.0.0")
+    assert str(solver._next_term_to_try().package) == "b"
+    source.add("b", "0.1.0")
+    source.add("b", "0.2.0")
+    assert str(solver._next_term_to_try().package) == "a"
+    assert [str(term.package) for term in priorities[4:]] == ["a", "b"]
+
+
+class PartiallyKnownPackageSource(PackageSource):
+    def __init__(self, unknown):  # type: (List[str]) -> None
+        self.unknown = unknown
+        super(PartiallyKnownPackageSource, self).__init__()
+
+    def known_versions_for(self, package, constraint=None):
+        if str(package) in self.unknown:
+            return None
+        return self.versions_for(package, constraint)
+
+
+def test_next_term_to_try_cached_heuristic():
+    source = PartiallyKnownPackageSource(unknown=["a"])
+    source.root_dep("b", "*")
+    source.root_dep("a", "*")
+    source.root_dep("c", "*")
+    source.root_dep("d", "*")
+    source.add("a", "1.0.0")
+    source.add("b", "1.0.0")
+    source.add("b", "2.0.0")
+    source.add("c", "1.0.0")
+    source.add("c", "2.0.0")
+    source.add("d", "1.0.0", deps={"a": "*"})
+
+    solver = _start(VersionSolver(source, heuristic=CACHED_HEURISTIC))
+    assert [str(term.package) for term in solver.solution.unsatisfied] == [
+        "d",
+        "c",
+        "a",
+        "b",
+    ]
+    # fewest versions, then dependencies, then by name, with unknown packages last
+    assert str(solver._next_term_to_try().package) == "d"
+    solver._propagate(solver._choose_package_version())
+    assert str(solver._next_term_to_try().package) == "b"
+    solver._propagate(solver._choose_package_version())
+    assert str(solver._next_term_to_try().package) == "c"
+    solver._propagate(solver._choose_package_version())
+    assert str(solver._next_term_to_try().package) == "a"
+
+    with pytest.raises(ValueError):
+        VersionSolver(source, heuristic="unknown")
+
+
+def test_propagate_visits_pending_incompatibilities():
+    source = RevisionedPackageSource()
+    source.root_dep("a", "*")
+    source.root_dep("b", "*")
+    source.add("a", "1.0.0", deps={"b": "^1.0.0"})
+    source.add("b", "1.0.0")
+    source.add("b", "2.0.0")
+
+    solver = _start(VersionSolver(source))
+    visits = []  # type: List[str]
+    propagate_incompatibility = solver._propagate_incompatibility
+    solver._propagate_incompatibility = lambda incompatibility: (
+        visits.append(str(incompatibility))
+        or propagate_incompatibility(incompatibility)
+    )
+
+    # nothing changed for the watched packages since the last propagation
+    solver._propagate(source.root)
+    assert visits == []
+
+    # deciding a revisits the incompatibilities watching a, and the new one
+    # deriving b revisits those of b
+    solver._propagate(solver._choose_package_version())
+    assert visits == [
+        "a (1.0.0) depends on b (^1.0.0)",
+        "root depends on a (*)",
+        "a (1.0.0) depends on b (^1.0.0)",
+        "root depends on b (*)",
+    ]
+    del visits[:]
+    for package in (source.root, Package("a"), Package("b")):
+        solver._propagate(package)
+    assert visits == []